@@ -1,25 +1,28 @@
 # -*- coding: utf-8 -*-
+# 每次调用插件都是一个新进程，模块顶层只导入各模式共用的部分，
+# 其余模块（pickle/threading/video_library 等）在用到的函数里导入，避免拖慢与之无关的模式
+import time
+_STARTED = time.perf_counter()
+
 import os
 import sys
-import urllib.parse
 import json
-import time
-import threading
-import pickle
-import base64
+import urllib.parse
 
 import xbmc
 import xbmcgui
 import xbmcplugin
 
-from lib.common import ADDON_PATH, ADDON_DATA_PATH, get_setting, get_skin_name, jsonrpc_request, notification, log
-from lib import video_library as library
-from lib.playlist_library import get_autoplay_next_values, set_autoplay_next_values
+from lib.common import ADDON_PATH, ADDON_DATA_PATH, SKIP_DATA_CHANGED, get_addon, get_setting, get_skin_name, jsonrpc_request, notification, notify_service, log
+from lib.skip_store import get_store as get_skip_store
 
 if not os.path.exists(ADDON_DATA_PATH):
     os.makedirs(ADDON_DATA_PATH)
-SKIP_DATA_FILE = os.path.join(ADDON_DATA_PATH, 'skip_intro_data.json')
 WINDOW_CACHE_FILE = os.path.join(ADDON_DATA_PATH, 'window_cache.pickle')
+# 分页浏览的结果游标：保存本次查询的完整结果，翻页时直接从这里取，不再重复查询
+FILTER_CURSOR_FILE = os.path.join(ADDON_DATA_PATH, 'filter_cursor.pickle')
+# 加载更多时容器整体刷新，最多输出最近这么多条目（按整页计），更早的页不再重复生成
+MAX_RENDERED_ITEMS = 240
 try:
     HANDLE = int(sys.argv[1])
 except (IndexError, ValueError):
@@ -27,6 +30,10 @@ except (IndexError, ValueError):
 
 
 def prefetch_data_for_window():
+    import base64
+    import pickle
+    from lib import video_library as library
+
     try:
         log("Starting window prefetch...")
         # 1. Load state from Skin
@@ -40,22 +47,13 @@ def prefetch_data_for_window():
                 log(f"Error loading state blob: {e}")
 
         # 2. Convert state to filters
-        filters = {}
-        for group, item in filter_state.items():
-            if group == 'filter.rating':
-                for obj in item:
-                    val = obj.get('value')
-                    if val:
-                        filters[f"{group}.{val}"] = True
-            else:
-                val = item.get('value')
-                if val is not None:
-                    filters[group] = val
+        filters, _ = library.filters_from_state(filter_state)
         
         # 3. Fetch items
         log(f"Prefetching with filters: {filters}")
         filter_limit = int(get_setting('filter_limit') or 300)
         items = library.jsonrpc_get_items(filters=filters, limit=filter_limit)
+        library.prepare_render_records(items)
         
         # 4. Save to cache
         with open(WINDOW_CACHE_FILE, 'wb') as f:
@@ -66,23 +64,6 @@ def prefetch_data_for_window():
     except Exception as e:
         log(f"Error in prefetch_data_for_window: {e}")
 
-def load_skip_data():
-    if not os.path.exists(SKIP_DATA_FILE):
-        return {}
-    try:
-        with open(SKIP_DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except Exception as e:
-        log(f"Error loading skip data: {e}")
-        return {}
-
-def save_skip_data(data):
-    try:
-        with open(SKIP_DATA_FILE, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        log(f"Error saving skip data: {e}")
-
 def get_current_tvshow_info():
     try:
         # 使用 JSON-RPC 获取可靠的 ID 和标题
@@ -156,6 +137,7 @@ def ensure_autoplay_next_setting_after_mark(tvshow_id):
         required_value = 2
         required_label = "剧集"
 
+    from lib.playlist_library import get_autoplay_next_values, set_autoplay_next_values
     current_values = get_autoplay_next_values()
     if required_value in current_values:
         return
@@ -246,27 +228,11 @@ def record_skip_point():
             return
 
         percentage = (current_time / total_time) * 100
-        data = load_skip_data()
-        
-        if tvshow_id not in data:
-            data[tvshow_id] = {"title": show_title, "seasons": {}}
-        elif "time" in data[tvshow_id]:
-            # 迁移旧格式
-            old_time = data[tvshow_id]["time"]
-            data[tvshow_id] = {"title": show_title, "seasons": {"1": {"intro": old_time}}}
-            del data[tvshow_id]["time"]
-        
-        if "seasons" not in data[tvshow_id]:
-            data[tvshow_id]["seasons"] = {}
-            
-        data[tvshow_id]["title"] = show_title 
-        
-        # 获取现有的季数据
-        season_data = data[tvshow_id]["seasons"].get(season, {})
-        # 处理旧格式（如果只是一个数字）
-        if isinstance(season_data, (int, float)):
-            season_data = {"intro": season_data}
-            
+        store = get_skip_store()
+
+        # 获取现有的季数据（旧格式由存储层统一转换）
+        season_data = store.get_season(tvshow_id, season) or {}
+
         msg = ""
         if percentage < 20:
             season_data["intro"] = current_time
@@ -283,11 +249,12 @@ def record_skip_point():
             notification("请在剧集前或后20%时间段内调用", sound=True)
             return
 
-        data[tvshow_id]["seasons"][season] = season_data
-        save_skip_data(data)
+        if not store.set_season(tvshow_id, season, season_data, title=show_title):
+            notification("无法记录请查阅日志", sound=True)
+            return
         
         # 通知 service 重新加载数据
-        xbmcgui.Window(10000).setProperty("MFG.Reload", "true")
+        notify_service(SKIP_DATA_CHANGED)
         
         notification(f"{msg} (第{season}季)")
         log(f"Recorded skip point for {show_title} Season {season}: {season_data}")
@@ -312,16 +279,12 @@ def delete_skip_point():
             return
 
         percentage = (current_time / total_time) * 100
-        data = load_skip_data()
-        
-        if tvshow_id not in data or "seasons" not in data[tvshow_id] or season not in data[tvshow_id]["seasons"]:
+        store = get_skip_store()
+        season_data = store.get_season(tvshow_id, season)
+        if season_data is None:
             notification("无片头片尾标记点", sound=True)
             return
 
-        season_data = data[tvshow_id]["seasons"][season]
-        if isinstance(season_data, (int, float)):
-             season_data = {"intro": season_data}
-
         msg = ""
         if percentage < 20:
             if "intro" in season_data:
@@ -339,19 +302,13 @@ def delete_skip_point():
             notification("删除失败 请在剧集前或后20%时间段内调用", sound=True)
             return
 
-        # Clean up empty dicts
-        if not season_data:
-            del data[tvshow_id]["seasons"][season]
-        else:
-            data[tvshow_id]["seasons"][season] = season_data
-            
-        if not data[tvshow_id]["seasons"]:
-            del data[tvshow_id]
-
-        save_skip_data(data)
+        # 季数据为空时存储层会删除该季，剧集没有剩余的季时一并删除
+        if not store.set_season(tvshow_id, season, season_data):
+            notification("删除错误", sound=True)
+            return
         
         # 通知 service 重新加载数据
-        xbmcgui.Window(10000).setProperty("MFG.Reload", "true")
+        notify_service(SKIP_DATA_CHANGED)
         notification(msg)
         
     except Exception as e:
@@ -689,6 +646,8 @@ def set_home_background(image):
         notification("背景已重置, 全局背景已恢复默认")
 
 def launch_t9():
+    import threading
+
     log("Launching T9 Input Window")
     # Start prefetch thread immediately
     threading.Thread(target=prefetch_data_for_window).start()
@@ -710,9 +669,9 @@ def launch_t9():
         horizon_xml = 'Custom_5111_MovieFilter_Horizon.xml'
         horizon_xml_path = os.path.join(base_dir, horizon_xml)
         
-        if not os.path.exists(horizon_xml_path):
+        src_xml_path = os.path.join(base_dir, xml_file)
+        if not os.path.exists(horizon_xml_path) or os.path.getmtime(horizon_xml_path) < os.path.getmtime(src_xml_path):
             log("Generating Horizon specific XML...")
-            src_xml_path = os.path.join(base_dir, xml_file)
             try:
                 with open(src_xml_path, 'r', encoding='utf-8') as f:
                     content = f.read()
@@ -738,12 +697,127 @@ def launch_t9():
 
     del w
 
+def get_page_size():
+    try:
+        return max(6, int(get_setting('page_size') or 60))
+    except ValueError:
+        return 60
+
+def save_filter_cursor(cursor, items):
+    import pickle
+    # 先写临时文件再替换，下一次插件调用读取时不会遇到写了一半的游标
+    tmp_path = FILTER_CURSOR_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"cursor": cursor, "items": items}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, FILTER_CURSOR_FILE)
+    except Exception as e:
+        log(f"Error saving filter cursor: {e}")
+
+def load_filter_cursor(cursor):
+    import pickle
+    try:
+        with open(FILTER_CURSOR_FILE, 'rb') as f:
+            data = pickle.load(f)
+        if data.get("cursor") == cursor:
+            return data.get("items")
+        log(f"Filter cursor mismatch: expected {cursor}, found {data.get('cursor')}")
+    except Exception as e:
+        log(f"Error loading filter cursor: {e}")
+    return None
+
+def create_load_more_item(cursor, next_page, remaining):
+    """列表末尾的“加载更多”占位项，点击后由皮肤把 ReloadID 切换为下一页。"""
+    li = xbmcgui.ListItem(label=get_addon().getLocalizedString(32041).format(remaining))
+    li.setArt({"poster": os.path.join(ADDON_PATH, "icon.png"), "thumb": os.path.join(ADDON_PATH, "icon.png")})
+    li.setProperty("IsPlayable", "false")
+    li.setProperty("MFG.LoadMore", "true")
+    li.setProperty("MFG.NextReload", f"page_{cursor}_{next_page}")
+    url = f"plugin://plugin.video.filteredmovies/?mode=filter_list&reload=page_{cursor}_{next_page}"
+    return li, url, False
+
+def first_rendered_page(pages, page_size):
+    """加载到第 pages 页时容器中输出的第一页，保证输出的条目不超过 MAX_RENDERED_ITEMS。"""
+    kept_pages = max(1, MAX_RENDERED_ITEMS // page_size)
+    return max(1, pages - kept_pages + 1)
+
+def add_filter_items(items, cursor, pages=1, started=None):
+    """
+    输出到第 pages 页的条目，剩余的部分用“加载更多”占位，返回 (输出的条目数, 是否新生成了渲染记录)。
+    插件目录刷新会整体替换容器，翻页时新一页之前的条目也要重新输出，
+    因此只保留从 first_rendered_page 开始的最近几页，每次翻页的耗时不随页数增长；
+    已有渲染记录的条目只重建 ListItem。
+    Kodi 要到 endOfDirectory 才会显示列表，因此所有条目一次交给 addDirectoryItems，
+    并记录生成条目和全部完成的耗时（从 started 起算）。
+    """
+    from lib import video_library as library
+
+    if started is None:
+        started = time.time()
+    page_size = get_page_size()
+    end = page_size * pages
+    visible = items[page_size * (first_rendered_page(pages, page_size) - 1):end]
+    remaining = max(0, len(items) - end)
+    total_hint = len(visible) + (1 if remaining > 0 else 0)
+    records_before = [m.get("_render") for m in visible]
+
+    entries = list(library.iter_list_items(visible))
+    if remaining > 0:
+        li, url, is_folder = create_load_more_item(cursor, pages + 1, remaining)
+        entries.append((url, li, is_folder))
+    built = time.time()
+    xbmcplugin.addDirectoryItems(HANDLE, entries, total_hint)
+    count = len(entries)
+
+    # cacheToDisc=False 确保每次刷新都不保留之前的焦点位置，从而回到开头
+    xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+    finished = time.time()
+    log(f"List timing: items built {(built - started) * 1000:.0f}ms, "
+        f"complete {(finished - started) * 1000:.0f}ms, {count} items")
+    rendered = any(m.get("_render") is not before for m, before in zip(visible, records_before))
+    return count, rendered
+
+def load_more_filter_items(reload_param):
+    started = time.time()
+    # page_<cursor>_<page>，cursor 本身可能包含下划线，因此从右侧拆分
+    try:
+        cursor, page = reload_param[len("page_"):].rsplit("_", 1)
+        pages = max(1, int(page))
+    except ValueError:
+        log(f"Invalid page reload param: {reload_param}")
+        xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+        return
+
+    items = load_filter_cursor(cursor)
+    if items is None:
+        xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+        return
+
+    count, rendered = add_filter_items(items, cursor, pages, started)
+    # 只有新一页附加了渲染记录时才重写游标，条目未变化时不再重复 pickle
+    if rendered:
+        save_filter_cursor(cursor, items)
+    # 保持焦点在新一页的第一个条目上
+    page_size = get_page_size()
+    xbmc.sleep(100)
+    xbmc.executebuiltin(f"SetFocus(9999,{page_size * (pages - first_rendered_page(pages, page_size))})")
+    log(f"Filtered list page {pages} populated from cursor {cursor}, {count} items")
+
 def filter_list(reload_param):
+    import pickle
+
+    started = time.time()
     # 先清空，再填充新的，保证页面永远都是显示前两行
     if reload_param.startswith("clear_"):
         xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
         return
 
+    if reload_param.startswith("page_"):
+        load_more_filter_items(reload_param)
+        return
+
+    cursor = str(time.time())
+
     # Check cache if first load
     if reload_param.startswith("first_"):
         # Wait for cache file (max 1000ms)
@@ -760,14 +834,8 @@ def filter_list(reload_param):
 
             log(f"Loaded {len(items)} items from window cache.")
             
-            list_items = []
-            for m in items:
-                li, url, is_folder = library.create_list_item(m)
-                if li:
-                    list_items.append((url, li, is_folder))
-            
-            xbmcplugin.addDirectoryItems(HANDLE, list_items, len(list_items))
-            xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+            add_filter_items(items, cursor, started=started)
+            save_filter_cursor(cursor, items)
             try: os.remove(WINDOW_CACHE_FILE)
             except: pass
             return
@@ -777,7 +845,9 @@ def filter_list(reload_param):
             except: pass
 
     import base64
-    
+    from lib import video_library as library
+    from lib import result_cache
+
     # 1. Load state from Skin
     filter_state = {}
     blob = xbmc.getInfoLabel('Skin.String(MFG.State)')
@@ -788,57 +858,34 @@ def filter_list(reload_param):
         except Exception as e:
             log(f"Error loading state blob: {e}")
 
-    # 2. Convert state to filters
-    filters = {}
-    for group, item in filter_state.items():
-        if group == 'filter.rating':
-            for obj in item:
-                val = obj['value']
-                if val:
-                    filters[f"{group}.{val}"] = True
-        else:
-            val = item['value']
-            if val is not None:
-                filters[group] = val
-
-    # 3. T9 Input
+    # 2. Convert state to filters（含 T9 输入，有输入时只保留影视范围、排序和 T9 条件）
     t9_input = xbmcgui.Window(10000).getProperty("MFG.T9Input")
-    filter_limit = int(get_setting('filter_limit') or 300)
-    search_limit = int(get_setting('search_limit') or 72)
-    limit = filter_limit
-    if t9_input:
-        t9_digits = "".join(ch for ch in str(t9_input) if ch.isdigit())
-        if t9_digits or t9_input.strip():
-                # 纯数字输入加 | 前缀避免与原始标题内容误匹配，含字母时直接传递
-                t9_value = t9_input.strip()
-                if t9_value.isdigit():
-                    t9_value = f"|{t9_value}"
-                filters["filter.t9"] = t9_value
-                limit = search_limit
-                # 当有T9输入时，只保留影视范围、排序和T9条件
-                keys_to_keep = ["filter.mediatype", "filter.sort", "filter.t9"]
-                filters = {k: v for k, v in filters.items() if k in keys_to_keep}
-
-    # 4. Get Items
-    items = library.jsonrpc_get_items(filters=filters, limit=limit)
-    # 5. Populate List
-    
-    list_items = []
-    for m in items:
-        li, url, is_folder = library.create_list_item(m)
-        if li:
-            list_items.append((url, li, is_folder))
-    
-    xbmcplugin.addDirectoryItems(HANDLE, list_items, len(list_items))
-    # cacheToDisc=False 确保每次刷新都不保留之前的焦点位置，从而回到开头
-    xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+    filters, searching = library.filters_from_state(filter_state, t9_input)
+    if searching:
+        limit = int(get_setting('search_limit') or 72)
+    else:
+        limit = int(get_setting('filter_limit') or 300)
+
+    # 4. Get Items（优先使用筛选窗口后台预取或之前查询过的结果）
+    items, source = result_cache.get(filters, limit)
+    stats = result_cache.record_lookup(source)
+    log(f"Result cache {source or 'miss'}, stats: {stats}")
+    fetched = items is None
+    if fetched:
+        items = library.jsonrpc_get_items(filters=filters, limit=limit)
+    # 5. Populate List (first page only, the rest stays in the cursor)
+    count, _ = add_filter_items(items, cursor, started=started)
+    # 列表输出后再保存，渲染记录已附加在条目上，翻页和再次命中缓存时直接复用
+    save_filter_cursor(cursor, items)
+    if fetched:
+        result_cache.put(filters, limit, items)
     
     if not reload_param.startswith("first_"):
         # 首次加载要的是快,不使用淡入效果
         # 列表加载完成，触发淡入动画
         xbmc.sleep(100)
         xbmcgui.Window(10000).setProperty("MFG.IsRefreshing", "false")
-    log(f"Filtered list populated with {len(list_items)} items")
+    log(f"Filtered list populated with {count} of {len(items)} items")
 
 def set_vs10_mode(target_mode=None):
     try:
@@ -1109,6 +1156,24 @@ def reboot_from_nand():
 
 def router(paramstring):
     log(f"Router called with: {paramstring}")
+    if get_setting('profile_imports') != 'true':
+        dispatch(paramstring)
+        return
+
+    # 统计本次调用的启动耗时：顶层导入在此之前已完成，只能整体计时；各模式内部的导入逐个模块计时
+    from lib import import_profile
+    startup = time.perf_counter() - _STARTED
+    import_profile.install()
+    try:
+        dispatch(paramstring)
+    finally:
+        import_profile.uninstall()
+        label = paramstring or "launch_t9"
+        log(f"Startup for {label}: top-level imports {startup * 1000:.1f}ms, "
+            f"total {(time.perf_counter() - _STARTED) * 1000:.1f}ms")
+        import_profile.report(label)
+
+def dispatch(paramstring):
     if not paramstring:
         launch_t9()
         return
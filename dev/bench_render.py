@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+测量筛选列表生成 ListItem 的速度（每秒条目数），分别统计：
+  cold  - 无渲染记录，逐条计算海报/进度等字段后生成 ListItem
+  warm  - 条目已带有渲染记录（例如来自预取或分页游标），只做生成 ListItem 的循环
+
+在 Kodi 之外运行时使用一个什么都不做的 ListItem 替身，结果只反映 Python 侧的开销。
+
+用法:
+  python dev/bench_render.py
+  python dev/bench_render.py 300 2000 5000
+"""
+import os
+import sys
+import time
+import types
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+
+def install_kodi_placeholders():
+    """Kodi 之外运行时提供最小的 xbmc* 模块，ListItem 的各个 setter 均为空操作。"""
+    try:
+        import xbmcgui  # noqa: F401
+        return False
+    except ImportError:
+        pass
+
+    class _Noop:
+        def __init__(self, *args, **kwargs):
+            pass
+
+        def __getattr__(self, name):
+            return lambda *args, **kwargs: None
+
+    class ListItem(_Noop):
+        def getVideoInfoTag(self):
+            return _Noop()
+
+    class Window(_Noop):
+        properties = {"MFG.LibraryRevision": "1"}
+
+        def getProperty(self, key):
+            return self.properties.get(key, "")
+
+    # 插件数据目录放到临时目录，不在仓库中留下文件
+    data_dir = tempfile.mkdtemp(prefix="mfg_bench_")
+    modules = {
+        "xbmc": {"LOGDEBUG": 0, "LOGINFO": 1, "LOGWARNING": 2, "LOGERROR": 3,
+                 "log": lambda *a, **k: None, "executeJSONRPC": lambda *a: "{}", "Monitor": _Noop},
+        "xbmcgui": {"ListItem": ListItem, "Window": Window},
+        "xbmcaddon": {"Addon": _Noop},
+        "xbmcplugin": {"addDirectoryItems": lambda *a, **k: True, "endOfDirectory": lambda *a, **k: None},
+        "xbmcvfs": {"translatePath": lambda p: data_dir},
+    }
+    for name, attrs in modules.items():
+        module = types.ModuleType(name)
+        module.__dict__.update(attrs)
+        # 其余属性（窗口基类、常量等）一律返回空操作类，保证模块能够导入
+        module.__getattr__ = lambda attr: _Noop
+        sys.modules[name] = module
+    return True
+
+
+def make_items(count):
+    items = []
+    for i in range(count):
+        kind = i % 3
+        if kind == 0:
+            items.append({
+                "media_type": "movie", "movieid": i + 1, "title": f"Movie {i}",
+                "art": {"poster": f"image://poster{i}.jpg/", "fanart": f"image://fanart{i}.jpg/"},
+                "year": 2000 + i % 25, "rating": 7.5, "playcount": 0, "file": f"/movies/{i}.mkv",
+                "resume": {"position": 600, "total": 6000}, "runtime": 6000,
+            })
+        elif kind == 1:
+            items.append({
+                "media_type": "tvshow", "tvshowid": i + 1, "title": f"Show {i}",
+                "art": {"poster": f"image://poster{i}.jpg/"}, "year": 2010, "rating": 8.1,
+                "episode": 24, "watchedepisodes": 6, "partial_progress": 0.4, "lastplayed": "2024-01-01",
+                "file": f"/shows/{i}/",
+            })
+        else:
+            items.append({
+                "media_type": "set", "setid": i + 1, "title": f"Set {i}", "plot": "plot",
+                "art": {"poster": f"image://poster{i}.jpg/"}, "total": 4, "watched": 1, "partial_progress": 0.5,
+                "playcount": 0,
+            })
+    return items
+
+
+def bench(library, count, rounds=5):
+    best_cold = best_warm = float('inf')
+    for _ in range(rounds):
+        items = make_items(count)
+        started = time.perf_counter()
+        library.create_list_items(items)
+        best_cold = min(best_cold, time.perf_counter() - started)
+
+        started = time.perf_counter()
+        library.create_list_items(items)
+        best_warm = min(best_warm, time.perf_counter() - started)
+    return count / best_cold, count / best_warm
+
+
+def main():
+    placeholders = install_kodi_placeholders()
+    from lib import video_library as library
+
+    counts = [int(arg) for arg in sys.argv[1:]] or [300, 2000]
+    if placeholders:
+        print("Running outside Kodi: ListItem calls are no-ops, numbers show Python-side cost only")
+    for count in counts:
+        cold, warm = bench(library, count)
+        print(f"{count:>6} items  cold {cold:>10.0f} items/s  warm {warm:>10.0f} items/s  ({warm / cold:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+测量 default.py 各模式的启动导入耗时。
+
+每个模式在独立的子进程中测量（与 Kodi 每次调用插件都是新进程一致）：
+先导入 default.py 本身，再导入该模式在函数内部用到的模块，按模块输出自身耗时。
+在 Kodi 之外运行时 xbmc* 模块使用 bench_render 中的替身，Kodi 内部模块的开销不计入。
+
+用法:
+  python dev/bench_startup.py
+  python dev/bench_startup.py filter_list launch_t9
+"""
+import os
+import sys
+import subprocess
+import importlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+# 各模式在函数内部导入的模块，与 default.py 中的局部导入保持一致
+MODE_IMPORTS = {
+    "confirm_stop_playback": [],
+    "force_prev": [],
+    "select_playback_speed": ["lib.window_handler"],
+    "select_subtitle": ["lib.media_info", "lib.window_handler"],
+    "record_skip_point": ["lib.playlist_library"],
+    "filter_list": ["pickle", "base64", "lib.video_library", "lib.result_cache"],
+    "launch_t9": ["threading", "base64", "pickle", "lib.video_library", "lib.window_handler"],
+}
+
+
+def run_child(mode):
+    from bench_render import install_kodi_placeholders
+    install_kodi_placeholders()
+
+    from lib import import_profile
+    import_profile.install()
+    importlib.import_module("default")
+    base = sum(cost for _, cost in import_profile.costs())
+    for name in MODE_IMPORTS[mode]:
+        importlib.import_module(name)
+    import_profile.uninstall()
+
+    entries = import_profile.costs()
+    total = sum(cost for _, cost in entries)
+    print(f"{mode}: default.py {base * 1000:.1f}ms, total {total * 1000:.1f}ms in {len(entries)} modules")
+    for name, cost in entries[:12]:
+        print(f"  {cost * 1000:8.1f}ms  {name}")
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--child":
+        run_child(sys.argv[2])
+        return
+
+    modes = sys.argv[1:] or list(MODE_IMPORTS)
+    for mode in modes:
+        if mode not in MODE_IMPORTS:
+            print(f"Unknown mode: {mode}")
+            continue
+        subprocess.run([sys.executable, __file__, "--child", mode],
+                       cwd=os.path.dirname(__file__))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,6 @@
 import os
 import json
-import traceback
+import time
 import xbmc
 import xbmcaddon
 import xbmcgui
@@ -21,10 +21,33 @@ def get_setting(setting_id, addon_id=ADDON_ID):
     return get_addon(addon_id).getSetting(setting_id)
 
 
+class RawJSON:
+    """已序列化的 JSON 片段，作为请求参数时原样嵌入，避免重复序列化。"""
+    __slots__ = ("text",)
+
+    def __init__(self, text):
+        self.text = text
+
+    def __repr__(self):
+        # 出错时记录的请求内容显示实际的 JSON
+        return self.text
+
+
+def dumps_payload(payload):
+    """序列化 JSON-RPC 请求，其中的 RawJSON 片段原样拼接，其余部分逐个用 json.dumps 序列化后组合。"""
+    if isinstance(payload, RawJSON):
+        return payload.text
+    if isinstance(payload, dict):
+        return "{" + ", ".join(f"{json.dumps(str(key))}: {dumps_payload(value)}" for key, value in payload.items()) + "}"
+    if isinstance(payload, (list, tuple)):
+        return "[" + ", ".join(dumps_payload(value) for value in payload) + "]"
+    return json.dumps(payload)
+
+
 def jsonrpc_request(payload):
     """执行 JSON-RPC 请求。单请求返回 result，批量请求返回 list，失败返回 None。"""
     try:
-        request_text = payload if isinstance(payload, str) else json.dumps(payload)
+        request_text = payload if isinstance(payload, str) else dumps_payload(payload)
         response_text = xbmc.executeJSONRPC(request_text)
         response = json.loads(response_text)
 
@@ -33,6 +56,7 @@ def jsonrpc_request(payload):
             if isinstance(payload, dict):
                 method = payload.get("method") or method
             log(f"JSON-RPC error for {method}: {response.get('error')}", xbmc.LOGWARNING)
+            import traceback
             caller_stack = "".join(traceback.format_stack(limit=10)[:-1]).rstrip()
             if caller_stack:
                 log(f"JSON-RPC caller stack for {method}:\n{caller_stack}", xbmc.LOGWARNING)
@@ -44,9 +68,49 @@ def jsonrpc_request(payload):
         return response
     except Exception as e:
         log(f"JSON-RPC call failed for {payload}: {e}", xbmc.LOGERROR)
+        import traceback
         log(traceback.format_exc(), xbmc.LOGERROR)
         return None
 
+def jsonrpc_parallel(payloads, max_workers=4, timings=None):
+    """并发执行相互独立的 JSON-RPC 请求，按 payloads 顺序返回各自的 result，失败项为 None。
+
+    executeJSONRPC 调用期间会释放 GIL，因此总耗时约等于最慢的一个请求，而不是所有请求之和。
+    timings 传入列表时，按 payloads 顺序填入每个请求自身的耗时（秒）。
+    """
+    payloads = list(payloads)
+    if timings is not None:
+        timings[:] = [0.0] * len(payloads)
+
+    def request(index):
+        started = time.time()
+        result = jsonrpc_request(payloads[index])
+        if timings is not None:
+            timings[index] = time.time() - started
+        return result
+
+    if not payloads:
+        return []
+    if len(payloads) == 1:
+        return [request(0)]
+    # 每次插件调用都会导入本模块，线程池只在真正并发请求时才导入
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(payloads))) as executor:
+        return list(executor.map(request, range(len(payloads))))
+
+# default.py 修改片头片尾数据后通知 service 重新加载，service 收到的 method 为 "Other.skip_data_changed"
+SKIP_DATA_CHANGED = "skip_data_changed"
+
+
+def notify_service(message):
+    """通过 JSONRPC.NotifyAll 向 service 的 Monitor.onNotification 发送消息。"""
+    return jsonrpc_request({
+        "jsonrpc": "2.0",
+        "method": "JSONRPC.NotifyAll",
+        "params": {"sender": ADDON_ID, "message": message},
+        "id": "JSONRPC.NotifyAll",
+    })
+
 def get_skin_name():
     # Skin detection logic
     current_skin_id = xbmc.getSkinDir().lower()
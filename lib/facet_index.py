@@ -0,0 +1,675 @@
+# -*- coding: utf-8 -*-
+"""
+类型/地区/年份/评分筛选的本地位图索引。
+
+service 为电影和剧集各维护一份 FacetIndex：每个条目分配一个稠密序号，
+每个筛选按钮对应一个 Python int 位图（第 n 位表示序号 n 的条目命中该按钮）。
+任意筛选组合只需几次按位与/或，再按预排序的序号排列输出结果，无需 Kodi 执行带多表连接的 SQL。
+
+FACET_INDEX_FILE 的格式为 [8 字节头部长度][头部][各类型排序字段][各条目]：
+头部只含位图和预排序序号，插件进程每次调用只读取头部，排序字段在需要现场排序时才读取，
+条目（含海报等展示字段）只读取最终输出的那一页。
+读取方不长期占用文件：Windows 上打开中的文件无法被 os.replace 覆盖，service 保存时会失败。
+"""
+import os
+import json
+import time
+import pickle
+import struct
+import threading
+
+import xbmc
+import xbmcgui
+
+from .common import ADDON_DATA_PATH, jsonrpc_parallel, jsonrpc_request, log
+
+FACET_INDEX_FILE = os.path.join(ADDON_DATA_PATH, 'facet_index.bin')
+_HEADER_SIZE = struct.Struct("<Q")
+# sort_items_locally 可能用到的字段，现场排序时只读取这些字段
+_SORT_FIELDS = ("movieid", "tvshowid", "media_type", "title", "year", "rating", "dateadded", "playcount",
+                "resume", "episode", "watchedepisodes", "lastplayed")
+# service 完成首次构建后设置，插件进程据此判断索引是否可用
+FACET_READY_PROPERTY = "MFG.FacetIndexReady"
+FACET_RECONCILE_INTERVAL = 1800
+# 收到增量通知后等待这么久（秒）没有新通知再统一处理，连续的更新（例如整季标记已看）只重建和保存一次
+FACET_UPDATE_DELAY = 2.0
+
+# 与筛选窗口中各组按钮的取值一致（不含默认按钮）
+FACET_VALUES = {
+    "filter.genre": ["动作", "喜剧", "爱情", "科幻", "犯罪", "冒险", "剧情", "恐怖",
+                     "动画", "战争", "悬疑", "历史", "音乐", "其他"],
+    "filter.region": ["内地", "中国香港", "中国台湾", "美国", "日本", "韩国", "泰国",
+                      "印度", "英国", "法国", "德国", "俄罗斯", "加拿大", "其他"],
+    "filter.year": ["今年", "2020年代", "2010年代", "2000年代", "90年代", "80年代",
+                    "70年代", "60年代", "更早"],
+    "filter.rating": ["10-9", "9-8", "8-7", "7-6", "6分以下"],
+}
+# 评分为多选，同组内取并集；其余组为单选
+_MULTI_SELECT_GROUPS = ("filter.rating",)
+# 这些排序只依赖入库时确定的字段，构建时预先排好序号
+PRESORTED_METHODS = ("year", "rating", "dateadded")
+_SUPPORTED_KEYS = {"filter.mediatype", "filter.sort", "filter.random_seed", "filter.genre", "filter.region", "filter.year"}
+
+_MEDIA_QUERIES = {
+    "movie": {
+        "method": "VideoLibrary.GetMovies",
+        "details": "VideoLibrary.GetMovieDetails",
+        "result_key": "movies",
+        "details_key": "moviedetails",
+        "id_field": "movieid",
+        # 展示字段与 get_movie_items 相同，另加筛选需要的字段
+        "properties": ["title", "art", "dateadded", "rating", "year", "resume", "runtime",
+                       "lastplayed", "playcount", "file", "genre", "country"],
+    },
+    "tvshow": {
+        "method": "VideoLibrary.GetTVShows",
+        "details": "VideoLibrary.GetTVShowDetails",
+        "result_key": "tvshows",
+        "details_key": "tvshowdetails",
+        "id_field": "tvshowid",
+        # 剧集的地区保存在 tag 中
+        "properties": ["title", "art", "dateadded", "rating", "year", "episode", "watchedepisodes",
+                       "lastplayed", "playcount", "file", "genre", "tag"],
+    },
+}
+
+_facet_rules_cache = {}
+
+
+def _facet_key(group, value):
+    return f"{group}.{value}" if group in _MULTI_SELECT_GROUPS else group
+
+
+def facet_rules(media_type):
+    """返回 [(group, value, filter_obj)]，filter_obj 由 build_filter 生成，保证与 Kodi 侧筛选语义一致。"""
+    # “今年”按钮的规则随年份变化
+    cache_key = (media_type, time.localtime().tm_year)
+    rules = _facet_rules_cache.get(cache_key)
+    if rules is None:
+        from .video_library import build_filter
+        rules = []
+        for group, values in FACET_VALUES.items():
+            for value in values:
+                key = _facet_key(group, value)
+                filters = {key: True} if group in _MULTI_SELECT_GROUPS else {key: value}
+                rules.append((group, value, build_filter(filters, media_type=media_type)))
+        _facet_rules_cache.clear()
+        _facet_rules_cache[cache_key] = rules
+    return rules
+
+
+def bit_count(bits):
+    return bin(bits).count("1")
+
+
+def bit_ordinals(bits):
+    """返回位图中所有置位的序号集合。"""
+    return {i for i, c in enumerate(reversed(bin(bits)[2:])) if c == '1'}
+
+
+def is_supported(filters):
+    """筛选条件是否全部落在索引覆盖的维度上（T9、首字母等交给 Kodi）。"""
+    return not unindexed_filters(filters)
+
+
+def unindexed_filters(filters):
+    """索引不覆盖的筛选条件（T9、首字母等）。"""
+    return {
+        key: value for key, value in (filters or {}).items()
+        if not key.startswith("filter.rating.") and key not in _SUPPORTED_KEYS
+    }
+
+
+class _IndexFile:
+    """query_items 调用期间打开的索引文件，按需读取其中的片段，调用返回前关闭。"""
+
+    def __init__(self, f, base):
+        self._file = f
+        self._base = base
+        self._lock = threading.Lock()
+
+    def load(self, span):
+        offset, length = span
+        with self._lock:
+            self._file.seek(self._base + offset)
+            data = self._file.read(length)
+        return pickle.loads(data)
+
+
+class FacetIndex:
+    """
+    单一媒体类型的位图索引。service 中 records 保存完整条目；
+    插件进程从 FACET_INDEX_FILE 读取时 records 为 None，条目和排序字段在 query_items 中按需从文件读取。
+    """
+
+    def __init__(self, media_type):
+        self.media_type = media_type
+        self.records = []        # 序号 -> 条目（删除后为 None）
+        self.ordinals = {}       # 条目 id -> 序号
+        self.alive = 0           # 未删除条目的位图
+        self.bitsets = {}        # (group, value) -> 位图
+        self.permutations = {}   # 排序方式 -> 按该方式降序排列的序号列表
+        # 以下仅在插件进程中使用
+        self._file = None
+        self._record_spans = None   # 序号 -> (偏移, 长度)
+        self._keys_span = None
+        self._keys = None           # 序号 -> 排序字段
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["records"] = None
+        state["_file"] = None
+        state["_keys"] = None
+        return state
+
+    def _record(self, ordinal):
+        if self.records is not None:
+            return dict(self.records[ordinal])
+        return self._file.load(self._record_spans[ordinal])
+
+    def _sort_keys(self, ordinal):
+        if self.records is not None:
+            return self.records[ordinal]
+        if self._keys is None:
+            self._keys = self._file.load(self._keys_span)
+        return self._keys[ordinal]
+
+    def add(self, record):
+        item_id = record.get(_MEDIA_QUERIES[self.media_type]["id_field"])
+        if not item_id:
+            return
+        ordinal = self.ordinals.get(item_id)
+        if ordinal is None:
+            ordinal = len(self.records)
+            self.records.append(None)
+            self.ordinals[item_id] = ordinal
+        else:
+            self._clear_bits(ordinal)
+
+        from . import local_filter
+        record["media_type"] = self.media_type
+        self.records[ordinal] = record
+        bit = 1 << ordinal
+        self.alive |= bit
+        for group, value, filter_obj in facet_rules(self.media_type):
+            if local_filter.matches(filter_obj, record):
+                self.bitsets[(group, value)] = self.bitsets.get((group, value), 0) | bit
+
+    def remove(self, item_id):
+        ordinal = self.ordinals.pop(item_id, None)
+        if ordinal is None:
+            return False
+        self._clear_bits(ordinal)
+        self.records[ordinal] = None
+        return True
+
+    def _clear_bits(self, ordinal):
+        mask = ~(1 << ordinal)
+        self.alive &= mask
+        for key in self.bitsets:
+            self.bitsets[key] &= mask
+
+    def rebuild_permutations(self):
+        from .video_library import sort_items_locally
+        live = [r for r in self.records if r is not None]
+        id_field = _MEDIA_QUERIES[self.media_type]["id_field"]
+        self.permutations = {}
+        for method in PRESORTED_METHODS:
+            ordered = sort_items_locally(list(live), {"method": method, "order": "descending"})
+            self.permutations[method] = [self.ordinals[r[id_field]] for r in ordered]
+
+    def group_bits(self, filters, group):
+        """返回单个筛选组当前选择对应的位图，未选择时为全部条目。"""
+        filters = filters or {}
+        values = FACET_VALUES[group]
+        if group in _MULTI_SELECT_GROUPS:
+            selected = [v for v in values if filters.get(_facet_key(group, v))]
+            if not selected:
+                return self.alive
+            bits = 0
+            for v in selected:
+                bits |= self.bitsets.get((group, v), 0)
+            return bits
+        value = filters.get(group)
+        if value not in values:
+            return self.alive
+        return self.bitsets.get((group, value), 0)
+
+    def select(self, filters):
+        """按筛选条件返回命中条目的位图。"""
+        bits = self.alive
+        for group in FACET_VALUES:
+            bits &= self.group_bits(filters, group)
+        return bits
+
+    def materialize(self, bits, sort_obj, limit):
+        """按排序方式输出命中条目的副本，最多 limit 个。"""
+        hits = bit_ordinals(bits)
+        method = (sort_obj or {}).get("method")
+        permutation = self.permutations.get(method)
+        if permutation is not None:
+            if sort_obj.get("order", "descending") != "descending":
+                permutation = reversed(permutation)
+            selected = []
+            for ordinal in permutation:
+                if ordinal in hits:
+                    selected.append(ordinal)
+                    if len(selected) >= limit:
+                        break
+            return [self._record(o) for o in selected]
+
+        # 其余排序依赖播放次数等易变字段（随机排序依赖种子），按排序字段对命中条目现场排序，只读取输出的条目
+        keys = [dict(self._sort_keys(o), _ordinal=o) for o in hits]
+        from .video_library import sort_items_locally
+        return [self._record(k["_ordinal"]) for k in sort_items_locally(keys, sort_obj)[:limit]]
+
+
+def _is_ready():
+    return xbmcgui.Window(10000).getProperty(FACET_READY_PROPERTY) == "true"
+
+
+def _read_indexes(f):
+    """从打开的索引文件读取头部，条目和排序字段通过 f 按需读取，f 关闭后不可再读取。"""
+    (size,) = _HEADER_SIZE.unpack(f.read(_HEADER_SIZE.size))
+    indexes = pickle.loads(f.read(size))
+    source = _IndexFile(f, _HEADER_SIZE.size + size)
+    for index in indexes.values():
+        index._file = source
+    return indexes
+
+
+def load_facet_indexes():
+    """
+    读取 service 维护的索引，返回 {media_type: FacetIndex}，只含位图和序号（供 FacetCounter 计数），
+    读取后即关闭文件；未就绪时返回 None。
+    """
+    if not _is_ready():
+        return None
+    try:
+        with open(FACET_INDEX_FILE, 'rb') as f:
+            indexes = _read_indexes(f)
+    except Exception as e:
+        log(f"Error loading facet index: {e}")
+        return None
+    for index in indexes.values():
+        index._file = None
+    return indexes
+
+
+def _replace_file(src, dst, attempts=5):
+    """Windows 上插件进程正在读取时 os.replace 会失败，读取只持续一次查询，稍后重试即可。"""
+    for attempt in range(attempts):
+        try:
+            os.replace(src, dst)
+            return
+        except PermissionError:
+            if attempt == attempts - 1:
+                raise
+            time.sleep(0.2)
+
+
+def media_types_for(mediatype):
+    """筛选窗口的影视范围对应的索引类型，索引不覆盖的范围返回 None。"""
+    if mediatype == "电影":
+        return ("movie",)
+    if mediatype == "剧集":
+        return ("tvshow",)
+    if not mediatype or mediatype == "全部":
+        return ("movie", "tvshow")
+    return None
+
+
+class FacetCounter:
+    """
+    计算筛选窗口中每个按钮在当前选择下的命中数。
+    某个按钮的计数 = 本组之外其他各组当前选择的交集 & 该按钮位图，
+    因此只有一个组的选择变化时，该组自身按钮的计数不变，只需重算其他组。
+    计数加载线程和 GUI 线程都会调用 update，由 _lock 串行化。
+    """
+
+    def __init__(self, indexes):
+        self.indexes = indexes or {}
+        self.media_types = None
+        self.selection = {}   # media_type -> {group: 当前选择的位图}
+        self.masks = {}       # media_type -> 索引不覆盖的条件（T9、首字母）命中的位图
+        self.counts = {}      # (group, value) -> 命中数，value 为 '' 表示默认按钮
+        self._lock = threading.Lock()
+
+    def update(self, filters, changed_group=None, masks=None):
+        """
+        按新的筛选条件更新计数，返回本次变化的 {(group, value): count}。
+        filters 含索引不覆盖的条件时，masks 为 rule_masks 给出的各类型命中位图。
+        影视范围不受索引覆盖或缺少 masks 时返回 None，调用方应清除计数显示。
+        """
+        with self._lock:
+            return self._update(filters, changed_group, masks)
+
+    def _update(self, filters, changed_group, masks):
+        filters = filters or {}
+        media_types = media_types_for(filters.get("filter.mediatype"))
+        if unindexed_filters(filters) and masks is None:
+            media_types = None
+        if media_types is None or any(m not in self.indexes for m in media_types):
+            self.media_types = None
+            self.selection = {}
+            self.masks = {}
+            self.counts = {}
+            return None
+
+        masks = masks or {}
+        if masks != self.masks:
+            # 搜索输入变化时所有按钮的计数都会变化
+            self.masks = masks
+            changed_group = None
+
+        if changed_group not in FACET_VALUES or not self.selection:
+            # 首次计算或变化的不是单个筛选组，全部重算
+            self.selection = {
+                m: {g: index.group_bits(filters, g) for g in FACET_VALUES}
+                for m, index in self.indexes.items()
+            }
+            dirty_groups = list(FACET_VALUES)
+        elif media_types != self.media_types:
+            dirty_groups = list(FACET_VALUES)
+        else:
+            changed = False
+            for m in self.selection:
+                bits = self.indexes[m].group_bits(filters, changed_group)
+                if bits != self.selection[m][changed_group]:
+                    self.selection[m][changed_group] = bits
+                    changed = True
+            if not changed:
+                return {}
+            dirty_groups = [g for g in FACET_VALUES if g != changed_group]
+        self.media_types = media_types
+
+        updated = {}
+        for group in dirty_groups:
+            group_counts = {value: 0 for value in [''] + FACET_VALUES[group]}
+            for m in media_types:
+                index = self.indexes[m]
+                others = self._alive(m)
+                for g, bits in self.selection[m].items():
+                    if g != group:
+                        others &= bits
+                group_counts[''] += bit_count(others)
+                for value in FACET_VALUES[group]:
+                    group_counts[value] += bit_count(others & index.bitsets.get((group, value), 0))
+            for value, count in group_counts.items():
+                updated[(group, value)] = count
+
+        # 影视范围按钮：当前其他条件下各范围的结果数
+        totals = {m: bit_count(self._selected(m)) for m in self.selection}
+        for value, types in (('', ("movie", "tvshow")), ("电影", ("movie",)), ("剧集", ("tvshow",))):
+            if all(t in totals for t in types):
+                updated[("filter.mediatype", value)] = sum(totals[t] for t in types)
+
+        self.counts.update(updated)
+        return updated
+
+    def _alive(self, media_type):
+        bits = self.indexes[media_type].alive
+        if media_type in self.masks:
+            bits &= self.masks[media_type]
+        return bits
+
+    def _selected(self, media_type):
+        bits = self._alive(media_type)
+        for group_bits in self.selection[media_type].values():
+            bits &= group_bits
+        return bits
+
+
+def rule_masks(indexes, filters):
+    """
+    由 Kodi 按 id 查询索引不覆盖的条件（T9、首字母），返回 {media_type: 命中条目的位图}，
+    供 FacetCounter 与位图选择求交集；没有这类条件时返回 {}，查询失败时返回 None。
+    """
+    extra = unindexed_filters(filters)
+    if not extra:
+        return {}
+    from .video_library import build_filter
+    media_types = list(indexes)
+    queries = []
+    for media_type in media_types:
+        params = {"properties": []}
+        filter_obj = build_filter(extra, media_type=media_type)
+        if filter_obj:
+            params["filter"] = filter_obj
+        queries.append({"jsonrpc": "2.0", "id": f"facet_mask_{media_type}",
+                        "method": _MEDIA_QUERIES[media_type]["method"], "params": params})
+    masks = {}
+    for media_type, data in zip(media_types, jsonrpc_parallel(queries)):
+        if data is None:
+            return None
+        index = indexes[media_type]
+        id_field = _MEDIA_QUERIES[media_type]["id_field"]
+        bits = 0
+        for row in data.get(_MEDIA_QUERIES[media_type]["result_key"], []):
+            ordinal = index.ordinals.get(row.get(id_field))
+            if ordinal is not None:
+                bits |= 1 << ordinal
+        masks[media_type] = bits
+    return masks
+
+
+def query_items(media_types, filters, limit, sort_obj):
+    """
+    通过位图索引获取条目，media_types 为 ("movie",)、("tvshow",) 或两者。
+    索引未就绪或筛选条件超出索引覆盖范围时返回 None，调用方回退到 Kodi 查询。
+    索引文件只在本次调用期间打开。
+    """
+    if not is_supported(filters) or not _is_ready():
+        return None
+    items = []
+    try:
+        with open(FACET_INDEX_FILE, 'rb') as f:
+            indexes = _read_indexes(f)
+            if any(m not in indexes for m in media_types):
+                return None
+            for media_type in media_types:
+                index = indexes[media_type]
+                items.extend(index.materialize(index.select(filters), sort_obj, limit))
+    except Exception as e:
+        log(f"Error querying facet index: {e}")
+        return None
+    if len(media_types) > 1:
+        from .video_library import sort_items_locally
+        sort_items_locally(items, sort_obj)
+    return items[:limit]
+
+
+class FacetStore:
+    """
+    在 service 中常驻，负责构建和增量维护电影/剧集位图索引，
+    变化后写回 FACET_INDEX_FILE 供插件进程读取。
+    """
+
+    def __init__(self):
+        self.indexes = {}
+        self.last_reconcile = 0
+        self._lock = threading.Lock()
+        # 待处理的增量通知 [(method, payload)]，由后台线程合并处理
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._last_change = 0
+        self._worker = None
+
+    def needs_reconcile(self):
+        return time.time() - self.last_reconcile > FACET_RECONCILE_INTERVAL
+
+    def start_reconcile(self, stale=False):
+        """在后台线程中全量构建。stale 为 True 时先清除 FACET_READY_PROPERTY，构建完成前插件进程回退到 Kodi 查询。"""
+        if stale:
+            xbmcgui.Window(10000).clearProperty(FACET_READY_PROPERTY)
+        self.last_reconcile = time.time()
+        threading.Thread(target=self.reconcile, daemon=True).start()
+
+    def reconcile(self):
+        started = time.time()
+        media_types = list(_MEDIA_QUERIES)
+        results = jsonrpc_parallel([
+            {
+                "jsonrpc": "2.0", "id": f"facet_{m}",
+                "method": _MEDIA_QUERIES[m]["method"],
+                "params": {"properties": _MEDIA_QUERIES[m]["properties"]},
+            }
+            for m in media_types
+        ])
+        if any(r is None for r in results):
+            log("Facet index reconcile failed, keeping previous data", xbmc.LOGWARNING)
+            return False
+
+        indexes = {}
+        for media_type, data in zip(media_types, results):
+            index = FacetIndex(media_type)
+            for record in data.get(_MEDIA_QUERIES[media_type]["result_key"], []):
+                index.add(record)
+            index.rebuild_permutations()
+            indexes[media_type] = index
+
+        with self._lock:
+            self.indexes = indexes
+            self.last_reconcile = time.time()
+            self._save()
+
+        xbmcgui.Window(10000).setProperty(FACET_READY_PROPERTY, "true")
+        log(f"Facet index built: " + ", ".join(f"{m}={len(i.ordinals)}" for m, i in indexes.items())
+            + f" in {time.time() - started:.2f}s")
+        return True
+
+    def handle_notification(self, method, data):
+        """在 Monitor 回调线程中调用，只登记变化，实际的查询、重建和保存都在后台线程完成。"""
+        try:
+            payload = json.loads(data) if data else {}
+        except ValueError:
+            payload = {}
+
+        if method in ("VideoLibrary.OnScanFinished", "VideoLibrary.OnCleanFinished"):
+            self.start_reconcile(stale=True)
+            return
+
+        with self._pending_lock:
+            self._pending.append((method, payload))
+            self._last_change = time.time()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._process_pending, daemon=True)
+                self._worker.start()
+
+    def _process_pending(self):
+        while True:
+            with self._pending_lock:
+                wait = self._last_change + FACET_UPDATE_DELAY - time.time()
+                if wait <= 0:
+                    pending, self._pending = self._pending, []
+                    if not pending:
+                        self._worker = None
+                        return
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self._apply_pending(pending)
+            except Exception as e:
+                log(f"Error applying facet index updates: {e}")
+
+    def _apply_pending(self, pending):
+        removed = set()   # (media_type, id)
+        updated = set()
+        episode_ids = set()
+        for method, payload in pending:
+            if method == "VideoLibrary.OnRemove":
+                if payload.get("type") in _MEDIA_QUERIES and payload.get("id"):
+                    removed.add((payload["type"], payload["id"]))
+                continue
+            item = payload.get("item") or {}
+            if not item.get("id"):
+                continue
+            if item.get("type") == "episode":
+                episode_ids.add(item["id"])
+            elif item.get("type") in _MEDIA_QUERIES:
+                updated.add((item["type"], item["id"]))
+
+        if episode_ids:
+            # 剧集的已看集数、最近观看随单集变化
+            responses = jsonrpc_request([
+                {
+                    "jsonrpc": "2.0", "id": i, "method": "VideoLibrary.GetEpisodeDetails",
+                    "params": {"episodeid": int(episode_id), "properties": ["tvshowid"]},
+                }
+                for i, episode_id in enumerate(episode_ids)
+            ]) or []
+            for res in responses if isinstance(responses, list) else []:
+                tvshow_id = ((res.get("result") or {}).get("episodedetails") or {}).get("tvshowid") if isinstance(res, dict) else None
+                if tvshow_id:
+                    updated.add(("tvshow", tvshow_id))
+        updated -= removed
+
+        details = []
+        if updated:
+            keys = list(updated)
+            responses = jsonrpc_request([
+                {
+                    "jsonrpc": "2.0", "id": i, "method": _MEDIA_QUERIES[media_type]["details"],
+                    "params": {_MEDIA_QUERIES[media_type]["id_field"]: int(item_id),
+                               "properties": _MEDIA_QUERIES[media_type]["properties"]},
+                }
+                for i, (media_type, item_id) in enumerate(keys)
+            ]) or []
+            for res in responses if isinstance(responses, list) else []:
+                if not isinstance(res, dict) or not isinstance(res.get("id"), int):
+                    continue
+                media_type = keys[res["id"]][0]
+                record = (res.get("result") or {}).get(_MEDIA_QUERIES[media_type]["details_key"])
+                if record:
+                    details.append((media_type, record))
+
+        with self._lock:
+            touched = set()
+            for media_type, item_id in removed:
+                index = self.indexes.get(media_type)
+                if index and index.remove(item_id):
+                    touched.add(media_type)
+            for media_type, record in details:
+                index = self.indexes.get(media_type)
+                if index is not None:
+                    index.add(record)
+                    touched.add(media_type)
+            if not touched:
+                return
+            for media_type in touched:
+                self.indexes[media_type].rebuild_permutations()
+            self._save()
+        log(f"Facet index updated from {len(pending)} notifications: "
+            f"removed={len(removed)}, updated={len(details)}", xbmc.LOGDEBUG)
+
+    def _save(self):
+        tmp_path = FACET_INDEX_FILE + ".tmp"
+        try:
+            chunks = []
+            position = 0
+
+            def append(obj):
+                nonlocal position
+                blob = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+                chunks.append(blob)
+                position += len(blob)
+                return position - len(blob), len(blob)
+
+            for index in self.indexes.values():
+                index._keys_span = append([
+                    {k: r[k] for k in _SORT_FIELDS if k in r} if r is not None else None
+                    for r in index.records
+                ])
+            for index in self.indexes.values():
+                index._record_spans = [append(r) if r is not None else None for r in index.records]
+
+            header = pickle.dumps(self.indexes, protocol=pickle.HIGHEST_PROTOCOL)
+            with open(tmp_path, 'wb') as f:
+                f.write(_HEADER_SIZE.pack(len(header)))
+                f.write(header)
+                for blob in chunks:
+                    f.write(blob)
+            _replace_file(tmp_path, FACET_INDEX_FILE)
+        except Exception as e:
+            log(f"Error saving facet index: {e}")
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+导入耗时统计。
+
+插件每次调用都是一个新进程，模块导入是启动开销的主要部分。
+install() 之后首次加载的每个模块都会记录自身执行耗时（不含其间导入的其他模块），report() 按耗时输出到日志。
+开启设置 profile_imports 后由 default.py 使用，也可以用 dev/bench_startup.py 在 Kodi 之外测量。
+"""
+import sys
+import time
+
+_costs = {}
+_stack = []
+
+
+class _TimedLoader:
+    def __init__(self, loader):
+        self._loader = loader
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        started = time.perf_counter()
+        _stack.append(0.0)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            nested = _stack.pop()
+            elapsed = time.perf_counter() - started
+            if _stack:
+                _stack[-1] += elapsed
+            _costs[module.__name__] = elapsed - nested
+
+
+class _TimedFinder:
+    """排在 sys.meta_path 最前，借用后面的 finder 找到模块，再把 loader 换成计时版本。"""
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is None:
+                continue
+            if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+                spec.loader = _TimedLoader(spec.loader)
+            return spec
+        return None
+
+
+_finder = _TimedFinder()
+
+
+def install():
+    if _finder not in sys.meta_path:
+        sys.meta_path.insert(0, _finder)
+
+
+def uninstall():
+    if _finder in sys.meta_path:
+        sys.meta_path.remove(_finder)
+
+
+def costs():
+    """返回 [(模块名, 耗时秒)]，按耗时从高到低排列。"""
+    return sorted(_costs.items(), key=lambda item: item[1], reverse=True)
+
+
+def report(label, top=15):
+    from .common import log
+
+    entries = costs()
+    total = sum(cost for _, cost in entries)
+    lines = [f"Import cost for {label}: {total * 1000:.1f}ms in {len(entries)} modules"]
+    for name, cost in entries[:top]:
+        lines.append(f"  {cost * 1000:8.1f}ms  {name}")
+    log("\n".join(lines))
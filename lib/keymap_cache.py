@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+用户 keymap 中绑定了 toggle_favourite 的按键代码。
+
+解析结果连同 keymap 文件的名称、大小和修改时间一起保存在 ADDON_DATA_PATH，
+文件未变化时筛选窗口直接读取结果，不再解析 XML。service 定期在后台检查并更新。
+"""
+import os
+import json
+
+import xbmc
+import xbmcvfs
+
+from .common import ADDON_DATA_PATH, log
+
+KEYMAP_CACHE_FILE = os.path.join(ADDON_DATA_PATH, 'keymap_cache.json')
+# service 检查 keymap 文件是否变化的间隔（秒）
+KEYMAP_REFRESH_INTERVAL = 60
+_MAPPING_FILE = os.path.join(os.path.dirname(__file__), '..', 'resources', 'keyboard_mapping.json')
+
+
+def _keymap_folder():
+    return xbmcvfs.translatePath('special://profile/keymaps/')
+
+
+def _xml_files(folder):
+    # 按字母顺序排序，以正确处理Kodi的覆盖加载机制
+    return sorted([f for f in os.listdir(folder) if f.lower().endswith('.xml')])
+
+
+def keymap_signature():
+    """返回 [[文件名, 大小, 修改时间], ...]，包含按键名称映射表本身。"""
+    signature = []
+    try:
+        st = os.stat(_MAPPING_FILE)
+        signature.append(["keyboard_mapping.json", st.st_size, st.st_mtime])
+    except OSError:
+        signature.append(["keyboard_mapping.json", -1, 0])
+
+    folder = _keymap_folder()
+    if os.path.exists(folder):
+        for file_name in _xml_files(folder):
+            try:
+                st = os.stat(os.path.join(folder, file_name))
+            except OSError:
+                continue
+            signature.append([file_name, st.st_size, st.st_mtime])
+    return signature
+
+
+def parse_fav_button_codes():
+    """解析用户的 keymap XML，提取绑定了 toggle_favourite 的自定义按键代码"""
+    import xml.etree.ElementTree as ET
+
+    # 记录全局的键盘映射 button_code -> action_str
+    global_keyboard_map = {}
+
+    # 加载键盘映射 JSON
+    name_to_code = {}
+    try:
+        with open(_MAPPING_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+            name_to_code = data.get("name_to_code", {})
+    except Exception as e:
+        log(f"Failed to load keyboard mapping json: {e}", xbmc.LOGERROR)
+
+    folder = _keymap_folder()
+    if os.path.exists(folder):
+        for file_name in _xml_files(folder):
+            file_path = os.path.join(folder, file_name)
+            try:
+                tree = ET.parse(file_path)
+                root = tree.getroot()
+
+                # Kodi 的 keymap 加载是不区分大小写的，我们遍历子节点匹配
+                for global_node in root:
+                    if global_node.tag.lower() == 'global':
+                        for keyboard_node in global_node:
+                            if keyboard_node.tag.lower() == 'keyboard':
+                                # 遍历所有的按键标签
+                                for elem in keyboard_node:
+                                    tag = elem.tag.lower()
+                                    text = elem.text or ''
+                                    button_code = None
+
+                                    # 处理 <key id="xxx">
+                                    if tag == 'key' and 'id' in elem.attrib:
+                                        try:
+                                            button_code = int(elem.attrib['id'])
+                                        except ValueError:
+                                            pass
+                                    else:
+                                        # 处理具有命名标签的映射
+                                        if tag in name_to_code:
+                                            button_code = name_to_code[tag]
+
+                                    # 将得到的 button_code 映射覆盖，这就是Kodi执行的加载合并逻辑
+                                    if button_code is not None:
+                                        global_keyboard_map[button_code] = text
+
+            except Exception as e:
+                log(f"Failed to parse keymap {file_path}: {e}", xbmc.LOGERROR)
+
+    # 从最终合并完成的字典中，筛选出分配给了我们的 toggle_favourite 脚本的按钮代码
+    allowed_button_codes = set()
+    for code, action_text in global_keyboard_map.items():
+        if 'plugin.video.filteredmovies' in action_text and 'toggle_favourite' in action_text:
+            allowed_button_codes.add(code)
+
+    log(f"Parsed favourite button codes: {allowed_button_codes}")
+    return allowed_button_codes
+
+
+def _load_cache():
+    try:
+        with open(KEYMAP_CACHE_FILE, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_cache(signature, codes):
+    tmp_path = KEYMAP_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({"signature": signature, "codes": sorted(codes)}, f)
+        os.replace(tmp_path, KEYMAP_CACHE_FILE)
+    except Exception as e:
+        log(f"Error saving keymap cache: {e}")
+
+
+def get_fav_button_codes():
+    """keymap 文件未变化时返回缓存的按键代码，否则重新解析并更新缓存。"""
+    signature = keymap_signature()
+    cache = _load_cache()
+    if cache.get("signature") == signature:
+        return set(cache.get("codes", []))
+    codes = parse_fav_button_codes()
+    _save_cache(signature, codes)
+    return codes
+
+
+def refresh():
+    """service 后台调用：keymap 文件变化时预先解析，窗口打开时直接命中缓存。"""
+    try:
+        signature = keymap_signature()
+        if _load_cache().get("signature") != signature:
+            log("Keymap files changed, refreshing favourite button codes")
+            _save_cache(signature, parse_fav_button_codes())
+    except Exception as e:
+        log(f"Error refreshing keymap cache: {e}")
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+在 Python 中对 build_filter 生成的规则树求值。
+
+规则格式与 Kodi JSON-RPC 的 List.Filter 相同（and/or 嵌套 + field/operator/value），
+record 为普通 dict，列表字段（genre/country/tag）按 Kodi 的多值语义处理：
+contains 表示任意一个值包含，doesnotcontain 表示所有值都不包含。
+字符串比较与 Kodi 数据库一致，不区分大小写。
+"""
+
+_LIST_FIELDS = ("genre", "country", "tag")
+_NUMERIC_FIELDS = ("year", "rating")
+
+
+def _to_number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _field_values(record, field):
+    value = record.get(field)
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return [str(v).lower() for v in value]
+    return [str(value).lower()]
+
+
+def _match_rule(rule, record):
+    field = rule.get("field")
+    operator = rule.get("operator")
+    value = rule.get("value")
+
+    if field in _NUMERIC_FIELDS:
+        actual = _to_number(record.get(field))
+        if operator == "is":
+            return actual == _to_number(value)
+        if operator == "isnot":
+            return actual != _to_number(value)
+        if operator == "between":
+            low, high = value
+            return _to_number(low) <= actual <= _to_number(high)
+        if operator == "lessthan":
+            return actual < _to_number(value)
+        if operator == "greaterthan":
+            return actual > _to_number(value)
+        raise ValueError(f"Unsupported operator {operator} for {field}")
+
+    values = _field_values(record, field)
+    expected = str(value).lower() if value is not None else ""
+    if operator == "contains":
+        return any(expected in v for v in values)
+    if operator == "doesnotcontain":
+        return not any(expected in v for v in values)
+    if operator == "is":
+        return expected in values
+    if operator == "isnot":
+        return expected not in values
+    if operator == "startswith":
+        return any(v.startswith(expected) for v in values)
+    if operator == "true":
+        return bool(record.get(field))
+    raise ValueError(f"Unsupported operator {operator} for {field}")
+
+
+def matches(filter_obj, record):
+    """判断 record 是否满足规则树，filter_obj 为 None 时视为全部满足。"""
+    if not filter_obj:
+        return True
+    if "and" in filter_obj:
+        return all(matches(sub, record) for sub in filter_obj["and"])
+    if "or" in filter_obj:
+        return any(matches(sub, record) for sub in filter_obj["or"])
+    return _match_rule(filter_obj, record)
+
+
+def is_supported(filter_obj):
+    """判断规则树中的所有字段是否都能在本地求值。"""
+    if not filter_obj:
+        return True
+    if "and" in filter_obj:
+        return all(is_supported(sub) for sub in filter_obj["and"])
+    if "or" in filter_obj:
+        return all(is_supported(sub) for sub in filter_obj["or"])
+    return filter_obj.get("field") in _LIST_FIELDS + _NUMERIC_FIELDS + ("title",)
+
+
+def fields(filter_obj):
+    """返回规则树中用到的字段集合，用于只取回本地求值需要的属性。"""
+    if not filter_obj:
+        return set()
+    if "and" in filter_obj or "or" in filter_obj:
+        result = set()
+        for sub in filter_obj.get("and") or filter_obj.get("or"):
+            result |= fields(sub)
+        return result
+    return {filter_obj.get("field")}
@@ -1,9 +1,20 @@
 # -*- coding: utf-8 -*-
+"""
+播放中的字幕和音轨列表。
+
+每条流的显示名称、国旗图片和排序只与流本身有关，service 在 onAVStarted 时为正在播放的文件计算一次，
+保存在 STREAM_LABEL_CACHE_FILE。选择器打开时只查询当前选中的流，流的数量与缓存一致时直接使用缓存的条目。
+"""
+import os
 import re
+import json
+import functools
 import xbmc
-import xbmcaddon
 
-from .common import jsonrpc_request, notification, log
+from .common import ADDON_DATA_PATH, ADDON_PATH, jsonrpc_request, notification, log
+
+STREAM_LABEL_CACHE_FILE = os.path.join(ADDON_DATA_PATH, 'stream_labels.json')
+_FLAGS_DIR = os.path.join(ADDON_PATH, 'resources', 'skins', 'Default', 'media', 'flags')
 
 _LANG_MAP = {
     'ukr': '乌克兰语', 'uk': '乌克兰语',
@@ -55,7 +66,7 @@ _LANG_MAP = {
     'ukrainian': '乌克兰语', 'icelandic': '冰岛语', 'aramaic': '阿拉姆语',
 }
 
-_SUBTITLE_NAME_REPLACEMENTS = [
+_SUBTITLE_NAME_REPLACEMENTS = [(re.compile(pattern, re.IGNORECASE), repl) for pattern, repl in [
     (r'\bCHS/ENG\b', '简/英'),
     (r'\bCHT/ENG\b', '繁/英'),
     (r'\bCHS\b', '简体'),
@@ -73,11 +84,14 @@ _SUBTITLE_NAME_REPLACEMENTS = [
     (r'Traditional', '繁体'),
     (r'Mandarin', '普通话'),
     (r'Cantonese', '粤语'),
-]
+]]
 
 _AUDIO_NAME_CHANNEL_SUFFIX_RE = re.compile(r'\s+\d+\.\d+\s*$')
+_LANGUAGE_PREFIX_SEPARATOR_RE = re.compile(r'^[\s\-_/|:：]+')
+_CHINESE_CODES = ('chi', 'zho', 'zh', 'chn')
 
 
+@functools.lru_cache(maxsize=None)
 def _resolve_lang_name(lang_code):
     name = _LANG_MAP.get(lang_code.lower())
     if not name:
@@ -96,7 +110,7 @@ def _translate_stream_name(name):
 
     translated_name = name
     for pattern, repl in _SUBTITLE_NAME_REPLACEMENTS:
-        translated_name = re.sub(pattern, repl, translated_name, flags=re.IGNORECASE)
+        translated_name = pattern.sub(repl, translated_name)
 
     parts = translated_name.split('-')
     first_part = parts[0].strip()
@@ -124,7 +138,7 @@ def _strip_language_prefix_from_name(name, language):
         return cleaned_name
 
     remainder = cleaned_name[len(cleaned_language):].strip()
-    remainder = re.sub(r'^[\s\-_/|:：]+', '', remainder)
+    remainder = _LANGUAGE_PREFIX_SEPARATOR_RE.sub('', remainder)
 
     bracket_pairs = (
         ('(', ')'),
@@ -140,6 +154,27 @@ def _strip_language_prefix_from_name(name, language):
     return remainder
 
 
+@functools.lru_cache(maxsize=None)
+def _get_flag_path(lang_code):
+    """根据语言代码返回本地国旗图片路径，与 fuse2 皮肤逻辑相同。"""
+    if not lang_code or lang_code in ('unk', 'und', ''):
+        return None
+    code = lang_code.lower()
+    path = os.path.join(_FLAGS_DIR, f'{code}.png')
+    if os.path.exists(path):
+        return path
+    # 尝试 ISO 639-1 两字母码
+    try:
+        iso2 = xbmc.convertLanguage(lang_code, xbmc.ISO_639_1)
+        if iso2:
+            path2 = os.path.join(_FLAGS_DIR, f'{iso2.lower()}.png')
+            if os.path.exists(path2):
+                return path2
+    except Exception:
+        pass
+    return None
+
+
 def _strip_audio_channel_suffix(name):
     cleaned_name = (name or '').strip()
     if not cleaned_name:
@@ -175,6 +210,230 @@ def _build_code_info(bitrate, samplerate):
     return bitrate_text or samplerate_text
 
 
+def _build_subtitle_items(streams):
+    """计算字幕流的显示条目，按外挂、中文、原始顺序排列。"""
+    raw_items = []
+    for s in streams:
+        idx = s.get('index')
+        lang_code = s.get('language', 'unk')
+        name = s.get('name', '')
+
+        language = _resolve_lang_name(lang_code)
+
+        # 翻译并清理 name 字段
+        translated_name = _translate_stream_name(name)
+        cleaned_name = _strip_language_prefix_from_name(translated_name, language)
+        # 如果 name 与语言代码相同，也清掉
+        if cleaned_name and cleaned_name.lower() == lang_code.lower():
+            cleaned_name = ''
+        # 去掉中文括号包裹的"外挂"
+        if cleaned_name:
+            cleaned_name = cleaned_name.replace('（外挂）', '外挂')
+
+        # 合并 flags
+        extra_flags_parts = []
+        if s.get('isdefault'):
+            extra_flags_parts.append('默认')
+        if s.get('isforced'):
+            extra_flags_parts.append('强制')
+        if s.get('isimpaired'):
+            extra_flags_parts.append('解说')
+        if name and ('commentary' in name.lower() or '解说' in name or 'description' in name.lower()):
+            if '解说' not in extra_flags_parts:
+                extra_flags_parts.append('解说字幕')
+        extra_flags = '-'.join(extra_flags_parts)
+
+        # 构建完整 label（用于通知等场景）
+        label = language
+        if cleaned_name:
+            label += f"-{cleaned_name}"
+        if extra_flags:
+            label += f" ({extra_flags})"
+
+        is_chinese = lang_code.lower() in _CHINESE_CODES
+        is_external = '(external)' in name.lower() or '（外挂）' in name.lower()
+
+        raw_items.append({
+            "label": label,
+            "language": language,
+            "name": cleaned_name,
+            "extra_flags": extra_flags,
+            "index": idx,
+            "is_chinese": is_chinese,
+            "is_external": is_external,
+            "original_order": idx,
+            "lang_code": lang_code,
+        })
+
+    raw_items.sort(key=lambda x: (not x['is_external'], not x['is_chinese'], x['original_order']))
+
+    return [
+        {"label": item["label"], "language": item["language"],
+         "name": item["name"], "extra_flags": item["extra_flags"],
+         "index": item["index"], "lang_code": item["lang_code"],
+         "flag": _get_flag_path(item["lang_code"])}
+        for item in raw_items
+    ]
+
+
+def _build_audio_items(streams):
+    """计算音轨的显示条目，按中文、英语、其他语言排列。"""
+    display_items = []
+
+    def _is_positive_number(value):
+        try:
+            return float(value) > 0
+        except (TypeError, ValueError):
+            return False
+
+    has_known_bitrate = any(_is_positive_number(s.get('bitrate', 0)) for s in streams)
+
+    for s in streams:
+        idx = s.get('index')
+        lang_code = s.get('language', 'unk')
+        name = s.get('name', '')
+        channels = s.get('channels', 0)
+        codec = s.get('codec', '')
+        bitrate = s.get('bitrate', 0)
+        samplerate = s.get('samplerate', 0)
+
+        language = _resolve_lang_name(lang_code)
+        translated_name = _translate_stream_name(name)
+        name_without_language = _strip_language_prefix_from_name(translated_name, language)
+        name_without_language = _strip_audio_channel_suffix(name_without_language)
+        if language and name_without_language:
+            language_and_name = f"{language}-{name_without_language}"
+        else:
+            language_and_name = language or name_without_language
+        code_info = _build_code_info(bitrate, samplerate)
+        if not code_info and has_known_bitrate:
+            code_info = '未知码率'
+        channel = f"{int(channels)}声道" if channels else ''
+
+        extra_flags_parts = []
+        if s.get('isdefault'):
+            extra_flags_parts.append('默认')
+        if s.get('isimpaired'):
+            extra_flags_parts.append('解说')
+        if s.get('isoriginal'):
+            extra_flags_parts.append('原始')
+        extra_flags = '-'.join(extra_flags_parts)
+
+        details = []
+        if codec:
+            details.append(codec)
+        if code_info:
+            details.append(code_info)
+
+        if channel:
+            details.append(channel)
+        if extra_flags:
+            details.append(extra_flags)
+
+        label = language_and_name + (f" - {' - '.join(details)}" if details else "")
+
+        sort_priority = 2
+        if lang_code.lower() in _CHINESE_CODES:
+            sort_priority = 0
+        elif lang_code.lower() in ['eng', 'en']:
+            sort_priority = 1
+
+        display_items.append({
+            "label": label,
+            "language": language,
+            "name": name_without_language,
+            "language_and_name": language_and_name,
+            "codec": codec,
+            "code_info": code_info,
+            "channel": channel,
+            "extra_flags": extra_flags,
+            "index": idx,
+            "sort_priority": sort_priority,
+            "original_order": idx,
+            "lang_code": lang_code,
+            "flag": _get_flag_path(lang_code),
+        })
+
+    display_items.sort(key=lambda x: (x['sort_priority'], x['original_order']))
+    return display_items
+
+
+_STREAM_BUILDERS = {
+    "subtitles": _build_subtitle_items,
+    "audiostreams": _build_audio_items,
+}
+
+
+def _load_label_cache():
+    try:
+        with open(STREAM_LABEL_CACHE_FILE, 'r', encoding='utf-8') as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return cache if isinstance(cache, dict) else {}
+
+
+def _save_label_cache(cache):
+    tmp_path = STREAM_LABEL_CACHE_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, STREAM_LABEL_CACHE_FILE)
+    except Exception as e:
+        log(f"Error saving stream label cache: {e}")
+
+
+def _playing_file():
+    try:
+        return xbmc.Player().getPlayingFile()
+    except RuntimeError:
+        return None
+
+
+def _stream_signature(streams):
+    """每条流的 [index, language, name]，用于判断缓存的显示条目是否仍对应当前的流（JSON 中元组会变成列表）。"""
+    return [[stream.get("index"), stream.get("language", ""), stream.get("name", "")] for stream in streams]
+
+
+def _stream_items(kind, streams):
+    """返回流的显示条目（不含选中状态）。正在播放的文件和每条流的签名与缓存一致时直接使用缓存，否则重新计算并更新缓存。"""
+    playing_file = _playing_file()
+    cache = _load_label_cache()
+    signature = _stream_signature(streams)
+    if playing_file and cache.get("file") == playing_file:
+        entry = cache.get(kind) or {}
+        if entry.get("signature") == signature:
+            return entry["items"]
+    else:
+        cache = {"file": playing_file}
+
+    items = _STREAM_BUILDERS[kind](streams)
+    if playing_file:
+        cache[kind] = {"signature": signature, "items": items}
+        _save_label_cache(cache)
+    return items
+
+
+def precompute_stream_labels():
+    """service 在播放开始时调用：为正在播放的文件计算字幕和音轨的显示条目并写入缓存。"""
+    playing_file = _playing_file()
+    if not playing_file:
+        return
+    result = jsonrpc_request({
+        "jsonrpc": "2.0",
+        "method": "Player.GetProperties",
+        "params": {"playerid": 1, "properties": list(_STREAM_BUILDERS)},
+        "id": "Player.GetProperties",
+    }) or {}
+    cache = {"file": playing_file}
+    for kind, build in _STREAM_BUILDERS.items():
+        streams = result.get(kind) or []
+        cache[kind] = {"signature": _stream_signature(streams), "items": build(streams)}
+    _save_label_cache(cache)
+    log(f"Precomputed stream labels for {playing_file}: "
+        f"subtitles={len(cache['subtitles']['signature'])}, audio={len(cache['audiostreams']['signature'])}")
+
+
 def get_subtitle_items(suppress_warning=False):
     """获取字幕列表。返回 (display_items, current_index, is_enabled, player)。"""
     log("get_subtitle_items function started")
@@ -208,9 +467,6 @@ def get_subtitle_items(suppress_warning=False):
             for i, name in enumerate(avail_streams):
                 streams.append({"index": i, "name": name, "language": "unk"})
 
-        for itm in streams:
-            log(f"{itm['language']} {itm['name']}")
-
         if not streams:
             if not suppress_warning:
                 notification("没有可用的字幕流")
@@ -218,68 +474,9 @@ def get_subtitle_items(suppress_warning=False):
 
         current_index = current_stream.get('index') if is_enabled else -1
 
-        raw_items = []
-        for s in streams:
-            idx = s.get('index')
-            lang_code = s.get('language', 'unk')
-            name = s.get('name', '')
-
-            language = _resolve_lang_name(lang_code)
-
-            # 翻译并清理 name 字段
-            translated_name = _translate_stream_name(name)
-            cleaned_name = _strip_language_prefix_from_name(translated_name, language)
-            # 如果 name 与语言代码相同，也清掉
-            if cleaned_name and cleaned_name.lower() == lang_code.lower():
-                cleaned_name = ''
-            # 去掉中文括号包裹的"外挂"
-            if cleaned_name:
-                cleaned_name = cleaned_name.replace('（外挂）', '外挂')
-
-            # 合并 flags
-            extra_flags_parts = []
-            if s.get('isdefault'):
-                extra_flags_parts.append('默认')
-            if s.get('isforced'):
-                extra_flags_parts.append('强制')
-            if s.get('isimpaired'):
-                extra_flags_parts.append('解说')
-            if name and ('commentary' in name.lower() or '解说' in name or 'description' in name.lower()):
-                if '解说' not in extra_flags_parts:
-                    extra_flags_parts.append('解说字幕')
-            extra_flags = '-'.join(extra_flags_parts)
-
-            # 构建完整 label（用于通知等场景）
-            label = language
-            if cleaned_name:
-                label += f"-{cleaned_name}"
-            if extra_flags:
-                label += f" ({extra_flags})"
-
-            is_chinese = lang_code.lower() in ['chi', 'zho', 'zh', 'chn']
-            is_external = '(external)' in name.lower() or '（外挂）' in name.lower()
-
-            raw_items.append({
-                "label": label,
-                "language": language,
-                "name": cleaned_name,
-                "extra_flags": extra_flags,
-                "index": idx,
-                "is_active": (is_enabled and idx == current_index),
-                "is_chinese": is_chinese,
-                "is_external": is_external,
-                "original_order": idx,
-                "lang_code": lang_code,
-            })
-
-        raw_items.sort(key=lambda x: (not x['is_external'], not x['is_chinese'], x['original_order']))
-
         display_items = [
-            {"label": item["label"], "language": item["language"],
-             "name": item["name"], "extra_flags": item["extra_flags"],
-             "index": item["index"],
-             "is_active": item["is_active"], "lang_code": item.get("lang_code", "unk")}
-            for item in raw_items
+            dict(item, is_active=(is_enabled and item["index"] == current_index))
+            for item in _stream_items("subtitles", streams)
         ]
 
         return display_items, current_index, is_enabled, player
@@ -312,83 +509,10 @@ def get_audio_items(suppress_warning=False):
             return None, -1
 
         current_index = current_stream.get('index', -1)
-        display_items = []
-
-        def _is_positive_number(value):
-            try:
-                return float(value) > 0
-            except (TypeError, ValueError):
-                return False
-
-        has_known_bitrate = any(_is_positive_number(s.get('bitrate', 0)) for s in streams)
-
-        for s in streams:
-            idx = s.get('index')
-            lang_code = s.get('language', 'unk')
-            name = s.get('name', '')
-            channels = s.get('channels', 0)
-            codec = s.get('codec', '')
-            bitrate = s.get('bitrate', 0)
-            samplerate = s.get('samplerate', 0)
-
-            language = _resolve_lang_name(lang_code)
-            translated_name = _translate_stream_name(name)
-            name_without_language = _strip_language_prefix_from_name(translated_name, language)
-            name_without_language = _strip_audio_channel_suffix(name_without_language)
-            if language and name_without_language:
-                language_and_name = f"{language}-{name_without_language}"
-            else:
-                language_and_name = language or name_without_language
-            code_info = _build_code_info(bitrate, samplerate)
-            if not code_info and has_known_bitrate:
-                code_info = '未知码率'
-            channel = f"{int(channels)}声道" if channels else ''
-
-            extra_flags_parts = []
-            if s.get('isdefault'):
-                extra_flags_parts.append('默认')
-            if s.get('isimpaired'):
-                extra_flags_parts.append('解说')
-            if s.get('isoriginal'):
-                extra_flags_parts.append('原始')
-            extra_flags = '-'.join(extra_flags_parts)
-
-            details = []
-            if codec:
-                details.append(codec)
-            if code_info:
-                details.append(code_info)
-
-            if channel:
-                details.append(channel)
-            if extra_flags:
-                details.append(extra_flags)
-
-            label = language_and_name + (f" - {' - '.join(details)}" if details else "")
-
-            sort_priority = 2
-            if lang_code.lower() in ['chi', 'zho', 'zh', 'chn']:
-                sort_priority = 0
-            elif lang_code.lower() in ['eng', 'en']:
-                sort_priority = 1
-
-            display_items.append({
-                "label": label,
-                "language": language,
-                "name": name_without_language,
-                "language_and_name": language_and_name,
-                "codec": codec,
-                "code_info": code_info,
-                "channel": channel,
-                "extra_flags": extra_flags,
-                "index": idx,
-                "is_active": (idx == current_index),
-                "sort_priority": sort_priority,
-                "original_order": idx,
-                "lang_code": lang_code,
-            })
-
-        display_items.sort(key=lambda x: (x['sort_priority'], x['original_order']))
+        display_items = [
+            dict(item, is_active=(item["index"] == current_index))
+            for item in _stream_items("audiostreams", streams)
+        ]
         return display_items, current_index
 
     except Exception as e:
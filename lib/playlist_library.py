@@ -1,4 +1,10 @@
 # -*- coding: utf-8 -*-
+import json
+import time
+import bisect
+import threading
+from collections import OrderedDict
+
 import xbmc
 from lib.common import jsonrpc_request, log
 
@@ -6,8 +12,20 @@ from lib.common import jsonrpc_request, log
 MAX_PLAYLIST_ITEMS_BEFORE = 10
 MAX_PLAYLIST_ITEMS_AFTER = 10
 MAX_DELETE_LOWER_EPISODES_BELOW = 10
-# 插入/删除播放列表项后等待 300ms，给 Kodi 足够时间处理更新并避免过快连续操作导致的异常。
-PLAYLIST_MUTATION_DELAY_MS = 300
+# 批量修改播放列表后，等待 Kodi 发出 Playlist.OnAdd/OnRemove 通知的最长时间（秒）
+PLAYLIST_CHANGE_TIMEOUT = 3.0
+# 等待通知时调用 waitForAbort 的间隔（秒）
+PLAYLIST_CHANGE_POLL_INTERVAL = 0.05
+# 最多缓存的季剧集列表数，连续观看时在多部剧、多季之间切换也能直接命中
+MAX_CACHED_SEASONS = 16
+
+_season_lock = threading.Lock()
+_season_cache = OrderedDict()  # (tvshowid, season) -> {"tvshowid", "season", "episodes"}
+# 新增剧集通知等待这么久（秒）后批量查询所属剧集
+ADDED_EPISODE_DELAY = 1.0
+_added_lock = threading.Lock()
+_added_episodes = set()
+_added_worker = None
 
 
 def get_autoplay_next_values():
@@ -80,10 +98,7 @@ def get_playlist_items(playlist_id):
     return playlist
 
 
-def get_season_episode(tvshow_id, season):
-    if tvshow_id in (None, -1) or season in (None, -1):
-        return None
-
+def _fetch_season_episode(tvshow_id, season):
     result = jsonrpc_request({
         "jsonrpc": "2.0",
         "method": "VideoLibrary.GetEpisodes",
@@ -111,6 +126,176 @@ def get_season_episode(tvshow_id, season):
     }
 
 
+def get_season_episode(tvshow_id, season):
+    """返回该季按集数排序的剧集列表，结果按 (tvshowid, season) 缓存，媒体库变化时由 invalidate_season_cache 清除。
+
+    返回的字典在调用方之间共享，不要修改。
+    """
+    if tvshow_id in (None, -1) or season in (None, -1):
+        return None
+
+    key = (int(tvshow_id), int(season))
+    with _season_lock:
+        cached = _season_cache.get(key)
+        if cached is not None:
+            _season_cache.move_to_end(key)
+            return cached
+
+    season_info = _fetch_season_episode(*key)
+    if season_info is None:
+        return None
+
+    with _season_lock:
+        _season_cache[key] = season_info
+        _season_cache.move_to_end(key)
+        while len(_season_cache) > MAX_CACHED_SEASONS:
+            _season_cache.popitem(last=False)
+    return season_info
+
+
+def invalidate_season_cache(method, data):
+    """根据媒体库通知清除受影响的季缓存，在 Monitor 回调线程中调用，不做 JSON-RPC 查询。
+
+    缓存只含各集的 id 和集数：观看状态、进度、海报等更新不影响它，OnUpdate 只处理新增剧集（带 "added"），
+    其所属剧集由后台线程批量查询后清除该剧的所有季；重新刮削发生在扫描中，由 OnScanFinished 全部清除。
+    剧集删除时只清除包含该剧集的季，剧集被删除时清除该剧的所有季，季被删除或扫描、清理完成时全部清除。
+    """
+    try:
+        payload = json.loads(data) if data else {}
+    except ValueError:
+        payload = {}
+
+    if method == "VideoLibrary.OnUpdate":
+        item = payload.get("item") or {}
+        if item.get("type") == "episode" and payload.get("added") and item.get("id"):
+            _queue_added_episode(item["id"])
+        return
+    item = payload if method == "VideoLibrary.OnRemove" else {}
+    item_type = item.get("type")
+    item_id = item.get("id")
+
+    if method in ("VideoLibrary.OnScanFinished", "VideoLibrary.OnCleanFinished") or item_type == "season":
+        with _season_lock:
+            _season_cache.clear()
+        return
+    if item_type == "tvshow":
+        _drop_show_seasons([item_id])
+        return
+    if item_type != "episode":
+        return
+
+    with _season_lock:
+        keys = [
+            key for key, season_info in _season_cache.items()
+            if any(episode.get("id") == item_id for episode in season_info["episodes"])
+        ]
+        for key in keys:
+            del _season_cache[key]
+
+def _queue_added_episode(episode_id):
+    global _added_worker
+    with _added_lock:
+        _added_episodes.add(episode_id)
+        if _added_worker is None:
+            _added_worker = threading.Thread(target=_process_added_episodes, daemon=True)
+            _added_worker.start()
+
+def _process_added_episodes():
+    """批量查询新增剧集所属的剧集，清除这些剧的季缓存。扫描时会连续收到大量新增通知，合并处理。"""
+    global _added_worker
+    while True:
+        time.sleep(ADDED_EPISODE_DELAY)
+        with _added_lock:
+            episode_ids = list(_added_episodes)
+            _added_episodes.clear()
+            if not episode_ids:
+                _added_worker = None
+                return
+        try:
+            responses = jsonrpc_request([
+                {
+                    "jsonrpc": "2.0", "id": i, "method": "VideoLibrary.GetEpisodeDetails",
+                    "params": {"episodeid": int(episode_id), "properties": ["tvshowid"]},
+                }
+                for i, episode_id in enumerate(episode_ids)
+            ]) or []
+            show_ids = set()
+            for res in responses if isinstance(responses, list) else []:
+                tvshow_id = ((res.get("result") or {}).get("episodedetails") or {}).get("tvshowid") if isinstance(res, dict) else None
+                show_ids.add(tvshow_id)
+            # 查询失败时无法确定所属剧集，全部清除
+            _drop_show_seasons(show_ids or {None})
+        except Exception as e:
+            log(f"Error invalidating season cache for added episodes: {e}")
+
+def _drop_show_seasons(tvshow_ids):
+    with _season_lock:
+        if None in tvshow_ids:
+            # 无法确定所属剧集
+            _season_cache.clear()
+            return
+        show_ids = {int(tvshow_id) for tvshow_id in tvshow_ids}
+        for key in [key for key in _season_cache if key[0] in show_ids]:
+            del _season_cache[key]
+
+def _longest_increasing(values):
+    """返回 values 中最长严格递增子序列的下标列表。"""
+    values = list(values)
+    tail_values, tail_indexes = [], []
+    previous = [-1] * len(values)
+    for idx, value in enumerate(values):
+        k = bisect.bisect_left(tail_values, value)
+        if k:
+            previous[idx] = tail_indexes[k - 1]
+        if k == len(tail_values):
+            tail_values.append(value)
+            tail_indexes.append(idx)
+        else:
+            tail_values[k] = value
+            tail_indexes[k] = idx
+
+    result = []
+    idx = tail_indexes[-1] if tail_indexes else -1
+    while idx >= 0:
+        result.append(idx)
+        idx = previous[idx]
+    result.reverse()
+    return result
+
+
+class PlaylistChangeMonitor(xbmc.Monitor):
+    """统计指定播放列表的 Playlist.OnAdd/OnRemove 通知，确认批量修改已被 Kodi 处理完。"""
+
+    def __init__(self, playlist_id, expected):
+        super().__init__()
+        self.playlist_id = playlist_id
+        self.expected = expected
+        self.received = 0
+
+    def onNotification(self, sender, method, data):
+        if method not in ("Playlist.OnAdd", "Playlist.OnRemove"):
+            return
+        try:
+            playlist_id = json.loads(data).get("playlistid")
+        except (TypeError, ValueError, AttributeError):
+            return
+        if playlist_id != self.playlist_id:
+            return
+        self.received += 1
+
+    def wait(self, timeout):
+        """等待收到全部通知，超时或 Kodi 退出时返回 False。
+
+        Kodi 只在创建 Monitor 的线程处于 waitForAbort/sleep 时才派发 onNotification，
+        因此这里必须用 waitForAbort 轮询，不能用 threading.Event 阻塞。
+        """
+        deadline = time.time() + timeout
+        while self.received < self.expected:
+            if time.time() >= deadline or self.waitForAbort(PLAYLIST_CHANGE_POLL_INTERVAL):
+                return False
+        return True
+
+
 class EpisodePlayList:
     PLAYLIST_ID = 1
 
@@ -145,215 +330,147 @@ class EpisodePlayList:
         for idx, item in enumerate(self.playlist_items):
             item["position"] = idx
 
-    def insert(self, position, episode_item):
-
-        result = jsonrpc_request({
-            "jsonrpc": "2.0",
-            "method": "Playlist.Insert",
-            "params": {
-                "playlistid": self.PLAYLIST_ID,
-                "position": int(position),
-                "item": {"episodeid": episode_item.get("id")},
-            },
-            "id": "Playlist.Insert",
-        })
-        if result != "OK":
-            return False
-
-        position = int(position)
-        if position < 0:
-            position = 0
-        if position > len(self.playlist_items):
-            position = len(self.playlist_items)
-
-        # RPC 成功后同步更新本地缓存，避免再次全量读取播放列表。
-        self.playlist_items.insert(position, {
-            "position": position,
-            "type": "episode",
-            "episode": episode_item.get("episode"),
-            "id": episode_item.get("id"),
-            "season": episode_item.get("season"),
-            "tvshowid": episode_item.get("tvshowid"),
-        })
-        self._reindex_items()
-        xbmc.sleep(PLAYLIST_MUTATION_DELAY_MS)
-        return True
-
-    def remove(self, position):
-        try:
-            position = int(position)
-        except (TypeError, ValueError):
-            return False
-
-        current_position = self.current_play.get("position") if isinstance(self.current_play, dict) else None
-        if isinstance(current_position, int) and position == current_position:
-            log(
-                "Skip removing current playing item: "
-                f"position={position}, playlistid={self.PLAYLIST_ID}"
-            )
-            return False
-
-        result = jsonrpc_request({
-            "jsonrpc": "2.0",
-            "method": "Playlist.Remove",
-            "params": {
-                "playlistid": self.PLAYLIST_ID,
-                "position": position,
-            },
-            "id": "Playlist.Remove",
-        })
-        if result != "OK":
-            return False
-
-        if 0 <= position < len(self.playlist_items):
-            self.playlist_items.pop(position)
-        self._reindex_items()
-        xbmc.sleep(PLAYLIST_MUTATION_DELAY_MS)
+    def _is_current_season(self, item):
+        return item.get("tvshowid") == self.current_season.get("tvshowid") \
+            and item.get("season") == self.current_season.get("season")
 
-        return True
+    def _plan_season_order(self):
+        """计算把当前季排成正确顺序所需的最少修改。
 
-    def _remove_incorrect_order_episodes(self):
-        remove_items = []
+        当前集保持不动；当前集前后已按顺序排列的同季剧集取最长递增子序列保留，其余同季剧集先删除，
+        再和缺失的前后各 MAX_PLAYLIST_ITEMS_BEFORE/AFTER 集一起插入到正确位置。
+        当前集后方出现的更早剧集（含重复的当前集）直接删除，最多 MAX_DELETE_LOWER_EPISODES_BELOW 条。
 
-        if not self.current_play:
-            return 0
+        返回 (removals, inserts, stats)：removals 为要删除的位置；inserts 为 [(位置, [剧集, ...])]，
+        位置以删除完成后的列表为准，每组是一段插在同一位置的连续剧集。
+        """
+        season_episodes = [item for item in self.current_season.get("episodes") or [] if isinstance(item, dict)]
+        rank = {item.get("id"): idx for idx, item in enumerate(season_episodes) if item.get("id") is not None}
+        current_rank = rank.get(self.current_play.get("id"))
+        if current_rank is None:
+            return [], [], {}
+        current_position = self.current_play["position"]
 
-        # 仅处理“当前集后方出现更早剧集”的乱序场景，最多删除 5 条。
-        for item in self.playlist_items[self.current_play["position"] + 1:]:
-            # 只删除同季剧集
-            is_c_tvshow = item.get("tvshowid") == self.current_season.get("tvshowid")
-            is_c_season = is_c_tvshow and item.get("season") == self.current_season.get("season")
-            if not is_c_season:
+        before, after, dropped = [], [], []
+        for item in self.playlist_items:
+            if item is self.current_play or not self._is_current_season(item):
                 continue
-
-            if item['episode'] < self.current_play["episode"]:
-                remove_items.append(item)
-                if len(remove_items) >= MAX_DELETE_LOWER_EPISODES_BELOW:
-                    break
-
-        if remove_items:
-            log(
-                "Playlist remove plan: "
-                f"current_episode={self.current_episode}, "
-                f"remove_after={[item.get('episode') for item in remove_items]}, "
-                f"playlistid={self.PLAYLIST_ID}"
-            )
-
-        removed = 0
-        # 倒序删除，避免位置前移导致后续下标失真。
-        for item in sorted(remove_items, key=lambda candidate: candidate.get("position", -1), reverse=True):
-            pos = item.get("position")
-            if not isinstance(pos, int):
+            item_rank = rank.get(item.get("id"))
+            if item_rank is None:
+                # 不在剧集库中的条目不参与排序
                 continue
-
-            if self.remove(pos):
-                removed += 1
-                log(
-                    "Removed incorrect order item: "
-                    f"episode={item.get('episode')}, id={item.get('id')}, "
-                    f"position={pos}, playlistid={self.PLAYLIST_ID}"
-                )
-        return removed
-
-
-    def _fill_neighbors_around_current(self):
-        insert_before = 0
-        insert_after = 0
-        if not self.current_play:
-            return insert_before, insert_after
-
-        season_episodes = self.current_season.get("episodes")
-        if not isinstance(season_episodes, list):
-            return insert_before, insert_after
-
-        current_episode_idx = -1
-        current_play_id = self.current_play.get("id")
-        for idx, item in enumerate(season_episodes):
-            if not isinstance(item, dict):
+            if item["position"] > current_position and item_rank <= current_rank:
+                if len(dropped) < MAX_DELETE_LOWER_EPISODES_BELOW:
+                    dropped.append(item)
                 continue
-            if item.get("id") == current_play_id:
-                current_episode_idx = idx
-                break
-
-        if current_episode_idx < 0:
-            return insert_before, insert_after
-
-        current_tvshowid = self.current_season.get("tvshowid")
-        current_season_id = self.current_season.get("season")
-        existing_ids = {
-            item.get("id")
-            for item in self.playlist_items
-            if item.get("tvshowid") == current_tvshowid
-            and item.get("season") == current_season_id
-            and item.get("id") is not None
+            (before if item["position"] < current_position else after).append(item)
+
+        candidates = [item for item in before if rank[item["id"]] < current_rank]
+        kept = [candidates[idx] for idx in _longest_increasing(rank[item["id"]] for item in candidates)]
+        kept.append(self.current_play)
+        kept.extend(after[idx] for idx in _longest_increasing(rank[item["id"]] for item in after))
+
+        kept_positions = {item["position"] for item in kept}
+        moved = [item for item in before + after if item["position"] not in kept_positions]
+        removals = sorted(item["position"] for item in dropped + moved)
+
+        kept_ranks = {rank[item["id"]] for item in kept}
+        window = range(max(0, current_rank - MAX_PLAYLIST_ITEMS_BEFORE),
+                       min(len(season_episodes), current_rank + 1 + MAX_PLAYLIST_ITEMS_AFTER))
+        moved_ranks = {rank[item["id"]] for item in moved}
+        missing = sorted((set(window) | moved_ranks) - kept_ranks)
+
+        # 删除完成后各保留条目的新位置
+        removed = set(removals)
+        new_position = {}
+        for item in self.playlist_items:
+            if item["position"] not in removed:
+                new_position[item["position"]] = len(new_position)
+
+        # 缺失的剧集插在第一个比它靠后的保留剧集之前，没有则插在最后一个保留剧集之后
+        groups = {}
+        for missing_rank in missing:
+            anchor = next((item for item in kept if rank[item["id"]] > missing_rank), None)
+            if anchor is not None:
+                position = new_position[anchor["position"]]
+            else:
+                position = new_position[kept[-1]["position"]] + 1
+            groups.setdefault(position, []).append(season_episodes[missing_rank])
+        inserts = sorted(groups.items())
+
+        stats = {
+            "removed_below": len(dropped),
+            "moved": len(moved),
+            "before": sum(1 for idx in missing if idx < current_rank and idx not in moved_ranks),
+            "after": sum(1 for idx in missing if idx > current_rank and idx not in moved_ranks),
         }
-
-        desired_before = season_episodes[max(0, current_episode_idx - MAX_PLAYLIST_ITEMS_BEFORE):current_episode_idx]
-        desired_after = season_episodes[current_episode_idx + 1:current_episode_idx + 1 + MAX_PLAYLIST_ITEMS_AFTER]
-        missing_before = [item for item in desired_before if item.get("id") not in existing_ids]
-        missing_after = [item for item in desired_after if item.get("id") not in existing_ids]
-
-        if missing_before or missing_after:
+        if removals or inserts:
             log(
-                "Playlist fill plan: "
+                "Playlist plan: "
                 f"current_episode={self.current_episode}, "
-                f"missing_before={[item.get('episode') for item in missing_before]}, "
-                f"missing_after={[item.get('episode') for item in missing_after]}, "
+                f"remove={[self.playlist_items[pos].get('episode') for pos in removals]}, "
+                f"insert={[(pos, [ep.get('episode') for ep in eps]) for pos, eps in inserts]}, "
                 f"playlistid={self.PLAYLIST_ID}"
             )
+        return removals, inserts, stats
+
+    def _apply_changes(self, removals, inserts):
+        """在一个 JSON-RPC 批量请求中完成全部删除和插入，并等待 Kodi 发出对应的变更通知。"""
+        payloads = []
+        # 从后往前删除和插入，前面的位置不受影响
+        for position in sorted(removals, reverse=True):
+            payloads.append({
+                "jsonrpc": "2.0",
+                "method": "Playlist.Remove",
+                "params": {"playlistid": self.PLAYLIST_ID, "position": position},
+                "id": f"Playlist.Remove.{position}",
+            })
+        for position, episodes in sorted(inserts, reverse=True, key=lambda group: group[0]):
+            payloads.append({
+                "jsonrpc": "2.0",
+                "method": "Playlist.Insert",
+                "params": {
+                    "playlistid": self.PLAYLIST_ID,
+                    "position": position,
+                    "item": [{"episodeid": episode.get("id")} for episode in episodes],
+                },
+                "id": f"Playlist.Insert.{position}",
+            })
+        if not payloads:
+            return True
+
+        expected = len(removals) + sum(len(episodes) for _, episodes in inserts)
+        monitor = PlaylistChangeMonitor(self.PLAYLIST_ID, expected)
+        responses = jsonrpc_request(payloads)
+        failed = [
+            response for response in responses or []
+            if not isinstance(response, dict) or response.get("result") != "OK"
+        ]
+        if responses is None or failed:
+            log(f"Playlist batch update failed: {failed or responses}", xbmc.LOGWARNING)
+            return False
 
-        def get_insert_position(target_episode):
-            if not isinstance(target_episode, int):
-                return None
-
-            last_same_season_position = None
-            for item in self.playlist_items:
-                is_same_tvshow = item.get("tvshowid") == current_tvshowid
-                is_same_season = is_same_tvshow and item.get("season") == current_season_id
-                if not is_same_season:
-                    continue
-
-                position = item.get("position")
-                last_same_season_position = position
-
-                item_episode = item.get("episode")
-                if item_episode > target_episode:
-                    return position
-
-            if isinstance(last_same_season_position, int):
-                return last_same_season_position + 1
-            return len(self.playlist_items)
-
-        for episode_item in missing_before:
-            insert_pos = get_insert_position(episode_item.get("episode"))
-            if not isinstance(insert_pos, int):
-                continue
-
-            if self.insert(insert_pos, episode_item):
-                insert_before += 1
-                existing_ids.add(episode_item.get("id"))
-                log(
-                    "Inserted missing before item: "
-                    f"episode={episode_item.get('episode')}, id={episode_item.get('id')}, "
-                    f"position={insert_pos}, playlistid={self.PLAYLIST_ID}"
-                )
-
-        for episode_item in missing_after:
-            insert_pos = get_insert_position(episode_item.get("episode"))
-            if not isinstance(insert_pos, int):
-                continue
-
-            if self.insert(insert_pos, episode_item):
-                insert_after += 1
-                existing_ids.add(episode_item.get("id"))
-                log(
-                    "Inserted missing after item: "
-                    f"episode={episode_item.get('episode')}, id={episode_item.get('id')}, "
-                    f"position={insert_pos}, playlistid={self.PLAYLIST_ID}"
-                )
-
-        return insert_before, insert_after
+        if not monitor.wait(PLAYLIST_CHANGE_TIMEOUT):
+            log(
+                "Timed out waiting for playlist notifications: "
+                f"received={monitor.received}, expected={expected}, playlistid={self.PLAYLIST_ID}",
+                xbmc.LOGWARNING
+            )
 
+        # 同步更新本地缓存，避免再次全量读取播放列表
+        removed = set(removals)
+        items = [item for item in self.playlist_items if item["position"] not in removed]
+        for position, episodes in sorted(inserts, reverse=True, key=lambda group: group[0]):
+            items[position:position] = [{
+                "type": "episode",
+                "episode": episode.get("episode"),
+                "id": episode.get("id"),
+                "season": episode.get("season"),
+                "tvshowid": episode.get("tvshowid"),
+            } for episode in episodes]
+        self.playlist_items = items
+        self._reindex_items()
+        return True
 
     def fix_playlist(self):
         try:
@@ -371,12 +488,19 @@ class EpisodePlayList:
         if not is_scraped_tvshow:
             return
 
-        removed_below = self._remove_incorrect_order_episodes()
-        inserted_before, inserted_after = self._fill_neighbors_around_current()
+        removals, inserts, stats = self._plan_season_order()
+        if not removals and not inserts:
+            return
 
-        if removed_below or inserted_before or inserted_after:
-            log(
-                "Synced season playlist: "
-                f"removed_below={removed_below}, before={inserted_before}, after={inserted_after}, "
-                f"playlistid={self.PLAYLIST_ID}"
-            )
+        if not self._apply_changes(removals, inserts):
+            # 部分修改可能已生效，重新读取实际播放列表
+            self.playlist_items = get_playlist_items(self.PLAYLIST_ID)
+            self.current_play = self._find_current_play()
+            return
+
+        log(
+            "Synced season playlist: "
+            f"removed_below={stats['removed_below']}, moved={stats['moved']}, "
+            f"before={stats['before']}, after={stats['after']}, "
+            f"playlistid={self.PLAYLIST_ID}"
+        )
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+筛选窗口空闲时的后台预取。
+
+窗口给出用户下一步可能点击的筛选组合，调度器在用户停止操作一段时间后逐个查询并写入结果缓存。
+每轮预取受查询数和耗时预算限制，一旦有真实刷新或新的操作立即让出。
+"""
+import time
+import threading
+
+import xbmc
+import xbmcgui
+
+from .common import log
+from . import result_cache
+
+# 用户停止操作后等待多久再开始预取（秒）
+PREFETCH_IDLE_DELAY = 0.8
+# 每轮预取最多查询的组合数
+PREFETCH_MAX_QUERIES = 6
+# 每轮预取累计查询耗时上限（秒）
+PREFETCH_MAX_SECONDS = 3.0
+
+
+class PrefetchScheduler:
+    def __init__(self, limit):
+        self.limit = limit
+        self._generation = 0
+        self._candidates = []
+        self._lock = threading.Lock()
+        self._event = threading.Event()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        self.cancel()
+        self._event.set()
+
+    def schedule(self, candidates):
+        """替换待预取的组合列表，重新开始空闲计时。"""
+        with self._lock:
+            self._generation += 1
+            self._candidates = list(candidates)
+        self._event.set()
+
+    def cancel(self):
+        """放弃当前轮次，用于真实刷新开始时让出查询资源。"""
+        with self._lock:
+            self._generation += 1
+            self._candidates = []
+
+    def _should_yield(self, generation):
+        if not self._running or generation != self._generation:
+            return True
+        return xbmcgui.Window(10000).getProperty("MFG.IsRefreshing") == "true"
+
+    def _run(self):
+        monitor = xbmc.Monitor()
+        while self._running and not monitor.abortRequested():
+            self._event.wait()
+            self._event.clear()
+            if not self._running:
+                break
+
+            with self._lock:
+                generation = self._generation
+                candidates = self._candidates
+
+            # 等待用户空闲，期间有新操作则重新计时
+            if monitor.waitForAbort(PREFETCH_IDLE_DELAY):
+                break
+            # 等待正在进行的真实刷新结束
+            while self._running and generation == self._generation \
+                    and xbmcgui.Window(10000).getProperty("MFG.IsRefreshing") == "true":
+                if monitor.waitForAbort(0.2):
+                    return
+            if generation != self._generation:
+                continue
+
+            self._prefetch_round(generation, candidates)
+
+    def _prefetch_round(self, generation, candidates):
+        from .video_library import jsonrpc_get_items, prepare_render_records
+
+        started = time.time()
+        fetched = 0
+        for filters in candidates:
+            if fetched >= PREFETCH_MAX_QUERIES or time.time() - started >= PREFETCH_MAX_SECONDS:
+                break
+            if self._should_yield(generation):
+                log(f"Prefetch yielded after {fetched} combinations")
+                return
+            items, _ = result_cache.get(filters, self.limit)
+            if items is not None:
+                continue
+            try:
+                items = jsonrpc_get_items(filters=dict(filters), limit=self.limit)
+            except Exception as e:
+                log(f"Prefetch failed for {filters}: {e}")
+                continue
+            prepare_render_records(items)
+            # 查询期间状态已变化时结果仍然有效，照常写入
+            result_cache.put(filters, self.limit, items, source="prefetch")
+            fetched += 1
+
+        if fetched:
+            log(f"Prefetched {fetched} combinations in {time.time() - started:.2f}s")
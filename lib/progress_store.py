@@ -0,0 +1,384 @@
+# -*- coding: utf-8 -*-
+import os
+import json
+import time
+import threading
+
+import xbmc
+import xbmcgui
+
+from .common import ADDON_DATA_PATH, jsonrpc_parallel, jsonrpc_request, log
+
+PROGRESS_STORE_FILE = os.path.join(ADDON_DATA_PATH, 'progress_store.json')
+# 电影集 -> 成员电影属性索引，供电影集筛选在本地完成
+SET_INDEX_FILE = os.path.join(ADDON_DATA_PATH, 'set_index.json')
+# service 完成首次全量校正后设置，插件进程据此判断聚合数据是否可信
+READY_PROPERTY = "MFG.ProgressStoreReady"
+# 增量更新可能漏掉部分变化（例如共享数据库被其他设备修改），定期全量校正一次
+RECONCILE_INTERVAL = 1800
+# 收到通知后等待这么久（秒）没有新通知再统一查询和保存，连续标记多集已看时只处理一次
+PROGRESS_UPDATE_DELAY = 1.0
+_EPISODE_PROPERTIES = ["tvshowid", "resume", "runtime"]
+_MOVIE_PROPERTIES = ["setid", "playcount", "resume", "runtime", "rating", "genre", "country", "year"]
+
+
+def _resume_fraction(item):
+    resume = item.get("resume") or {}
+    position = resume.get("position", 0)
+    total = resume.get("total", 0)
+    if total == 0:
+        total = item.get("runtime", 0)
+    if total > 0 and position > 0:
+        # 上限设为 0.99，避免计为完整观看
+        return min(float(position) / float(total), 0.99)
+    return 0.0
+
+
+def load_progress_maps():
+    """
+    读取 service 维护的进度聚合，返回 (show_map, set_map)。
+    show_map 与 get_inprogress_episodes_map 相同，set_map 与 get_movieset_progress_map 相同。
+    service 未就绪时返回 (None, None)，调用方应回退到实时查询。
+    """
+    if xbmcgui.Window(10000).getProperty(READY_PROPERTY) != "true":
+        return None, None
+    try:
+        with open(PROGRESS_STORE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        shows = {int(k): v for k, v in data.get("shows", {}).items()}
+        sets = {int(k): v for k, v in data.get("sets", {}).items()}
+        return shows, sets
+    except Exception as e:
+        log(f"Error loading progress store: {e}")
+        return None, None
+
+
+def load_set_index():
+    """
+    读取 service 维护的电影集索引，返回 {setid: [member, ...]}，member 含 genre/country/year/rating。
+    service 未就绪时返回 None。
+    """
+    if xbmcgui.Window(10000).getProperty(READY_PROPERTY) != "true":
+        return None
+    try:
+        with open(SET_INDEX_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return {int(k): v for k, v in data.items()}
+    except Exception as e:
+        log(f"Error loading set index: {e}")
+        return None
+
+
+class ProgressStore:
+    """
+    在 service 中常驻的剧集/电影集进度聚合。
+    启动时全量构建，之后根据 VideoLibrary.OnUpdate / OnRemove 和 Player.OnStop 通知增量更新，
+    每次变化只重算受影响的剧集或电影集，并写回 PROGRESS_STORE_FILE 供插件进程直接读取。
+    通知在 Monitor 回调中只登记，查询和保存在后台线程中合并处理。
+    """
+
+    def __init__(self):
+        self.episodes = {}        # episodeid -> (tvshowid, fraction)
+        self.show_episodes = {}   # tvshowid -> {episodeid}
+        self.set_movies = {}      # movieid -> {"setid", "watched", "partial", "rating", "genre", "country", "year"}
+        self.set_members = {}     # setid -> {movieid}
+        self.shows = {}
+        self.sets = {}
+        self.last_reconcile = 0
+        self._lock = threading.Lock()
+        # 待处理的增量通知 [(method, payload)]，由后台线程合并处理
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._last_change = 0
+        self._worker = None
+        # 正在进行的全量校正各自的列表，校正查询期间应用的通知记录在其中，替换数据后重新处理
+        self._replays = []
+
+    def needs_reconcile(self):
+        return time.time() - self.last_reconcile > RECONCILE_INTERVAL
+
+    def start_reconcile(self, stale=False):
+        """
+        在后台线程中全量校正。stale 为 True 表示现有聚合已不可信（例如媒体库扫描后），
+        校正完成前清除 READY_PROPERTY，插件进程回退到实时查询。
+        """
+        if stale:
+            xbmcgui.Window(10000).clearProperty(READY_PROPERTY)
+        self.last_reconcile = time.time()
+        threading.Thread(target=self.reconcile, daemon=True).start()
+
+    def reconcile(self):
+        from .video_library import _inprogress_episodes_query, _movieset_movies_query
+        started = time.time()
+        replay = []
+        with self._lock:
+            self._replays.append(replay)
+        try:
+            episodes_data, movies_data = jsonrpc_parallel([_inprogress_episodes_query(), _movieset_movies_query()])
+        except Exception:
+            episodes_data = movies_data = None
+        if episodes_data is None or movies_data is None:
+            with self._lock:
+                self._replays.remove(replay)
+            log("Progress store reconcile failed, keeping previous data", xbmc.LOGWARNING)
+            return False
+
+        with self._lock:
+            self._replays.remove(replay)
+            self.episodes = {}
+            self.show_episodes = {}
+            for ep in episodes_data.get("episodes", []):
+                self._set_episode(ep.get("episodeid"), ep)
+
+            self.set_movies = {}
+            self.set_members = {}
+            for m in movies_data.get("movies", []):
+                self._set_movie(m.get("movieid"), m)
+
+            self.shows = {}
+            for tvshow_id in self.show_episodes:
+                self._recompute_show(tvshow_id)
+            self.sets = {}
+            for set_id in self.set_members:
+                self._recompute_set(set_id)
+
+            self.last_reconcile = time.time()
+            self._save()
+            self._save_set_index()
+
+        if replay:
+            # 这些更新可能早于上面的查询结果生效，被整体替换覆盖，重新查询一次
+            self._queue(replay)
+        xbmcgui.Window(10000).setProperty(READY_PROPERTY, "true")
+        log(f"Progress store reconciled: {len(self.shows)} shows, {len(self.sets)} sets in {time.time() - started:.2f}s")
+        return True
+
+    def handle_notification(self, method, data):
+        """在 Monitor 回调线程中调用，只登记变化，JSON-RPC 查询和保存都在后台线程完成。"""
+        try:
+            payload = json.loads(data) if data else {}
+        except ValueError:
+            payload = {}
+
+        if method in ("VideoLibrary.OnScanFinished", "VideoLibrary.OnCleanFinished"):
+            # 在 Monitor 回调线程中执行会阻塞播放器回调，交给后台线程
+            self.start_reconcile(stale=True)
+            return
+
+        if method in ("VideoLibrary.OnRemove", "VideoLibrary.OnUpdate", "Player.OnStop"):
+            self._queue([(method, payload)])
+
+    def _queue(self, entries):
+        with self._pending_lock:
+            self._pending.extend(entries)
+            self._last_change = time.time()
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._process_pending, daemon=True)
+                self._worker.start()
+
+    def _process_pending(self):
+        while True:
+            with self._pending_lock:
+                wait = self._last_change + PROGRESS_UPDATE_DELAY - time.time()
+                if wait <= 0:
+                    pending, self._pending = self._pending, []
+                    if not pending:
+                        self._worker = None
+                        return
+            if wait > 0:
+                time.sleep(wait)
+                continue
+            try:
+                self._apply_pending(pending)
+            except Exception as e:
+                log(f"Error applying progress store updates: {e}")
+
+    def _apply_pending(self, pending):
+        removed = set()       # (type, id)
+        episode_ids = set()
+        movie_ids = set()
+        for method, payload in pending:
+            if method == "VideoLibrary.OnRemove":
+                if payload.get("id"):
+                    removed.add((payload.get("type"), payload["id"]))
+                continue
+            item = payload.get("item") or {}
+            if not item.get("id"):
+                continue
+            if item.get("type") == "episode":
+                episode_ids.add(item["id"])
+            elif item.get("type") == "movie":
+                movie_ids.add(item["id"])
+        episode_ids -= {item_id for item_type, item_id in removed if item_type == "episode"}
+        movie_ids -= {item_id for item_type, item_id in removed if item_type == "movie"}
+
+        requests = [("episode", i) for i in episode_ids] + [("movie", i) for i in movie_ids]
+        details = []
+        if requests:
+            responses = jsonrpc_request([
+                {
+                    "jsonrpc": "2.0", "id": n,
+                    "method": "VideoLibrary.GetEpisodeDetails" if item_type == "episode" else "VideoLibrary.GetMovieDetails",
+                    "params": {"episodeid": int(item_id), "properties": _EPISODE_PROPERTIES} if item_type == "episode"
+                    else {"movieid": int(item_id), "properties": _MOVIE_PROPERTIES},
+                }
+                for n, (item_type, item_id) in enumerate(requests)
+            ]) or []
+            for res in responses if isinstance(responses, list) else []:
+                if not isinstance(res, dict) or not isinstance(res.get("id"), int):
+                    continue
+                item_type, item_id = requests[res["id"]]
+                record = (res.get("result") or {}).get(f"{item_type}details")
+                if record:
+                    details.append((item_type, item_id, record))
+
+        with self._lock:
+            for replay in self._replays:
+                replay.extend(pending)
+            shows_changed = sets_changed = False
+            for item_type, item_id in removed:
+                changed = self._remove_item(item_type, item_id)
+                shows_changed |= changed and item_type in ("episode", "tvshow")
+                sets_changed |= changed and item_type in ("movie", "set")
+            for item_type, item_id, record in details:
+                if item_type == "episode":
+                    self._update_episode(item_id, record)
+                    shows_changed = True
+                else:
+                    self._update_movie(item_id, record)
+                    sets_changed = True
+            if shows_changed or sets_changed:
+                self._save()
+            if sets_changed:
+                self._save_set_index()
+        log(f"Progress store updated from {len(pending)} notifications: "
+            f"removed={len(removed)}, updated={len(details)}", xbmc.LOGDEBUG)
+
+    def _update_episode(self, episode_id, details):
+        affected = {self.episodes.get(episode_id, (None, 0.0))[0], details.get("tvshowid")}
+        self._drop_episode(episode_id)
+        self._set_episode(episode_id, details)
+        for tvshow_id in affected:
+            if tvshow_id:
+                self._recompute_show(tvshow_id)
+
+    def _update_movie(self, movie_id, details):
+        old = self.set_movies.get(movie_id) or {}
+        affected = {old.get("setid"), details.get("setid")}
+        self._drop_movie(movie_id)
+        self._set_movie(movie_id, details)
+        for set_id in affected:
+            if set_id:
+                self._recompute_set(set_id)
+
+    def _remove_item(self, item_type, item_id):
+        """按删除通知更新聚合，返回是否有变化。"""
+        if item_type == "episode" and item_id in self.episodes:
+            tvshow_id = self.episodes[item_id][0]
+            self._drop_episode(item_id)
+            self._recompute_show(tvshow_id)
+            return True
+        if item_type == "movie" and item_id in self.set_movies:
+            set_id = self.set_movies[item_id]["setid"]
+            self._drop_movie(item_id)
+            self._recompute_set(set_id)
+            return True
+        if item_type == "tvshow" and item_id in self.show_episodes:
+            # 剧集删除时其下的单集不会逐一发送删除通知
+            for episode_id in self.show_episodes.pop(item_id):
+                self.episodes.pop(episode_id, None)
+            self.shows.pop(item_id, None)
+            return True
+        if item_type == "set" and item_id in self.set_members:
+            # 电影集删除后成员电影仍在媒体库中，只是不再属于任何电影集
+            for movie_id in self.set_members.pop(item_id):
+                self.set_movies.pop(movie_id, None)
+            self.sets.pop(item_id, None)
+            return True
+        return False
+
+    def _set_episode(self, episode_id, ep):
+        tvshow_id = ep.get("tvshowid")
+        fraction = _resume_fraction(ep)
+        if not episode_id or not tvshow_id or fraction <= 0:
+            return
+        self.episodes[episode_id] = (tvshow_id, fraction)
+        self.show_episodes.setdefault(tvshow_id, set()).add(episode_id)
+
+    def _drop_episode(self, episode_id):
+        tvshow_id, _ = self.episodes.pop(episode_id, (None, 0.0))
+        if tvshow_id in self.show_episodes:
+            self.show_episodes[tvshow_id].discard(episode_id)
+
+    def _set_movie(self, movie_id, m):
+        set_id = m.get("setid")
+        if not movie_id or not set_id:
+            return
+        watched = m.get("playcount", 0) > 0
+        self.set_movies[movie_id] = {
+            "setid": set_id,
+            "watched": watched,
+            # 仅在未完全观看时计算部分进度
+            "partial": 0.0 if watched else _resume_fraction(m),
+            "rating": m.get("rating", 0.0),
+            "genre": m.get("genre") or [],
+            "country": m.get("country") or [],
+            "year": m.get("year", 0),
+        }
+        self.set_members.setdefault(set_id, set()).add(movie_id)
+
+    def _drop_movie(self, movie_id):
+        old = self.set_movies.pop(movie_id, None)
+        if old and old["setid"] in self.set_members:
+            self.set_members[old["setid"]].discard(movie_id)
+
+    def _recompute_show(self, tvshow_id):
+        episode_ids = self.show_episodes.get(tvshow_id)
+        if not episode_ids:
+            self.show_episodes.pop(tvshow_id, None)
+            self.shows.pop(tvshow_id, None)
+            return
+        self.shows[tvshow_id] = sum(self.episodes[eid][1] for eid in episode_ids)
+
+    def _recompute_set(self, set_id):
+        movie_ids = self.set_members.get(set_id)
+        if not movie_ids:
+            self.set_members.pop(set_id, None)
+            self.sets.pop(set_id, None)
+            return
+        entry = {"total": 0, "watched": 0, "partial": 0.0, "rating_sum": 0.0, "rating_count": 0}
+        for mid in movie_ids:
+            record = self.set_movies[mid]
+            entry["total"] += 1
+            if record["rating"] > 0:
+                entry["rating_sum"] += record["rating"]
+                entry["rating_count"] += 1
+            if record["watched"]:
+                entry["watched"] += 1
+            else:
+                entry["partial"] += record["partial"]
+        self.sets[set_id] = entry
+
+    def _save(self):
+        tmp_path = PROGRESS_STORE_FILE + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"shows": self.shows, "sets": self.sets, "updated": time.time()}, f, separators=(',', ':'))
+            os.replace(tmp_path, PROGRESS_STORE_FILE)
+        except Exception as e:
+            log(f"Error saving progress store: {e}")
+
+    def _save_set_index(self):
+        index = {}
+        for set_id, movie_ids in self.set_members.items():
+            index[set_id] = [
+                {key: self.set_movies[mid][key] for key in ("genre", "country", "year", "rating")}
+                for mid in movie_ids
+            ]
+        tmp_path = SET_INDEX_FILE + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(index, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, SET_INDEX_FILE)
+        except Exception as e:
+            log(f"Error saving set index: {e}")
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+筛选查询的执行路径选择。
+
+同一个 QueryPlan 可以交给 Kodi 执行（VideoLibrary.Get* 带 filter），
+也可以一次取回全部条目后用 local_filter 在 Python 中求值。
+Kodi 对 contains/doesnotcontain 这类规则只能逐行做字符串扫描，规则越多越慢（例如“其他”地区展开为 13 条 doesnotcontain），
+而本地路径的耗时基本只取决于媒体库大小。两条路径的实际耗时都会记录下来，按估算的代价选择更快的一条。
+
+耗时保存在内存中，文件只在首次使用或被其他进程改写后读取；
+jsonrpc_get_items 结束时调用 flush()，只有平滑值相对上次写盘变化明显时才写回文件。
+"""
+import os
+import copy
+import json
+
+from .common import ADDON_DATA_PATH, log
+
+QUERY_COST_FILE = os.path.join(ADDON_DATA_PATH, 'query_costs.json')
+# 新耗时在平滑平均中的权重
+_SMOOTHING = 0.3
+# 本地路径尚无耗时记录时，字符串扫描规则达到此数量才尝试本地路径
+LOCAL_PROBE_RULES = 6
+_SCAN_OPERATORS = ("contains", "doesnotcontain", "startswith")
+# 平滑值相对上次写盘的变化超过此比例才需要重新保存
+SAVE_THRESHOLD = 0.1
+
+_costs = None
+_persisted = {}
+_mtime = None
+
+
+def count_scan_rules(filter_obj):
+    """统计规则树中需要字符串扫描的规则数。"""
+    if not filter_obj:
+        return 0
+    if "and" in filter_obj:
+        return sum(count_scan_rules(sub) for sub in filter_obj["and"])
+    if "or" in filter_obj:
+        return sum(count_scan_rules(sub) for sub in filter_obj["or"])
+    return 1 if filter_obj.get("operator") in _SCAN_OPERATORS else 0
+
+
+def _file_mtime():
+    try:
+        return os.path.getmtime(QUERY_COST_FILE)
+    except OSError:
+        return None
+
+
+def _load():
+    """返回内存中的耗时记录，文件被其他进程更新过时重新读取。"""
+    global _costs, _persisted, _mtime
+    mtime = _file_mtime()
+    if _costs is None or mtime != _mtime:
+        try:
+            with open(QUERY_COST_FILE, 'r', encoding='utf-8') as f:
+                _costs = json.load(f)
+        except (OSError, ValueError):
+            _costs = {}
+        _persisted = copy.deepcopy(_costs)
+        _mtime = mtime
+    return _costs
+
+
+def _changed(old, new):
+    if old is None:
+        return new is not None
+    if new is None:
+        return False
+    return abs(new - old) > SAVE_THRESHOLD * max(abs(old), 1.0)
+
+
+def _needs_save():
+    for media_type, stats in (_costs or {}).items():
+        saved = _persisted.get(media_type, {})
+        if any(_changed(saved.get(key), value) for key, value in stats.items()):
+            return True
+    return False
+
+
+def flush():
+    """平滑值变化明显时写回文件。"""
+    global _persisted, _mtime
+    if not _needs_save():
+        return
+    tmp_path = QUERY_COST_FILE + ".tmp"
+    try:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(_costs, f)
+        os.replace(tmp_path, QUERY_COST_FILE)
+        _persisted = copy.deepcopy(_costs)
+        _mtime = _file_mtime()
+    except Exception as e:
+        log(f"Error saving query costs: {e}")
+
+
+def _smooth(old, new):
+    return new if old is None else old + _SMOOTHING * (new - old)
+
+
+def choose_path(media_type, plan):
+    """返回 "local" 或 "kodi"。"""
+    if not plan.filter_json or not plan.locally_evaluable:
+        return "kodi"
+    rules = count_scan_rules(plan.filter)
+    stats = _load().get(media_type, {})
+    local_cost = stats.get("local")
+    if local_cost is None:
+        return "local" if rules >= LOCAL_PROBE_RULES else "kodi"
+    kodi_base = stats.get("kodi_base")
+    if kodi_base is None:
+        return "kodi"
+    kodi_cost = kodi_base + stats.get("kodi_rule", 0.0) * rules
+    return "local" if local_cost < kodi_cost else "kodi"
+
+
+def record(media_type, path, plan, elapsed):
+    """记录一次查询的实际耗时（秒），用于之后的路径选择。只更新内存，由 flush() 写盘。"""
+    costs = _load()
+    stats = costs.setdefault(media_type, {})
+    elapsed_ms = elapsed * 1000.0
+    if path == "local":
+        stats["local"] = _smooth(stats.get("local"), elapsed_ms)
+    else:
+        rules = count_scan_rules(plan.filter) if plan.filter_json else 0
+        if rules == 0 or stats.get("kodi_base") is None:
+            stats["kodi_base"] = _smooth(stats.get("kodi_base"), elapsed_ms)
+        else:
+            per_rule = max(0.0, (elapsed_ms - stats["kodi_base"]) / rules)
+            stats["kodi_rule"] = _smooth(stats.get("kodi_rule"), per_rule)
+    log(f"{media_type} query via {path}: {elapsed_ms:.0f}ms, costs={stats}")
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+筛选结果缓存：按 (filters, limit) 保存 jsonrpc_get_items 的结果。
+由筛选窗口的后台预取和 filter_list 共同写入，filter_list 命中时无需再次查询。
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+
+import xbmcgui
+
+from .common import ADDON_DATA_PATH, log
+
+RESULT_CACHE_DIR = os.path.join(ADDON_DATA_PATH, 'result_cache')
+# 超过此时间的结果不再使用（播放进度等字段可能已变化）
+RESULT_CACHE_TTL = 300
+MAX_CACHE_ENTRIES = 24
+# service 在媒体库变化时递增，缓存条目记录写入时的值，不一致即失效
+REVISION_PROPERTY = "MFG.LibraryRevision"
+_STATS_PROPERTY = "MFG.ResultCacheStats"
+
+
+def _cache_path(filters, limit):
+    raw = json.dumps([filters, limit], sort_keys=True, ensure_ascii=False)
+    digest = hashlib.sha1(raw.encode('utf-8')).hexdigest()
+    return os.path.join(RESULT_CACHE_DIR, f"{digest}.pickle")
+
+
+def get_revision():
+    return xbmcgui.Window(10000).getProperty(REVISION_PROPERTY)
+
+
+def bump_revision():
+    home = xbmcgui.Window(10000)
+    try:
+        revision = int(home.getProperty(REVISION_PROPERTY) or 0)
+    except ValueError:
+        revision = 0
+    home.setProperty(REVISION_PROPERTY, str(revision + 1))
+
+
+def get(filters, limit):
+    """返回 (items, source)，未命中时返回 (None, None)。"""
+    path = _cache_path(filters, limit)
+    try:
+        with open(path, 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        log(f"Error loading result cache: {e}")
+        return None, None
+
+    if entry.get("revision") != get_revision() or time.time() - entry.get("time", 0) > RESULT_CACHE_TTL:
+        return None, None
+    return entry.get("items"), entry.get("source")
+
+
+def put(filters, limit, items, source="query"):
+    try:
+        if not os.path.exists(RESULT_CACHE_DIR):
+            os.makedirs(RESULT_CACHE_DIR)
+        path = _cache_path(filters, limit)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"revision": get_revision(), "time": time.time(), "source": source, "items": items},
+                        f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, path)
+        _trim()
+    except Exception as e:
+        log(f"Error saving result cache: {e}")
+
+
+def _trim():
+    entries = [os.path.join(RESULT_CACHE_DIR, name) for name in os.listdir(RESULT_CACHE_DIR) if name.endswith(".pickle")]
+    if len(entries) <= MAX_CACHE_ENTRIES:
+        return
+    entries.sort(key=os.path.getmtime)
+    for path in entries[:len(entries) - MAX_CACHE_ENTRIES]:
+        try: os.remove(path)
+        except OSError: pass
+
+
+def record_lookup(source):
+    """
+    记录一次查找结果，source 为命中条目的来源（prefetch/query）或 None（未命中）。
+    返回累计统计 {"prefetch": n, "query": n, "miss": n}，保存在窗口属性中跨进程累计。
+    """
+    home = xbmcgui.Window(10000)
+    try:
+        stats = json.loads(home.getProperty(_STATS_PROPERTY) or "{}")
+    except ValueError:
+        stats = {}
+    key = source or "miss"
+    stats[key] = stats.get(key, 0) + 1
+    home.setProperty(_STATS_PROPERTY, json.dumps(stats))
+    return stats
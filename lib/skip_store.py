@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+片头片尾跳过点的存储。
+
+service 和 default.py 共用同一份读写逻辑。解析后的数据常驻内存，并按 (tvshow_id, season) 建立索引，
+只有文件的修改时间或大小变化时才重新读取，切集时查询跳过点不再重复解析整个 JSON。
+tvshow_id 为剧集库 ID 的字符串，未刮削的文件夹为 "directory:<路径>"；季号同样为字符串。
+
+存储分为两部分：
+  skip_intro_data.json     快照，完整的数据
+  skip_intro_data.journal  日志，每行一条 JSON 记录 {"id", "season", "title", "points"}，points 为空表示删除该季
+记录跳过点只在日志末尾追加一行并 fsync，日志超过 JOURNAL_COMPACT_ENTRIES 条后合并进快照（先写临时文件再原子替换）。
+每条记录都是覆盖写入，重复回放结果不变，因此合并过程中任何时刻崩溃，下次读取快照 + 日志都能得到完整数据；
+日志末尾未写完的一行会被忽略。
+"""
+import os
+import json
+import threading
+
+from .common import ADDON_DATA_PATH, log
+
+SKIP_DATA_FILE = os.path.join(ADDON_DATA_PATH, 'skip_intro_data.json')
+SKIP_JOURNAL_FILE = os.path.join(ADDON_DATA_PATH, 'skip_intro_data.journal')
+# 日志记录数达到此值时合并进快照
+JOURNAL_COMPACT_ENTRIES = 64
+
+
+def _season_points(value):
+    """季数据统一为 {"intro": 秒, "outro": 秒}，兼容只保存片头秒数的旧格式。"""
+    if isinstance(value, dict):
+        return value
+    if isinstance(value, (int, float)):
+        return {"intro": value}
+    return {}
+
+
+def _apply(data, entry):
+    """把一条日志记录应用到数据上。"""
+    tvshow_id = entry["id"]
+    season = entry["season"]
+    points = entry.get("points")
+    record = data.get(tvshow_id)
+
+    if not points:
+        if not isinstance(record, dict):
+            return
+        seasons = record.get("seasons")
+        if seasons is not None:
+            seasons.pop(season, None)
+            if not seasons:
+                del data[tvshow_id]
+        elif "time" in record and season == "1":
+            del data[tvshow_id]
+        return
+
+    if not isinstance(record, dict):
+        record = data[tvshow_id] = {"title": entry.get("title"), "seasons": {}}
+    elif "time" in record:
+        # 迁移旧格式
+        record["seasons"] = {"1": {"intro": record.pop("time")}}
+    record.setdefault("seasons", {})
+    if entry.get("title"):
+        record["title"] = entry["title"]
+    record["seasons"][season] = points
+
+
+def _fsync_dir(path):
+    # 目录项的持久化，部分平台（Windows）不支持打开目录
+    try:
+        fd = os.open(os.path.dirname(path), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+class SkipStore:
+    def __init__(self, path=SKIP_DATA_FILE, journal_path=SKIP_JOURNAL_FILE):
+        self.path = path
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._snapshot_stamp = None
+        self._journal_stamp = None
+        # 已读取的日志字节数和记录数，日志只追加时从这里继续读取
+        self._journal_offset = 0
+        self._journal_entries = 0
+        self._data = {}
+        self._index = {}
+
+    @staticmethod
+    def _file_stamp(path):
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _index_show(self, tvshow_id):
+        # 索引结构 {tvshow_id: {season: points}}；旧格式整部剧只有一个片头时间，记在 season None 下
+        self._index.pop(tvshow_id, None)
+        record = self._data.get(tvshow_id)
+        if not isinstance(record, dict):
+            return
+        seasons = {season: _season_points(value) for season, value in (record.get("seasons") or {}).items()}
+        if "time" in record:
+            seasons[None] = {"intro": record["time"]}
+        self._index[tvshow_id] = seasons
+
+    def _load_snapshot(self):
+        data = {}
+        if self._snapshot_stamp is not None:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except Exception as e:
+                log(f"Error loading skip data: {e}")
+        self._data = data if isinstance(data, dict) else {}
+        self._index = {}
+        for tvshow_id in self._data:
+            self._index_show(tvshow_id)
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+    def _read_journal(self):
+        """从上次读取的位置继续回放日志，末尾不完整的一行留到下次。"""
+        try:
+            with open(self.journal_path, 'rb') as f:
+                f.seek(self._journal_offset)
+                chunk = f.read()
+        except OSError:
+            return
+        end = chunk.rfind(b"\n") + 1
+        for line in chunk[:end].splitlines():
+            if not line.strip():
+                continue
+            try:
+                entry = json.loads(line.decode('utf-8'))
+                _apply(self._data, entry)
+            except Exception as e:
+                log(f"Skipping damaged skip journal entry: {e}")
+                continue
+            self._index_show(entry["id"])
+            self._journal_entries += 1
+        self._journal_offset += end
+
+    def _refresh(self):
+        snapshot_stamp = self._file_stamp(self.path)
+        journal_stamp = self._file_stamp(self.journal_path)
+        if snapshot_stamp == self._snapshot_stamp and journal_stamp == self._journal_stamp:
+            return
+        journal_appended = (
+            snapshot_stamp == self._snapshot_stamp and journal_stamp is not None
+            and self._journal_stamp is not None and journal_stamp[0] == self._journal_stamp[0]
+            and journal_stamp[2] >= self._journal_offset
+        )
+        self._snapshot_stamp = snapshot_stamp
+        self._journal_stamp = journal_stamp
+        if not journal_appended:
+            self._load_snapshot()
+        if journal_stamp is not None:
+            self._read_journal()
+
+    def get(self, tvshow_id, season):
+        """返回该季的跳过点 {"intro", "outro"}（可能只含其一），没有记录时返回 None。"""
+        with self._lock:
+            self._refresh()
+            seasons = self._index.get(tvshow_id)
+            if not seasons:
+                return None
+            points = seasons.get(season) if season in seasons else seasons.get(None)
+            return dict(points) if points is not None else None
+
+    def get_season(self, tvshow_id, season):
+        """返回该季已记录的跳过点用于修改，不使用旧格式对其他季的兜底。没有记录时返回 None。"""
+        with self._lock:
+            self._refresh()
+            seasons = self._index.get(tvshow_id) or {}
+            if season in seasons:
+                return dict(seasons[season])
+            record = self._data.get(tvshow_id)
+            if isinstance(record, dict) and "time" in record and "seasons" not in record and season == "1":
+                return {"intro": record["time"]}
+            return None
+
+    def set_season(self, tvshow_id, season, points, title=None):
+        """保存该季的跳过点，points 为空时删除该季。只追加一条日志记录。"""
+        entry = {"id": tvshow_id, "season": season, "title": title, "points": points or {}}
+        line = (json.dumps(entry, ensure_ascii=False, separators=(',', ':')) + "\n").encode('utf-8')
+        with self._lock:
+            self._refresh()
+            if self._journal_stamp is not None and self._journal_stamp[2] > self._journal_offset:
+                # 上次写入中途崩溃留下不完整的一行，先补上换行，避免与新记录连在一起
+                line = b"\n" + line
+            try:
+                with open(self.journal_path, 'ab') as f:
+                    f.write(line)
+                    f.flush()
+                    os.fsync(f.fileno())
+            except Exception as e:
+                log(f"Error saving skip data: {e}")
+                return False
+            # 自己写入的记录直接回放，保持内存数据与文件一致
+            self._read_journal()
+            self._journal_stamp = self._file_stamp(self.journal_path)
+            if self._journal_entries >= JOURNAL_COMPACT_ENTRIES:
+                self._compact()
+        return True
+
+    def _compact(self):
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False, separators=(',', ':'))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            _fsync_dir(self.path)
+            # 快照已包含全部记录；在删除日志前崩溃只会导致下次重复回放
+            os.remove(self.journal_path)
+            _fsync_dir(self.journal_path)
+        except Exception as e:
+            log(f"Error compacting skip data: {e}")
+            return
+        log(f"Compacted {self._journal_entries} skip journal entries into snapshot")
+        self._snapshot_stamp = self._file_stamp(self.path)
+        self._journal_stamp = None
+        self._journal_offset = 0
+        self._journal_entries = 0
+
+
+_store = None
+
+
+def get_store():
+    global _store
+    if _store is None:
+        _store = SkipStore()
+    return _store
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+外挂字幕查找用的目录列表缓存。
+
+网络共享（SMB/NFS）上文件很多的目录 listdir 一次可能要数秒。每个目录列出一次后缓存 DIR_LISTING_TTL 秒，
+同时按字幕文件可能对应的视频文件名建立索引，同一目录下的重复播放和相邻剧集直接查表。
+"""
+import time
+import threading
+from collections import OrderedDict
+
+import xbmcvfs
+
+from .common import log
+
+SUBTITLE_EXTENSIONS = ('.srt', '.ass', '.ssa', '.sub', '.smi', '.vtt')
+# 目录列表的有效期（秒），过期后重新列出
+DIR_LISTING_TTL = 600
+# 最多缓存的目录数
+MAX_CACHED_DIRS = 32
+# 字幕文件名中，视频文件名之后允许出现的分隔符，例如 movie.srt、movie.en.srt、movie_en.srt
+_SEPARATORS = '.-_'
+
+_lock = threading.Lock()
+_listings = OrderedDict()  # dir_path -> (listed_at, {base_name_lower: [file, ...]})
+
+
+def _subtitle_index(files):
+    """返回 {小写视频文件名: [字幕文件名]}，每个字幕文件登记在所有能与之匹配的视频文件名下。"""
+    index = {}
+    for name in files:
+        lower = name.lower()
+        ext = next((ext for ext in SUBTITLE_EXTENSIONS if lower.endswith(ext)), None)
+        if ext is None:
+            continue
+        stem = lower[:-len(ext)]
+        bases = {stem}
+        for pos, ch in enumerate(stem):
+            if ch in _SEPARATORS:
+                bases.add(stem[:pos])
+        for base in bases:
+            index.setdefault(base, []).append(name)
+    return index
+
+
+def _get_index(dir_path):
+    now = time.time()
+    with _lock:
+        cached = _listings.get(dir_path)
+        if cached and now - cached[0] < DIR_LISTING_TTL:
+            _listings.move_to_end(dir_path)
+            return cached[1]
+
+    started = time.time()
+    dirs, files = xbmcvfs.listdir(dir_path)
+    index = _subtitle_index(files)
+    log(f"Listed {len(files)} files in {dir_path} in {time.time() - started:.2f}s")
+
+    with _lock:
+        _listings[dir_path] = (now, index)
+        _listings.move_to_end(dir_path)
+        while len(_listings) > MAX_CACHED_DIRS:
+            _listings.popitem(last=False)
+    return index
+
+
+def find_subtitles(dir_path, base_name):
+    """返回 dir_path 下与 base_name（不含扩展名的视频文件名）匹配的字幕完整路径，已排序。"""
+    index = _get_index(dir_path)
+    return sorted(dir_path + name for name in index.get(base_name.lower(), []))
+
+
+def invalidate(dir_path=None):
+    """丢弃某个目录（默认全部）的缓存列表，例如媒体库扫描后目录内容可能已变化。"""
+    with _lock:
+        if dir_path is None:
+            _listings.clear()
+        else:
+            _listings.pop(dir_path, None)
@@ -1,8 +1,15 @@
 # -*- coding: utf-8 -*-
-from .common import get_setting, jsonrpc_request, log
+from .common import RawJSON, get_setting, jsonrpc_parallel, jsonrpc_request, log
+from .progress_store import load_progress_maps, load_set_index
+from . import local_filter
+from . import facet_index
+from . import query_cost
 import xbmc
 import xbmcgui
 import datetime
+import json
+import time
+import zlib
 
 
 def get_search_field():
@@ -15,65 +22,89 @@ def get_filter_val(filters, key, default=None):
         return filters[key]
     return default
 
+def filters_from_state(filter_state, t9_input=None):
+    """
+    将筛选窗口的 filter_state（以及 MFG.T9Input 的搜索输入）转换为 jsonrpc_get_items 的 filters，
+    返回 (filters, searching)。default.py 和筛选窗口的按钮计数共用，保证计数与列表结果一致。
+    有搜索输入时只保留影视范围、排序和 T9 条件。
+    """
+    filters = {}
+    for group, item in (filter_state or {}).items():
+        if group == 'filter.rating':
+            for obj in item:
+                val = obj.get('value')
+                if val:
+                    filters[f"{group}.{val}"] = True
+        else:
+            val = item.get('value')
+            if val is not None:
+                filters[group] = val
+
+    t9_value = str(t9_input or "").strip()
+    if not t9_value:
+        return filters, False
+    # 纯数字输入加 | 前缀避免与原始标题内容误匹配，含字母时直接传递
+    if t9_value.isdigit():
+        t9_value = f"|{t9_value}"
+    filters["filter.t9"] = t9_value
+    keys_to_keep = ["filter.mediatype", "filter.sort", "filter.random_seed", "filter.t9"]
+    return {k: v for k, v in filters.items() if k in keys_to_keep}, True
+
 def has_t9_filter(filters):
     t9 = get_filter_val(filters, "filter.t9")
     if t9 is None:
         return False
     return bool(str(t9).strip())
 
-def get_inprogress_episodes_map():
-    """
-    获取所有正在观看的剧集，并返回 {tvshowid: partial_progress_sum} 的映射。
-    单集的进度计算方式为 (resume_position / total_duration)。
-    """
-    try:
-        # 获取正在观看的剧集
-        # 注意："inprogress" 筛选器可能并非在所有 Kodi 版本中都可用，
-        # 但如果获取所有剧集，检查 "resume" 属性是可靠的。
-        # 然而，获取所有剧集开销很大。
-        # 如果可能，我们尝试通过 playcount=0 (未观看) 和 lastplayed (已开始) 进行筛选，
-        # 或者如果可用 (Kodi 18+)，使用 "inprogress" 字段。
-        
-        # 使用 "inprogress" 筛选器
-        flt = {"field": "inprogress", "operator": "true", "value": ""}
-        
-        params = {
-            "jsonrpc": "2.0",
-            "method": "VideoLibrary.GetEpisodes",
-            "params": {
-                "properties": ["tvshowid", "resume", "runtime"],
-                "filter": flt
-            },
-            "id": "inprogress_eps"
-        }
+def _inprogress_episodes_query():
+    # 注意："inprogress" 筛选器可能并非在所有 Kodi 版本中都可用，
+    # 但如果获取所有剧集，检查 "resume" 属性是可靠的。
+    # 然而，获取所有剧集开销很大。
+    # 如果可能，我们尝试通过 playcount=0 (未观看) 和 lastplayed (已开始) 进行筛选，
+    # 或者如果可用 (Kodi 18+)，使用 "inprogress" 字段。
+    return {
+        "jsonrpc": "2.0",
+        "method": "VideoLibrary.GetEpisodes",
+        "params": {
+            "properties": ["tvshowid", "resume", "runtime"],
+            "filter": {"field": "inprogress", "operator": "true", "value": ""}
+        },
+        "id": "inprogress_eps"
+    }
 
-        data = jsonrpc_request(params) or {}
+def _build_inprogress_episodes_map(data):
+    episodes = (data or {}).get("episodes", [])
 
-        episodes = data.get("episodes", [])
+    progress_map = {}
+
+    for ep in episodes:
+        tvshow_id = ep.get("tvshowid")
+        if not tvshow_id:
+            continue
+            
+        resume = ep.get("resume", {})
+        position = resume.get("position", 0)
+        total = resume.get("total", 0)
         
-        progress_map = {}
+        if total == 0:
+            total = ep.get("runtime", 0)
         
-        for ep in episodes:
-            tvshow_id = ep.get("tvshowid")
-            if not tvshow_id:
-                continue
-                
-            resume = ep.get("resume", {})
-            position = resume.get("position", 0)
-            total = resume.get("total", 0)
+        if total > 0 and position > 0:
+            fraction = float(position) / float(total)
+            # 上限设为 0.99，避免计为完整剧集（完整剧集应由 watchedepisodes 处理）
+            if fraction > 0.99: fraction = 0.99
             
-            if total == 0:
-                total = ep.get("runtime", 0)
+            progress_map[tvshow_id] = progress_map.get(tvshow_id, 0.0) + fraction
             
-            if total > 0 and position > 0:
-                fraction = float(position) / float(total)
-                # 上限设为 0.99，避免计为完整剧集（完整剧集应由 watchedepisodes 处理）
-                if fraction > 0.99: fraction = 0.99
-                
-                progress_map[tvshow_id] = progress_map.get(tvshow_id, 0.0) + fraction
-                
-        return progress_map
-        
+    return progress_map
+
+def get_inprogress_episodes_map():
+    """
+    获取所有正在观看的剧集，并返回 {tvshowid: partial_progress_sum} 的映射。
+    单集的进度计算方式为 (resume_position / total_duration)。
+    """
+    try:
+        return _build_inprogress_episodes_map(jsonrpc_request(_inprogress_episodes_query()))
     except Exception as e:
         log(f"Error fetching in-progress episodes: {e}", xbmc.LOGERROR)
         return {}
@@ -310,15 +341,226 @@ def build_sort(filters=None):
     elif sort_key == "lastplayed":
         return {"order": "descending", "method": "lastplayed"}
     elif sort_key == "random":
-        return {"method": "random"}
+        # 种子保存在筛选状态中，同一种子下顺序固定，便于分页和缓存
+        return {"method": "random", "seed": str(get_filter_val(filters, "filter.random_seed", ""))}
     else:
         # “最热” 简单用 播放次数
         return {"order": "descending", "method": "playcount"}
 
+def kodi_sort(sort_obj):
+    """发给 Kodi 的排序参数：随机排序改为在本地按种子洗牌，Kodi 侧不排序。"""
+    if sort_obj.get("method") == "random":
+        return {"method": "none"}
+    return sort_obj
+
+def is_random_sort(sort_obj):
+    return (sort_obj or {}).get("method") == "random"
+
+def _random_rank(seed, m):
+    media_type = m.get("media_type", "movie")
+    item_id = m.get("movieid") or m.get("tvshowid") or m.get("setid") or m.get("title", "")
+    return zlib.crc32(f"{seed}|{media_type}|{item_id}".encode("utf-8"))
+
+# 列表查询 -> (结果字段, media_type, 详情查询, id 字段, 详情结果字段)
+_DETAILS_QUERIES = {
+    "VideoLibrary.GetMovies": ("movies", "movie", "VideoLibrary.GetMovieDetails", "movieid", "moviedetails"),
+    "VideoLibrary.GetTVShows": ("tvshows", "tvshow", "VideoLibrary.GetTVShowDetails", "tvshowid", "tvshowdetails"),
+}
+# 选中的条目不超过此数量时逐条获取详情；更多时 Kodi 串行处理大量 Get*Details 反而更慢，
+# 改为每个查询一次不排序、不分页的 Get* 后按 id 取出（Kodi 的随机排序本来也要取回全部行再排序）
+DETAILS_BATCH_MAX = 60
+
+def _id_query(params, columns, sort=None):
+    """只取 id 和 columns 字段、不分页的查询，sort 为 None 时不排序。"""
+    query = dict(params["params"])
+    query["properties"] = list(columns)
+    query["sort"] = sort if sort is not None else {"method": "none"}
+    query.pop("limits", None)
+    return dict(params, params=query)
+
+def fetch_selected_details(queries, selected):
+    """
+    selected 为 [(查询下标, id 查询返回的行)]，按该顺序返回这些条目的完整属性（queries 中的 properties）。
+    返回 (items, mode)，mode 为 "details" 或 "bulk"，用于耗时日志。
+    """
+    if len(selected) > DETAILS_BATCH_MAX:
+        details_map, mode = _fetch_selected_in_bulk(queries, selected), "bulk"
+    else:
+        details_map, mode = _fetch_selected_one_by_one(queries, selected), "details"
+    items = []
+    for qi, row in selected:
+        details = details_map.get((qi, row[_DETAILS_QUERIES[queries[qi]["method"]][3]]))
+        if not details:
+            continue
+        if "media_type" in row:
+            details["media_type"] = row["media_type"]
+        items.append(details)
+    return items, mode
+
+def _fetch_selected_one_by_one(queries, selected):
+    """逐条 Get*Details（合并为一次批量请求），返回 {(查询下标, id): 完整条目}。"""
+    batch_cmds = []
+    for idx, (qi, row) in enumerate(selected):
+        params = queries[qi]
+        _, _, method, id_key, _ = _DETAILS_QUERIES[params["method"]]
+        batch_cmds.append({
+            "jsonrpc": "2.0", "id": idx, "method": method,
+            "params": {id_key: row[id_key], "properties": params["params"]["properties"]}
+        })
+    responses = (jsonrpc_request(batch_cmds) or []) if batch_cmds else []
+    by_request = {}
+    for res in responses if isinstance(responses, list) else []:
+        if isinstance(res, dict) and isinstance(res.get("result"), dict):
+            by_request[res.get("id")] = res["result"]
+
+    details_map = {}
+    for idx, (qi, row) in enumerate(selected):
+        _, _, _, id_key, details_key = _DETAILS_QUERIES[queries[qi]["method"]]
+        details = by_request.get(idx, {}).get(details_key)
+        if details:
+            details_map[(qi, row[id_key])] = details
+    return details_map
+
+def _fetch_selected_in_bulk(queries, selected):
+    """对含有选中条目的查询各执行一次不排序、不分页的 Get*，返回 {(查询下标, id): 完整条目}。"""
+    wanted = {}
+    for qi, row in selected:
+        wanted.setdefault(qi, set()).add(row[_DETAILS_QUERIES[queries[qi]["method"]][3]])
+    indexes = sorted(wanted)
+    bulk_queries = []
+    for qi in indexes:
+        query = dict(queries[qi]["params"])
+        query["sort"] = {"method": "none"}
+        query.pop("limits", None)
+        bulk_queries.append(dict(queries[qi], params=query))
+
+    details_map = {}
+    for qi, data in zip(indexes, jsonrpc_parallel(bulk_queries)):
+        result_key, _, _, id_key, _ = _DETAILS_QUERIES[queries[qi]["method"]]
+        ids = wanted[qi]
+        for row in (data or {}).get(result_key, []):
+            if row.get(id_key) in ids:
+                details_map[(qi, row[id_key])] = row
+    return details_map
+
+def fetch_random_page(queries, sort_obj, limit, accept=None, columns=(), extra_queries=()):
+    """
+    随机排序的一页：先只取 id（以及 accept 需要的 columns 字段）按种子排序，截取前 limit 条后再获取这些条目的完整属性。
+    queries 为普通的 GetMovies/GetTVShows 请求，其中的 properties 用于详情查询；accept 可以修改条目（例如改写 media_type）。
+    extra_queries 与 id 查询并发执行，返回 (items, extra_results)。
+    """
+    started = time.time()
+    results = jsonrpc_parallel([_id_query(params, columns) for params in queries] + list(extra_queries))
+    ids_done = time.time()
+
+    seed = sort_obj.get("seed", "")
+    ranked = []   # [(随机序, 查询下标, 行)]
+    for qi, (params, data) in enumerate(zip(queries, results)):
+        result_key, media_type = _DETAILS_QUERIES[params["method"]][:2]
+        for row in (data or {}).get(result_key, []):
+            row["media_type"] = media_type
+            if accept is not None and not accept(row):
+                continue
+            ranked.append((_random_rank(seed, row), qi, row))
+    ranked.sort(key=lambda entry: entry[0])
+
+    items, mode = fetch_selected_details(queries, [(qi, row) for _, qi, row in ranked[:limit]])
+    log(f"Random page: {len(items)} items, ids {(ids_done - started) * 1000:.0f}ms, "
+        f"{mode} {(time.time() - ids_done) * 1000:.0f}ms")
+    return items, results[len(queries):]
+
+# 各类规则命中条目比例的粗略估计，用于估算整个查询的选择度
+_RULE_SELECTIVITY = {
+    ("genre", "contains"): 0.15,
+    ("country", "contains"): 0.2,
+    ("tag", "contains"): 0.2,
+    ("country", "doesnotcontain"): 0.9,
+    ("tag", "doesnotcontain"): 0.9,
+    ("year", "is"): 0.05,
+    ("year", "between"): 0.2,
+    ("year", "lessthan"): 0.1,
+    ("rating", "between"): 0.25,
+    ("rating", "lessthan"): 0.3,
+    ("title", "startswith"): 0.05,
+}
+_DEFAULT_RULE_SELECTIVITY = 0.1
+# 进程内的计划缓存，只对长驻进程有效：筛选窗口在用户切换条件时反复编译相同的组合，
+# 后台预取（prefetch）也在同一进程中查询。default.py 每次插件调用都是新进程，
+# 基本不会命中；编译一个计划只需构造规则并序列化，不值得为它持久化，因此该路径保持不缓存。
+_PLAN_CACHE_SIZE = 64
+_plan_cache = {}
+
+
+def _estimate_selectivity(filter_obj):
+    if not filter_obj:
+        return 1.0
+    if "and" in filter_obj:
+        result = 1.0
+        for sub in filter_obj["and"]:
+            result *= _estimate_selectivity(sub)
+        return result
+    if "or" in filter_obj:
+        return min(1.0, sum(_estimate_selectivity(sub) for sub in filter_obj["or"]))
+    return _RULE_SELECTIVITY.get((filter_obj.get("field"), filter_obj.get("operator")), _DEFAULT_RULE_SELECTIVITY)
+
+
+class QueryPlan:
+    """
+    build_filter/build_sort 的编译结果，创建后不可修改。
+    filter_json/sort_json 为预先序列化的 JSON 片段，可直接放入请求参数；
+    filter/sort 每次返回新的副本，供本地求值或需要追加规则的调用方使用。
+    """
+    __slots__ = ("media_type", "filter_json", "sort_json", "selectivity", "locally_evaluable", "_filter_text", "_sort_text")
+
+    def __init__(self, media_type, filter_obj, sort_obj):
+        set_attr = object.__setattr__
+        set_attr(self, "media_type", media_type)
+        set_attr(self, "_filter_text", json.dumps(filter_obj) if filter_obj else None)
+        set_attr(self, "_sort_text", json.dumps(sort_obj))
+        set_attr(self, "filter_json", RawJSON(self._filter_text) if filter_obj else None)
+        set_attr(self, "sort_json", RawJSON(json.dumps(kodi_sort(sort_obj))))
+        set_attr(self, "selectivity", _estimate_selectivity(filter_obj))
+        set_attr(self, "locally_evaluable", local_filter.is_supported(filter_obj))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("QueryPlan is immutable")
+
+    @property
+    def filter(self):
+        return json.loads(self._filter_text) if self._filter_text else None
+
+    @property
+    def sort(self):
+        return json.loads(self._sort_text)
+
+
+def get_query_plan(filters, media_type):
+    """返回 (filters, media_type) 对应的 QueryPlan，同一进程内相同条件复用已编译的计划。"""
+    key_parts = [json.dumps(filters or {}, sort_keys=True, ensure_ascii=False), media_type,
+                 datetime.datetime.now().year]
+    if has_t9_filter(filters):
+        # T9 规则依赖用户选择的搜索字段
+        key_parts.append(get_search_field())
+    key = tuple(key_parts)
+
+    plan = _plan_cache.get(key)
+    if plan is None:
+        if len(_plan_cache) >= _PLAN_CACHE_SIZE:
+            _plan_cache.clear()
+        plan = QueryPlan(media_type, build_filter(filters, media_type=media_type), build_sort(filters))
+        _plan_cache[key] = plan
+        log(f"Compiled {media_type} query plan: selectivity={plan.selectivity:.3f}, local={plan.locally_evaluable}", xbmc.LOGDEBUG)
+    return plan
+
 def sort_items_locally(items, sort_obj):
     if not sort_obj:
         return items
     method = sort_obj.get("method")
+    if method == "random":
+        # 按 (种子, 条目) 的哈希排序：与输入顺序无关，相同种子下结果稳定
+        seed = sort_obj.get("seed", "")
+        items.sort(key=lambda m: _random_rank(seed, m))
+        return items
     order = sort_obj.get("order", "descending")
     reverse = (order == "descending")
     
@@ -428,7 +670,7 @@ def get_documentary_items(limit, filters=None):
         "params": {
             "properties": movie_props,
             "limits": {"start": 0, "end": limit},
-            "sort": sort_obj,
+            "sort": kodi_sort(sort_obj),
             "filter": filter_obj_movie
         }
     }
@@ -441,13 +683,15 @@ def get_documentary_items(limit, filters=None):
         "params": {
             "properties": tv_props,
             "limits": {"start": 0, "end": limit},
-            "sort": sort_obj,
+            "sort": kodi_sort(sort_obj),
             "filter": filter_obj_tv
         }
     }
 
     # 执行批量请求
     batch_cmds = [params_movies, params_tv]
+    if is_random_sort(sort_obj):
+        return fetch_random_page(batch_cmds, sort_obj, limit)[0]
     items = []
     
     try:
@@ -476,71 +720,149 @@ def get_documentary_items(limit, filters=None):
     # 我们应该切片到限制大小。
     return items[:limit]
 
-def get_movieset_progress_map():
-    """
-    获取所有属于电影集的电影，并计算每个电影集的 {setid: {'total': count, 'watched': count, 'partial': float}}
-    """
-    try:
-        # 筛选属于任何电影集的电影 (set != "")
-        flt = {"field": "set", "operator": "isnot", "value": ""}
-        
-        params = {
-            "jsonrpc": "2.0",
-            "method": "VideoLibrary.GetMovies",
-            "params": {
-                "properties": ["setid", "playcount", "resume", "runtime", "rating"],
-                "filter": flt
-            },
-            "id": "set_movies"
-        }
-
-        data = jsonrpc_request(params) or {}
+def _movieset_movies_query():
+    # 筛选属于任何电影集的电影 (set != "")
+    return {
+        "jsonrpc": "2.0",
+        "method": "VideoLibrary.GetMovies",
+        "params": {
+            "properties": ["setid", "playcount", "resume", "runtime", "rating", "genre", "country", "year"],
+            "filter": {"field": "set", "operator": "isnot", "value": ""}
+        },
+        "id": "set_movies"
+    }
 
-        movies = data.get("movies", [])
+def _build_movieset_progress_map(data):
+    movies = (data or {}).get("movies", [])
+    
+    progress_map = {}
+    
+    for m in movies:
+        set_id = m.get("setid")
+        if not set_id:
+            continue
+            
+        if set_id not in progress_map:
+            progress_map[set_id] = {"total": 0, "watched": 0, "partial": 0.0, "rating_sum": 0.0, "rating_count": 0}
         
-        progress_map = {}
+        progress_map[set_id]["total"] += 1
         
-        for m in movies:
-            set_id = m.get("setid")
-            if not set_id:
-                continue
-                
-            if set_id not in progress_map:
-                progress_map[set_id] = {"total": 0, "watched": 0, "partial": 0.0, "rating_sum": 0.0, "rating_count": 0}
+        # Rating calculation
+        rating = m.get("rating", 0.0)
+        if rating > 0:
+            progress_map[set_id]["rating_sum"] += rating
+            progress_map[set_id]["rating_count"] += 1
+
+        playcount = m.get("playcount", 0)
+        if playcount > 0:
+            progress_map[set_id]["watched"] += 1
+        else:
+            # 仅在未完全观看时计算部分进度
+            resume = m.get("resume", {})
+            position = resume.get("position", 0)
+            total = resume.get("total", 0)
+            if total == 0: total = m.get("runtime", 0)
             
-            progress_map[set_id]["total"] += 1
+            if total > 0 and position > 0:
+                fraction = float(position) / float(total)
+                if fraction > 0.99: fraction = 0.99 # 如果未标记为已观看，则上限为 0.99
+                progress_map[set_id]["partial"] += fraction
             
-            # Rating calculation
-            rating = m.get("rating", 0.0)
-            if rating > 0:
-                progress_map[set_id]["rating_sum"] += rating
-                progress_map[set_id]["rating_count"] += 1
-
-            playcount = m.get("playcount", 0)
-            if playcount > 0:
-                progress_map[set_id]["watched"] += 1
-            else:
-                # 仅在未完全观看时计算部分进度
-                resume = m.get("resume", {})
-                position = resume.get("position", 0)
-                total = resume.get("total", 0)
-                if total == 0: total = m.get("runtime", 0)
-                
-                if total > 0 and position > 0:
-                    fraction = float(position) / float(total)
-                    if fraction > 0.99: fraction = 0.99 # 如果未标记为已观看，则上限为 0.99
-                    progress_map[set_id]["partial"] += fraction
-                
-        return progress_map
-        
+    return progress_map
+
+def get_movieset_progress_map():
+    """
+    获取所有属于电影集的电影，并计算每个电影集的 {setid: {'total': count, 'watched': count, 'partial': float}}
+    """
+    try:
+        return _build_movieset_progress_map(jsonrpc_request(_movieset_movies_query()))
     except Exception as e:
         log(f"Error fetching movieset progress: {e}")
         return {}
 
+def _execute_plan(params, result_key, plan, limit, columns, extra_queries=()):
+    """
+    按代价选择在 Kodi 侧筛选，或在本地求值：本地路径只取回 id 和规则用到的字段（按 Kodi 排序），
+    求值后只为命中的前 limit 条获取完整属性。记录主查询、本地求值和详情查询的耗时。
+    extra_queries 与主查询并发执行，返回 (items, extra_results)。
+    """
+    path = query_cost.choose_path(plan.media_type, plan)
+    if is_random_sort(plan.sort):
+        # 随机排序只取 id（本地求值时加上规则用到的字段）参与洗牌
+        accept, id_columns = None, ()
+        if path == "local":
+            params = dict(params, params={k: v for k, v in params["params"].items() if k != "filter"})
+            filter_obj = plan.filter
+            accept = lambda item: local_filter.matches(filter_obj, item)
+            id_columns = sorted(local_filter.fields(filter_obj))
+        return fetch_random_page([params], plan.sort, limit, accept, id_columns, extra_queries)
+
+    filter_obj = plan.filter
+    query = params
+    if path == "local":
+        unfiltered = dict(params, params={k: v for k, v in params["params"].items() if k != "filter"})
+        query = _id_query(unfiltered, sorted(local_filter.fields(filter_obj) | set(columns)), params["params"].get("sort"))
+
+    # 只计主查询自身的耗时、本地求值和详情查询，不含并发的附加查询
+    timings = []
+    results = jsonrpc_parallel([query] + list(extra_queries), timings=timings)
+    items = (results[0] or {}).get(result_key, [])
+    started = time.time() - timings[0]
+    if path == "local":
+        matched = []
+        for row in items:
+            if local_filter.matches(filter_obj, row):
+                matched.append((0, row))
+                if len(matched) >= limit:
+                    break
+        items, _ = fetch_selected_details([unfiltered], matched)
+    query_cost.record(plan.media_type, path, plan, time.time() - started)
+    return items, results[1:]
+
+# 后过滤查询的首个分页大小下限，之后每页翻倍
+OVERFETCH_MIN_CHUNK = 50
+
+def fetch_until_full(params, result_key, accept, limit):
+    """
+    按 limits.start/end 分页拉取，每页大小翻倍，直到 accept 通过的条目达到 limit 或数据源耗尽。
+    用于 Kodi 侧无法完整表达、需要本地后过滤的查询；limit 为 None 时一次取回全部。
+    """
+    query = dict(params["params"])
+    if limit is None:
+        query.pop("limits", None)
+        data = jsonrpc_request(dict(params, params=query)) or {}
+        return [item for item in data.get(result_key, []) if accept(item)]
+
+    accepted = []
+    start = 0
+    chunk = max(limit, OVERFETCH_MIN_CHUNK)
+    pages = 0
+    while True:
+        query["limits"] = {"start": start, "end": start + chunk}
+        data = jsonrpc_request(dict(params, params=query)) or {}
+        page = data.get(result_key, [])
+        pages += 1
+        for item in page:
+            if accept(item):
+                accepted.append(item)
+                if len(accepted) >= limit:
+                    log(f"fetch_until_full {result_key}: {limit} rows after {pages} pages, {start + len(page)} scanned", xbmc.LOGDEBUG)
+                    return accepted
+        start += len(page)
+        total = (data.get("limits") or {}).get("total")
+        if len(page) < chunk or (total is not None and start >= total):
+            return accepted
+        chunk *= 2
+
 def get_movie_items(filters, limit):
-    sort_obj = build_sort(filters)
+    plan = get_query_plan(filters, "movie")
+    sort_obj = plan.sort
+
+    # 仅含类型/地区/年份/评分条件时直接由本地位图索引给出结果
+    items = facet_index.query_items(("movie",), filters, limit, sort_obj)
+    if items is not None:
+        return items
 
-    filter_obj = build_filter(filters, media_type="movie")
     props = ["title", "art", "dateadded", "rating", "year", "resume", "runtime", "lastplayed", "playcount", "file"]
     if has_t9_filter(filters):
         props.append(get_search_field())
@@ -551,21 +873,20 @@ def get_movie_items(filters, limit):
         "params": {
             "properties": props,
             "limits": {"start": 0, "end": limit},
-            "sort": sort_obj
+            "sort": plan.sort_json
         }
     }
-    if filter_obj: params["params"]["filter"] = filter_obj
+    if plan.filter_json: params["params"]["filter"] = plan.filter_json
 
-    data = jsonrpc_request(params) or {}
-    items = data.get("movies", [])
+    items, _ = _execute_plan(params, "movies", plan, limit, ["genre", "country"])
     for item in items: item["media_type"] = "movie"
 
-    return sort_items_locally(items, sort_obj)
+    return sort_items_locally(items, sort_obj)[:limit]
 
 def get_tvshow_items(filters, limit):
-    sort_obj = build_sort(filters)
+    plan = get_query_plan(filters, "tvshow")
+    sort_obj = plan.sort
 
-    filter_obj = build_filter(filters, media_type="tvshow")
     props = ["title", "art", "dateadded", "rating", "year", "episode", "watchedepisodes", "lastplayed", "playcount", "file"]
     if has_t9_filter(filters):
         props.append(get_search_field())
@@ -576,23 +897,35 @@ def get_tvshow_items(filters, limit):
         "params": {
             "properties": props,
             "limits": {"start": 0, "end": limit},
-            "sort": sort_obj
+            "sort": plan.sort_json
         }
     }
-    if filter_obj: params["params"]["filter"] = filter_obj
-
-    data = jsonrpc_request(params) or {}
-    items = data.get("tvshows", [])
+    if plan.filter_json: params["params"]["filter"] = plan.filter_json
+
+    # 优先使用 service 维护的进度聚合；未就绪时与剧集列表并发查询
+    partial_progress_map, _ = load_progress_maps()
+    items = facet_index.query_items(("tvshow",), filters, limit, sort_obj)
+    if items is not None:
+        if partial_progress_map is None:
+            partial_progress_map = get_inprogress_episodes_map()
+    elif partial_progress_map is None:
+        items, (inprogress_data,) = _execute_plan(params, "tvshows", plan, limit, ["genre", "tag"],
+                                                  [_inprogress_episodes_query()])
+        partial_progress_map = _build_inprogress_episodes_map(inprogress_data)
+    else:
+        items, _ = _execute_plan(params, "tvshows", plan, limit, ["genre", "tag"])
 
     # Attach partial progress
-    partial_progress_map = get_inprogress_episodes_map()
     for item in items:
         item["media_type"] = "tvshow"
         tid = item.get("tvshowid")
         if tid:
             item["partial_progress"] = partial_progress_map.get(tid, 0.0)
 
-    return sort_items_locally(items, sort_obj)
+    return sort_items_locally(items, sort_obj)[:limit]
+
+# 电影集未取回 year/dateadded，这两种排序下本地排序保持 Kodi 返回的顺序
+_KODI_ORDERED_SET_SORTS = ("year", "dateadded")
 
 def get_set_items(filters, limit):
     sort_obj = build_sort(filters)
@@ -605,18 +938,13 @@ def get_set_items(filters, limit):
 
     has_complex = (region_val and region_val != "地区") or rating_active or (genre_val and genre_val != "类型") or (year_val and year_val != "年份")
 
-    # Initial fetch
-    # Always fetch a large number to allow local filtering of single-movie sets
-    fetch_limit = 20000
-
     props = ["title", "art", "plot", "playcount"]
     params = {
         "jsonrpc": "2.0", "id": "sets",
         "method": "VideoLibrary.GetMovieSets",
         "params": {
             "properties": props,
-            "limits": {"start": 0, "end": fetch_limit},
-            "sort": sort_obj
+            "sort": kodi_sort(sort_obj)
         }
     }
 
@@ -627,75 +955,154 @@ def get_set_items(filters, limit):
     set_basic_filter = build_filter(basic_filters, media_type="set")
     if set_basic_filter: params["params"]["filter"] = set_basic_filter
 
-    data = jsonrpc_request(params) or {}
-    items = data.get("sets", [])
+    # service 维护了电影集索引时，筛选和单片电影集排除全部在本地完成
+    _, set_progress_map = load_progress_maps()
+    set_index = load_set_index() if set_progress_map is not None else None
+    if set_index is not None:
+        return _get_indexed_set_items(filters, limit, sort_obj, set_basic_filter, set_index, set_progress_map)
+
+    # 复杂条件通过电影查询反查符合条件的 setid
+    params_lookup = None
+    if has_complex:
+        movie_filters_dict = filters.copy() if filters else {}
+        if "filter.letter" in movie_filters_dict: del movie_filters_dict["filter.letter"]
+
+        # 计划中的规则是副本，可以直接追加
+        movie_filter = get_query_plan(movie_filters_dict, "movie").filter
+        set_rule = {"field": "set", "operator": "isnot", "value": ""}
+
+        if movie_filter:
+            if "and" in movie_filter: movie_filter["and"].append(set_rule)
+            else: movie_filter = {"and": [movie_filter, set_rule]}
+        else:
+            movie_filter = {"and": [set_rule]}
+
+        params_lookup = {
+            "jsonrpc": "2.0", "method": "VideoLibrary.GetMovies",
+            "params": {"properties": ["setid"], "filter": movie_filter},
+            "id": "set_complex_lookup"
+        }
+
+    # 反查和电影集进度互不依赖，并发查询；
+    # service 已维护电影集进度聚合时省去电影集成员查询
+    queries = []
+    if params_lookup:
+        queries.append(params_lookup)
+    if set_progress_map is None:
+        queries.append(_movieset_movies_query())
+    results = jsonrpc_parallel(queries)
+    lookup_data = results[0] if params_lookup else None
+    if set_progress_map is None:
+        set_progress_map = _build_movieset_progress_map(results[-1])
 
     # T9 本地过滤（GetMovieSets 不支持 plot filter）
     t9_val = get_filter_val(filters, "filter.t9")
-    if t9_val is not None:
-        t9_token = str(t9_val).strip()
-        if t9_token:
-            items = [x for x in items if t9_token in (x.get("plot") or "")]
+    t9_token = str(t9_val).strip() if t9_val is not None else ""
 
     # Post-filter if complex
-    if has_complex:
-        try:
-            movie_filters_dict = filters.copy() if filters else {}
-            if "filter.letter" in movie_filters_dict: del movie_filters_dict["filter.letter"]
+    valid_set_ids = None
+    if params_lookup:
+        movies = (lookup_data or {}).get("movies", [])
+        valid_set_ids = {m.get("setid") for m in movies if m.get("setid")}
 
-            movie_filter = build_filter(movie_filters_dict, media_type="movie")
-            set_rule = {"field": "set", "operator": "isnot", "value": ""}
+    def accept(item):
+        sid = item.get("setid")
+        if t9_token and t9_token not in (item.get("plot") or ""):
+            return False
+        if valid_set_ids is not None and sid not in valid_set_ids:
+            return False
+        # Filter out sets with only 1 movie
+        progress = set_progress_map.get(sid) if sid else None
+        if not progress or progress["total"] <= 1:
+            return False
+        item["media_type"] = "set"
+        _attach_set_progress(item, progress)
+        return True
+
+    # 本地排序与 Kodi 顺序一致时分页拉取到够数即停，否则需要全部电影集参与本地排序
+    page_limit = limit if sort_obj.get("method") in _KODI_ORDERED_SET_SORTS else None
+    items = fetch_until_full(params, "sets", accept, page_limit)
 
-            if movie_filter:
-                if "and" in movie_filter: movie_filter["and"].append(set_rule)
-                else: movie_filter = {"and": [movie_filter, set_rule]}
-            else:
-                movie_filter = {"and": [set_rule]}
+    return sort_items_locally(items, sort_obj)[:limit]
 
-            params_lookup = {
-                "jsonrpc": "2.0", "method": "VideoLibrary.GetMovies",
-                "params": {"properties": ["setid"], "filter": movie_filter},
-                "id": "set_complex_lookup"
-            }
-            lookup_data = jsonrpc_request(params_lookup) or {}
-            movies = lookup_data.get("movies", [])
-            valid_set_ids = {m.get("setid") for m in movies if m.get("setid")}
+def _attach_set_progress(item, progress):
+    item["total"] = progress["total"]
+    item["watched"] = progress["watched"]
+    item["partial_progress"] = progress["partial"]
 
-            items = [x for x in items if x.get("setid") in valid_set_ids]
-            # items = items[:limit] # Don't slice here yet, wait for single-movie filter
-        except Exception as e:
-            log(f"Error in set complex post-filter: {e}")
+    # Calculate average rating
+    r_count = progress.get("rating_count", 0)
+    if r_count > 0:
+        item["rating"] = round(progress.get("rating_sum", 0.0) / r_count, 1)
 
-    for item in items: item["media_type"] = "set"
+def _get_indexed_set_items(filters, limit, sort_obj, set_basic_filter, set_index, set_progress_map):
+    """基于电影集索引在本地筛选，只为最终结果页获取海报等展示字段。"""
+    movie_filters = {k: v for k, v in (filters or {}).items() if k not in ("filter.letter", "filter.t9")}
+    movie_filter = get_query_plan(movie_filters, "movie").filter
 
-    # Attach set progress and filter single-movie sets
-    set_progress_map = get_movieset_progress_map()
-    filtered_items = []
-    
-    for item in items:
+    t9_val = get_filter_val(filters, "filter.t9")
+    t9_token = str(t9_val).strip() if t9_val is not None else ""
+
+    # 只取 setid/label 及排序、T9 需要的轻量字段
+    props = ["playcount"]
+    if t9_token:
+        props.append("plot")
+    params = {
+        "jsonrpc": "2.0", "id": "sets_index",
+        "method": "VideoLibrary.GetMovieSets",
+        "params": {"properties": props, "sort": kodi_sort(sort_obj)}
+    }
+    if set_basic_filter: params["params"]["filter"] = set_basic_filter
+    data = jsonrpc_request(params) or {}
+
+    items = []
+    for item in data.get("sets", []):
         sid = item.get("setid")
-        if sid and sid in set_progress_map:
-            total = set_progress_map[sid]["total"]
-            
-            # Filter out sets with only 1 movie
-            if total <= 1:
-                continue
-                
-            item["total"] = total
-            item["watched"] = set_progress_map[sid]["watched"]
-            item["partial_progress"] = set_progress_map[sid]["partial"]
-            
-            # Calculate average rating
-            r_sum = set_progress_map[sid].get("rating_sum", 0.0)
-            r_count = set_progress_map[sid].get("rating_count", 0)
-            if r_count > 0:
-                item["rating"] = round(r_sum / r_count, 1)
-            
-            filtered_items.append(item)
-            
-    items = filtered_items
+        progress = set_progress_map.get(sid)
+        # Filter out sets with only 1 movie
+        if not progress or progress["total"] <= 1:
+            continue
+        if t9_token and t9_token not in (item.get("plot") or ""):
+            continue
+        # 任一成员电影满足全部电影筛选条件即保留该电影集
+        if movie_filter and not any(local_filter.matches(movie_filter, m) for m in set_index.get(sid, [])):
+            continue
+        item["media_type"] = "set"
+        _attach_set_progress(item, progress)
+        items.append(item)
+
+    items = sort_items_locally(items, sort_obj)[:limit]
+    if not items:
+        return items
 
-    return sort_items_locally(items, sort_obj)[:limit]
+    batch_cmds = [
+        {
+            "jsonrpc": "2.0", "id": item["setid"], "method": "VideoLibrary.GetMovieSetDetails",
+            "params": {
+                "setid": item["setid"],
+                "properties": ["title", "art", "plot", "playcount"],
+                "movies": {"properties": [], "limits": {"start": 0, "end": 1}}
+            }
+        }
+        for item in items
+    ]
+    details_map = {}
+    results = jsonrpc_request(batch_cmds) or []
+    if isinstance(results, list):
+        for res in results:
+            details = (res.get("result") or {}).get("setdetails") if isinstance(res, dict) else None
+            if details:
+                details.pop("movies", None)
+                details_map[res.get("id")] = details
+
+    for item in items:
+        details = details_map.get(item["setid"], {})
+        for key in ("title", "art", "plot", "playcount"):
+            if key in details:
+                item[key] = details[key]
+        item.setdefault("title", item.get("label", ""))
+
+    return items
 
 def get_concert_items(filters, limit):
     # 演唱会仅查询电影，并在原筛选条件上追加音乐类型条件。
@@ -727,22 +1134,23 @@ def get_concert_items(filters, limit):
         "method": "VideoLibrary.GetMovies",
         "params": {
             "properties": props,
-            "limits": {"start": 0, "end": limit},
-            "sort": sort_obj,
+            "sort": kodi_sort(sort_obj),
             "filter": filter_obj
         }
     }
 
-    data = jsonrpc_request(params) or {}
-    items = data.get("movies", [])
-
     # 严格条件：类型必须且只能有一条，并且该条是“音乐”。
-    filtered_items = []
-    for item in items:
+    def accept(item):
         genres = item.get("genre", [])
         if len(genres) == 1 and genres[0] == "音乐":
             item["media_type"] = "concert"
-            filtered_items.append(item)
+            return True
+        return False
+
+    if is_random_sort(sort_obj):
+        filtered_items, _ = fetch_random_page([params], sort_obj, limit, accept, ["genre"])
+    else:
+        filtered_items = fetch_until_full(params, "movies", accept, limit)
 
     return sort_items_locally(filtered_items, sort_obj)[:limit]
 
@@ -779,14 +1187,17 @@ def get_documentary_items(filters, limit):
     batch_cmds = [
         {
             "jsonrpc": "2.0", "id": "movies", "method": "VideoLibrary.GetMovies",
-            "params": {"properties": movie_props, "limits": {"start": 0, "end": limit}, "sort": sort_obj, "filter": filter_obj_movie}
+            "params": {"properties": movie_props, "limits": {"start": 0, "end": limit}, "sort": kodi_sort(sort_obj), "filter": filter_obj_movie}
         },
         {
             "jsonrpc": "2.0", "id": "tvshows", "method": "VideoLibrary.GetTVShows",
-            "params": {"properties": tv_props, "limits": {"start": 0, "end": limit}, "sort": sort_obj, "filter": filter_obj_tv}
+            "params": {"properties": tv_props, "limits": {"start": 0, "end": limit}, "sort": kodi_sort(sort_obj), "filter": filter_obj_tv}
         }
     ]
 
+    if is_random_sort(sort_obj):
+        return fetch_random_page(batch_cmds, sort_obj, limit)[0]
+
     items = []
     try:
         results = jsonrpc_request(batch_cmds) or []
@@ -807,12 +1218,15 @@ def get_documentary_items(filters, limit):
     return sort_items_locally(items, sort_obj)[:limit]
 
 def get_mixed_items(filters, limit):
-    sort_obj = build_sort(filters)
+    movie_plan = get_query_plan(filters, "movie")
+    tv_plan = get_query_plan(filters, "tvshow")
+    sort_obj = movie_plan.sort
 
-    # Fetch all movies and tvshows
-    filter_obj_movie = build_filter(filters, media_type="movie")
-    filter_obj_tv = build_filter(filters, media_type="tvshow")
+    items = facet_index.query_items(("movie", "tvshow"), filters, limit, sort_obj)
+    if items is not None:
+        return items
 
+    # Fetch all movies and tvshows
     movie_props = ["title", "art", "dateadded", "rating", "year", "file", "resume", "runtime", "lastplayed", "playcount"]
     tv_props = ["title", "art", "dateadded", "rating", "year", "episode", "watchedepisodes", "file", "lastplayed"]
     if has_t9_filter(filters):
@@ -823,15 +1237,18 @@ def get_mixed_items(filters, limit):
     batch_cmds = [
         {
             "jsonrpc": "2.0", "id": "movies", "method": "VideoLibrary.GetMovies",
-            "params": {"properties": movie_props, "limits": {"start": 0, "end": limit}, "sort": sort_obj}
+            "params": {"properties": movie_props, "limits": {"start": 0, "end": limit}, "sort": movie_plan.sort_json}
         },
         {
             "jsonrpc": "2.0", "id": "tvshows", "method": "VideoLibrary.GetTVShows",
-            "params": {"properties": tv_props, "limits": {"start": 0, "end": limit}, "sort": sort_obj}
+            "params": {"properties": tv_props, "limits": {"start": 0, "end": limit}, "sort": tv_plan.sort_json}
         }
     ]
-    if filter_obj_movie: batch_cmds[0]["params"]["filter"] = filter_obj_movie
-    if filter_obj_tv: batch_cmds[1]["params"]["filter"] = filter_obj_tv
+    if movie_plan.filter_json: batch_cmds[0]["params"]["filter"] = movie_plan.filter_json
+    if tv_plan.filter_json: batch_cmds[1]["params"]["filter"] = tv_plan.filter_json
+
+    if is_random_sort(sort_obj):
+        return fetch_random_page(batch_cmds, sort_obj, limit)[0]
 
     items = []
     try:
@@ -893,6 +1310,8 @@ def jsonrpc_get_items(filters=None, limit=500):
         items = get_documentary_items(filters, limit)
     else:
         items = get_mixed_items(filters, limit)
+    # 本次查询记录的路径耗时统一写盘一次
+    query_cost.flush()
 
     # T9 搜索时按距离稳定排序，距离相同的项保持用户排序
     if t9_active:
@@ -908,36 +1327,28 @@ def jsonrpc_get_items(filters=None, limit=500):
 
     return items
 
-def create_list_item(m):
-    li = xbmcgui.ListItem(label=m["title"])
-    li.setContentLookup(False)
-    # 设置海报/缩略图
+def _render_revision():
+    # service 在媒体库变化时递增；service 未运行时为空，此时不复用渲染记录
+    return xbmcgui.Window(10000).getProperty("MFG.LibraryRevision")
+
+def build_render_record(m):
+    """
+    预先计算生成 ListItem 所需的全部字段（海报、URL、信息标签、进度百分比），
+    结果只含基本类型，可随条目一起 pickle。条目没有 ID 时返回 None。
+    """
     art = m.get("art", {})
     art_dict = {}
     media_type = m.get("media_type", "movie")
-    
+
     if "poster" in art:
         art_dict["poster"] = art["poster"]
         art_dict["thumb"] = art["poster"]
-    
+
     if "fanart" in art:
         art_dict["fanart"] = art["fanart"]
-        
-    li.setArt(art_dict)
-    
+
     # ID 处理
-    url = ""
-    is_folder = False
-    
-    if media_type == "movie" or media_type == "documentary":
-        item_id = m.get("movieid")
-        # 优先使用文件路径作为 URL，确保播放器能直接播放
-        if "file" in m:
-            url = m["file"]
-        else:
-            url = f"videodb://movies/titles/{item_id}"
-        is_folder = False
-    elif media_type == "tvshow":
+    if media_type == "tvshow":
         item_id = m.get("tvshowid")
         url = f"videodb://tvshows/titles/{item_id}/"
         is_folder = True
@@ -946,7 +1357,9 @@ def create_list_item(m):
         url = f"videodb://movies/sets/{item_id}/"
         is_folder = True
     else:
+        # movie / documentary / concert
         item_id = m.get("movieid")
+        # 优先使用文件路径作为 URL，确保播放器能直接播放
         if "file" in m:
             url = m["file"]
         else:
@@ -954,104 +1367,164 @@ def create_list_item(m):
         is_folder = False
 
     if not item_id:
-        return None, None, False
-
-    # Append timestamp to force unique path (bypassing history focus)
-    if url:
-        sep = "&" if "?" in url else "?"
-        # url = f"{url}{sep}t={time.time()}"
-
-    # 设置 IsPlayable
-    if not is_folder:
-        li.setProperty("IsPlayable", "true")
-        li.setIsFolder(False)
-    else:
-        li.setProperty("IsPlayable", "false")
-        li.setIsFolder(True)
-    
-    
+        return None
 
-    info_tag = li.getVideoInfoTag()
-    info_tag.setTitle(m["title"])
-    info_tag.setYear(m.get("year", 0))
-    info_tag.setRating(m.get("rating", 0.0))
-    if "plot" in m:
-        info_tag.setPlot(m["plot"])
-    
-    if "playcount" in m:
-        info_tag.setPlaycount(m.get("playcount", 0))
+    record = {
+        "title": m["title"],
+        "art": art_dict,
+        "url": url,
+        "is_folder": is_folder,
+        "year": m.get("year", 0),
+        "rating": m.get("rating", 0.0),
+        "plot": m.get("plot"),
+        "playcount": m.get("playcount"),
+        "file": m.get("file"),
+        "resume": None,
+        "percent": None,
+        # 设置 MediaType 以便皮肤显示正确的图标/信息
+        "mediatype": media_type if media_type not in ["documentary", "concert"] else "movie",
+        "dbid": int(item_id),
+    }
 
-    if "file" in m:
-        info_tag.setFilenameAndPath(m["file"])
-        info_tag.setPath(m["file"])
-    
     # 如果可用，设置断点续播点
     resume = m.get("resume", {})
-    
+
     if media_type == "tvshow":
         total_episodes = m.get("episode", 0)
         watched_episodes = m.get("watchedepisodes", 0)
         last_played = m.get("lastplayed", "")
-        
+
         if total_episodes > 0:
             # 计算百分比
             # 使用已观看计数 + 来自正在观看剧集的部分进度
             partial = m.get("partial_progress", 0.0)
             val = float(watched_episodes) + partial
-            
+
             pct = int((val / total_episodes) * 100)
             if pct > 100: pct = 100
             # 如果我们认为已开始（有部分进度或 lastplayed），则确保至少 1%
-            if (partial > 0 or (watched_episodes == 0 and last_played)) and pct == 0: 
+            if (partial > 0 or (watched_episodes == 0 and last_played)) and pct == 0:
                 pct = 1
-            
+
             if pct == 100: pct = 0
-            
-            li.setProperty("SkinPercentPlayed", str(pct))
-    
+
+            record["percent"] = str(pct)
+
     elif media_type == "set":
         total_movies = m.get("total", 0)
         watched_movies = m.get("watched", 0)
-        
+
         if total_movies > 0:
             # 对于电影集，使用已观看计数 + 部分进度
             partial = m.get("partial_progress", 0.0)
             val = float(watched_movies) + partial
-            
+
             pct = int((val / total_movies) * 100)
             if pct > 100: pct = 100
-            
+
             # 如果已开始，确保至少 1%
             if (partial > 0 or watched_movies > 0) and pct == 0:
                 pct = 1
 
             if pct == 100: pct = 0
 
-            li.setProperty("SkinPercentPlayed", str(pct))
+            record["percent"] = str(pct)
 
     elif resume and "position" in resume and resume["position"] > 0:
         total = resume.get("total", 0)
         if total == 0:
             total = m.get("runtime", 0)
-        
+
         if total > 0:
-            info_tag.setResumePoint(resume["position"], total)
+            record["resume"] = (resume["position"], total)
             # 如果需要，还为皮肤可见性检查设置属性
-            pct = int((resume["position"] / total) * 100)
-            li.setProperty("SkinPercentPlayed", str(pct))
+            record["percent"] = str(int((resume["position"] / total) * 100))
         else:
-            info_tag.setResumePoint(resume["position"])
-            pass
-    
-    # 设置 MediaType 以便皮肤显示正确的图标/信息
-    info_tag.setMediaType(media_type if media_type not in ["documentary", "concert"] else "movie")
-    
+            record["resume"] = (resume["position"],)
+
+    return record
+
+def get_render_record(m, revision=None):
+    """
+    返回条目的渲染记录。记录以 (media_type, id, 媒体库版本) 为键缓存在条目自身的 _render 字段中，
+    条目随结果缓存/分页游标 pickle 时一并保存，之后的刷新和翻页可直接复用。
+    """
+    if revision is None:
+        revision = _render_revision()
+    media_type = m.get("media_type", "movie")
+    key = (media_type, m.get("movieid") or m.get("tvshowid") or m.get("setid"), revision)
+    cached = m.get("_render")
+    if revision and cached and cached[0] == key:
+        return cached[1]
+    record = build_render_record(m)
+    if revision:
+        m["_render"] = (key, record)
+    return record
+
+def prepare_render_records(items):
+    """预先为一批条目生成渲染记录，例如在后台预取时，把这部分开销移出刷新路径。"""
+    revision = _render_revision()
+    for m in items:
+        get_render_record(m, revision)
+    return items
+
+def list_item_from_record(record):
+    li = xbmcgui.ListItem(label=record["title"])
+    li.setContentLookup(False)
+    li.setArt(record["art"])
+
+    # 设置 IsPlayable
+    if not record["is_folder"]:
+        li.setProperty("IsPlayable", "true")
+        li.setIsFolder(False)
+    else:
+        li.setProperty("IsPlayable", "false")
+        li.setIsFolder(True)
+
+    info_tag = li.getVideoInfoTag()
+    info_tag.setTitle(record["title"])
+    info_tag.setYear(record["year"])
+    info_tag.setRating(record["rating"])
+    if record["plot"] is not None:
+        info_tag.setPlot(record["plot"])
+
+    if record["playcount"] is not None:
+        info_tag.setPlaycount(record["playcount"])
+
+    if record["file"] is not None:
+        info_tag.setFilenameAndPath(record["file"])
+        info_tag.setPath(record["file"])
+
+    if record["resume"]:
+        info_tag.setResumePoint(*record["resume"])
+    if record["percent"] is not None:
+        li.setProperty("SkinPercentPlayed", record["percent"])
+
+    info_tag.setMediaType(record["mediatype"])
+
     # 关键：设置 DBID，让 Kodi 知道这是数据库中的项目，从而启用原生右键菜单
-    info_tag.setDbId(int(item_id))
+    info_tag.setDbId(record["dbid"])
 
-    li.setPath(url)
+    li.setPath(record["url"])
     # 强制设置目标窗口，防止 Kodi 在添加收藏夹时将上下文菜单所在窗口(如 13003)绑定到收藏夹URL
     # 设置为 "videos" 或 "10025"，保证从收藏夹打开或者右键菜单处理都按照原生视频库逻辑处理。
     li.setProperty("targetwindow", "videos")
+    return li
+
+def iter_list_items(items):
+    """逐个生成 (url, ListItem, is_folder)，跳过没有 ID 的条目。"""
+    revision = _render_revision()
+    for m in items:
+        record = get_render_record(m, revision)
+        if record:
+            yield record["url"], list_item_from_record(record), record["is_folder"]
 
-    return li, url, is_folder
+def create_list_items(items):
+    """批量生成 (url, ListItem, is_folder)，跳过没有 ID 的条目。"""
+    return list(iter_list_items(items))
+
+def create_list_item(m):
+    record = get_render_record(m)
+    if not record:
+        return None, None, False
+    return list_item_from_record(record), record["url"], record["is_folder"]
@@ -1,6 +1,9 @@
 # -*- coding: utf-8 -*-
 from .common import ADDON_PATH, get_setting, notification, log
 from . import t9_helper
+from . import facet_index
+from . import keymap_cache
+from .prefetch import PrefetchScheduler
 import xbmc
 import xbmcgui
 import xbmcvfs
@@ -9,6 +12,7 @@ import threading
 import queue
 import json
 import base64
+import random
 
 # T9 多字符映射：数字 -> [数字, 字母...]
 _MULTITAP_MAP = {
@@ -244,10 +248,17 @@ for group, data in FILTER_MAP.items():
     # 映射按钮
     for val, btn_id in data['mapping'].items():
         FILTER_ID_TO_INFO_MAP[btn_id] = (group, val)
+# 随机排序种子在筛选状态中的键，不对应任何按钮
+RANDOM_SEED_KEY = 'filter.random_seed'
+# (组, 值) -> ID，用于发布各按钮的结果计数
+FILTER_INFO_TO_ID_MAP = {info: btn_id for btn_id, info in FILTER_ID_TO_INFO_MAP.items()}
 
 class FilterWindow(xbmcgui.WindowXML):
     def _set_button_state(self, btn_id, is_selected):
         color_val = 'FFEB9E17' if is_selected else 'FFFFFFFF'
+        # 未选中且当前条件下没有结果的按钮置灰
+        if not is_selected and xbmcgui.Window(10000).getProperty(f'MFG.FacetCount.{btn_id}') == '0':
+            color_val = 'FF808080'
         xbmcgui.Window(10000).setProperty(f'MFG.FilterColor.{btn_id}', color_val)
 
     def _load_state_from_skin(self):
@@ -262,6 +273,8 @@ class FilterWindow(xbmcgui.WindowXML):
                 loaded_state = json.loads(decoded)
                 
                 self.filter_state = loaded_state
+                if RANDOM_SEED_KEY not in self.filter_state:
+                    self._rotate_random_seed()
                 return
             except Exception as e:
                 log(f"Error loading state blob: {e}", xbmc.LOGERROR)
@@ -276,6 +289,11 @@ class FilterWindow(xbmcgui.WindowXML):
                 self.filter_state[group] = [default_obj]
             else:
                 self.filter_state[group] = default_obj
+        self._rotate_random_seed()
+
+    def _rotate_random_seed(self):
+        """生成新的随机排序种子，只在用户主动要求重新洗牌时调用。"""
+        self.filter_state[RANDOM_SEED_KEY] = {'value': str(random.getrandbits(32))}
 
     def _save_state_to_skin(self):
         try:
@@ -316,73 +334,109 @@ class FilterWindow(xbmcgui.WindowXML):
                 for btn_id in all_ids:
                     self._set_button_state(btn_id, btn_id == active_id)
 
-    def _fav_from_custom_keymaps(self):
-        """解析用户的 keymap XML，提取绑定了 toggle_favourite 的自定义按键代码"""
-        import os
-        import json
-        import xml.etree.ElementTree as ET
-        
-        # 记录全局的键盘映射 button_code -> action_str
-        global_keyboard_map = {}
-        
-        # 加载键盘映射 JSON
-        mapping_file = os.path.join(os.path.dirname(__file__), '..', 'resources', 'keyboard_mapping.json')
-        name_to_code = {}
+    def _current_filters(self):
+        """当前筛选状态和搜索输入对应的 filters，与 default.py 的 filter_list 使用同一转换。"""
+        from .video_library import filters_from_state
+        filters, _ = filters_from_state(self.filter_state, xbmcgui.Window(10000).getProperty("MFG.T9Input"))
+        return filters
+
+    def _facet_masks(self, counter, filters):
+        """索引不覆盖的条件（T9 搜索）对应的位图，相同条件只查询一次。"""
+        extra = facet_index.unindexed_filters(filters)
+        if not extra:
+            return {}
+        key = json.dumps(extra, sort_keys=True, ensure_ascii=False)
+        cached = getattr(self, '_facet_mask_cache', None)
+        if cached and cached[0] == key:
+            return cached[1]
+        masks = facet_index.rule_masks(counter.indexes, filters)
+        if masks is not None:
+            self._facet_mask_cache = (key, masks)
+        return masks
+
+    def _start_facet_counts(self):
+        """后台加载筛选索引，加载完成后计算一次全部按钮的结果计数。"""
+        self.facet_counter = None
+
+        def worker():
+            indexes = facet_index.load_facet_indexes()
+            if indexes:
+                self.facet_counter = facet_index.FacetCounter(indexes)
+                self._update_facet_counts()
+
+        threading.Thread(target=worker, daemon=True).start()
+
+    def _update_facet_counts(self, changed_group=None):
+        """更新 MFG.FacetCount.<按钮ID>，changed_group 为本次变化的筛选组。"""
+        counter = getattr(self, 'facet_counter', None)
+        if counter is None:
+            return
         try:
-            with open(mapping_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                name_to_code = data.get("name_to_code", {})
+            filters = self._current_filters()
+            updated = counter.update(filters, changed_group, self._facet_masks(counter, filters))
         except Exception as e:
-            log(f"Failed to load keyboard mapping json: {e}", xbmc.LOGERROR)
+            log(f"Error updating facet counts: {e}", xbmc.LOGERROR)
+            return
 
-        folder = xbmcvfs.translatePath('special://profile/keymaps/')
-        if os.path.exists(folder):
-            # 获取所有xml并按字母顺序排序，以正确处理Kodi的覆盖加载机制
-            xml_files = sorted([f for f in os.listdir(folder) if f.lower().endswith('.xml')])
-            
-            for file_name in xml_files:
-                file_path = os.path.join(folder, file_name)
-                try:
-                    tree = ET.parse(file_path)
-                    root = tree.getroot()
-                    
-                    # Kodi 的 keymap 加载是不区分大小写的，我们遍历子节点匹配
-                    for global_node in root:
-                        if global_node.tag.lower() == 'global':
-                            for keyboard_node in global_node:
-                                if keyboard_node.tag.lower() == 'keyboard':
-                                    # 遍历所有的按键标签
-                                    for elem in keyboard_node:
-                                        tag = elem.tag.lower()
-                                        text = elem.text or ''
-                                        button_code = None
-                                        
-                                        # 处理 <key id="xxx">
-                                        if tag == 'key' and 'id' in elem.attrib:
-                                            try:
-                                                button_code = int(elem.attrib['id'])
-                                            except ValueError:
-                                                pass
-                                        else:
-                                            # 处理具有命名标签的映射
-                                            if tag in name_to_code:
-                                                button_code = name_to_code[tag]
-                                                
-                                        # 将得到的 button_code 映射覆盖，这就是Kodi执行的加载合并逻辑
-                                        if button_code is not None:
-                                            global_keyboard_map[button_code] = text
-                                            
-                except Exception as e:
-                    log(f"Failed to parse keymap {file_path}: {e}", xbmc.LOGERROR)
-
-        # 从最终合并完成的字典中，筛选出分配给了我们的 toggle_favourite 脚本的按钮代码
-        allowed_button_codes = set()
-        for code, action_text in global_keyboard_map.items():
-            if 'plugin.video.filteredmovies' in action_text and 'toggle_favourite' in action_text:
-                allowed_button_codes.add(code)
-
-        log(f"Parsed favourite button codes: {allowed_button_codes}")
-        return allowed_button_codes
+        home = xbmcgui.Window(10000)
+        if updated is None:
+            # 当前影视范围不在索引覆盖内，清除计数
+            for btn_id in FILTER_ID_TO_INFO_MAP:
+                home.clearProperty(f'MFG.FacetCount.{btn_id}')
+        else:
+            for info, count in updated.items():
+                btn_id = FILTER_INFO_TO_ID_MAP.get(info)
+                if btn_id:
+                    home.setProperty(f'MFG.FacetCount.{btn_id}', str(count))
+        self.update_highlights()
+
+    def _filters_after_click(self, filters, btn_id):
+        """返回点击某个筛选按钮后的 filters，与 _handle_filter_click 的状态变化一致。"""
+        group, val = FILTER_ID_TO_INFO_MAP[btn_id]
+        new_filters = dict(filters)
+        if group == 'filter.rating':
+            if btn_id == FILTER_MAP[group]['default']:
+                for key in list(new_filters):
+                    if key.startswith('filter.rating.'):
+                        del new_filters[key]
+            elif new_filters.pop(f"{group}.{val}", None) is None:
+                new_filters[f"{group}.{val}"] = True
+        else:
+            new_filters[group] = val
+        return new_filters
+
+    def _schedule_prefetch(self, focused_id=None):
+        """预取聚焦按钮、其他排序方式和其他影视范围对应的结果。"""
+        scheduler = getattr(self, 'prefetch_scheduler', None)
+        if scheduler is None:
+            return
+        # T9 搜索结果不参与预取
+        if xbmcgui.Window(10000).getProperty("MFG.T9Input"):
+            scheduler.cancel()
+            return
+
+        filters = self._current_filters()
+        btn_ids = []
+        if focused_id in FILTER_ID_TO_INFO_MAP:
+            btn_ids.append(focused_id)
+        btn_ids.extend(FILTER_MAP['filter.sort']['mapping'].values())
+        btn_ids.append(FILTER_MAP['filter.mediatype']['default'])
+        btn_ids.extend(FILTER_MAP['filter.mediatype']['mapping'].values())
+
+        candidates = []
+        for btn_id in btn_ids:
+            candidate = self._filters_after_click(filters, btn_id)
+            if candidate != filters and candidate not in candidates:
+                candidates.append(candidate)
+        scheduler.schedule(candidates)
+
+    def onFocus(self, controlId):
+        if controlId in FILTER_ID_TO_INFO_MAP:
+            self._schedule_prefetch(controlId)
+
+    def _fav_from_custom_keymaps(self):
+        """绑定了 toggle_favourite 的自定义按键代码，keymap 文件未变化时直接使用缓存的解析结果"""
+        return keymap_cache.get_fav_button_codes()
 
     def onInit(self):
         # Set property to indicate window is open
@@ -392,6 +446,10 @@ class FilterWindow(xbmcgui.WindowXML):
         self._load_state_from_skin()
         # 立即初始化筛选高亮
         self.update_highlights()
+        self._start_facet_counts()
+        self.prefetch_scheduler = PrefetchScheduler(int(get_setting('filter_limit') or 300))
+        self.prefetch_scheduler.start()
+        self._schedule_prefetch()
         
         
         # 初始化属性，确保非空
@@ -477,16 +535,21 @@ class FilterWindow(xbmcgui.WindowXML):
                         self.refresh_container()
                         last_input_time = time.time()
                         last_input = current_input
+                        self._update_facet_counts()
                     else:
                         if (time.time() - last_input_time > 0.5):
                             self.refresh_container()
                             last_input = current_input
+                            # 按钮计数同样按搜索结果计算（需要查询 Kodi，在此线程中完成）
+                            self._update_facet_counts()
                 
             except Exception as e:
                 log(f"Worker error: {e}", xbmc.LOGERROR)
 
     def cleanup(self):
         self.running = False
+        if getattr(self, 'prefetch_scheduler', None):
+            self.prefetch_scheduler.stop()
         if hasattr(self, 'input_queue'):
             self.input_queue.put(('close', None))
         if hasattr(self, 'worker') and self.worker.is_alive():
@@ -495,6 +558,8 @@ class FilterWindow(xbmcgui.WindowXML):
         
         # 清除全局属性
         xbmcgui.Window(10000).clearProperty("MFG.T9Input")
+        for btn_id in FILTER_ID_TO_INFO_MAP:
+            xbmcgui.Window(10000).clearProperty(f'MFG.FacetCount.{btn_id}')
 
     def onAction(self, action):
         action_id = action.getId()
@@ -640,6 +705,10 @@ class FilterWindow(xbmcgui.WindowXML):
             # 单选逻辑 (其他筛选组)
             old_obj = self.filter_state.get(group)
             if old_obj and old_obj['id'] == controlId:
+                if group == 'filter.sort' and val == '随机':
+                    # 再次点击“随机”表示重新洗牌
+                    self._rotate_random_seed()
+                    self.refresh_container()
                 return True # 点击已选中的项，无变化
             
             self.filter_state[group] = click_obj
@@ -649,6 +718,7 @@ class FilterWindow(xbmcgui.WindowXML):
                 self._set_button_state(old_obj['id'], False)
             self._set_button_state(controlId, True)
             
+        self._update_facet_counts(group)
         self.refresh_container()
         return True
 
@@ -673,6 +743,10 @@ class FilterWindow(xbmcgui.WindowXML):
         xbmcgui.Window(10000).setProperty("MFG.IsRefreshing", "true")
          # 等待淡出动画完成
 
+        # 真实刷新优先，暂停后台预取
+        if getattr(self, 'prefetch_scheduler', None):
+            self.prefetch_scheduler.cancel()
+
         # 保存当前状态到 Skin，以便 default.py 读取
         self._save_state_to_skin()
         
@@ -683,6 +757,8 @@ class FilterWindow(xbmcgui.WindowXML):
         xbmc.sleep(100)
         reload_id = str(time.time())
         xbmcgui.Window(10000).setProperty("MFG.ReloadID", reload_id)
+        # 刷新完成后（MFG.IsRefreshing 复位）预取下一步可能的组合
+        self._schedule_prefetch()
 
 
 class DialogSelectWindow(xbmcgui.WindowXMLDialog):
@@ -770,31 +846,6 @@ class OSDListWindow(xbmcgui.WindowXMLDialog):
         super(OSDListWindow, self).onAction(action)
 
 
-# 语言代码（ISO 639-1）→ 国家代码（ISO 3166-1 alpha-2，大写）映射，用于获取国旗图片
-
-
-def _get_flag_path(lang_code):
-    """根据语言代码返回本地国旗图片路径，与 fuse2 皮肤逻辑相同。"""
-    if not lang_code or lang_code in ('unk', 'und', ''):
-        return None
-    import os
-    flags_dir = os.path.join(ADDON_PATH, 'resources', 'skins', 'Default', 'media', 'flags')
-    code = lang_code.lower()
-    path = os.path.join(flags_dir, f'{code}.png')
-    if os.path.exists(path):
-        return path
-    # 尝试 ISO 639-1 两字母码
-    try:
-        iso2 = xbmc.convertLanguage(lang_code, xbmc.ISO_639_1)
-        if iso2:
-            path2 = os.path.join(flags_dir, f'{iso2.lower()}.png')
-            if os.path.exists(path2):
-                return path2
-    except Exception:
-        pass
-    return None
-
-
 class MediaSelectWindow(xbmcgui.WindowXMLDialog):
     """统一字幕/音轨选择器窗口（Custom_1112_MediaSelect.xml）。
 
@@ -864,9 +915,8 @@ class MediaSelectWindow(xbmcgui.WindowXMLDialog):
             if item.get("is_active"):
                 li.setProperty("IsActive", "true")
                 sub_focus = i
-            flag_path = _get_flag_path(item.get("lang_code", ""))
-            if flag_path:
-                li.setArt({'thumb': flag_path})
+            if item.get("flag"):
+                li.setArt({'thumb': item["flag"]})
             self.subtitle_list.addItem(li)
         if self.subtitle_items:
             self.subtitle_list.selectItem(sub_focus)
@@ -895,9 +945,8 @@ class MediaSelectWindow(xbmcgui.WindowXMLDialog):
             if item.get("is_active"):
                 li.setProperty("IsActive", "true")
                 audio_focus = i
-            flag_path = _get_flag_path(item.get("lang_code", ""))
-            if flag_path:
-                li.setArt({'thumb': flag_path})
+            if item.get("flag"):
+                li.setArt({'thumb': item["flag"]})
             self.audio_list.addItem(li)
         if self.audio_items:
             self.audio_list.selectItem(audio_focus)
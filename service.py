@@ -1,21 +1,39 @@
 # -*- coding: utf-8 -*-
 import os
-import json
+import math
 import time
 import traceback
 import threading
+from concurrent.futures import ThreadPoolExecutor
 
 import xbmc
 import xbmcgui
-import xbmcvfs
 
-from lib.common import ADDON_PATH, ADDON_DATA_PATH, get_setting, get_skin_name, jsonrpc_request, notification, log
-from lib.playlist_library import EpisodePlayList, get_season_episode
+from lib.common import ADDON_ID, ADDON_PATH, ADDON_DATA_PATH, SKIP_DATA_CHANGED, get_setting, get_skin_name, jsonrpc_request, notification, log
+from lib.playlist_library import EpisodePlayList, get_season_episode, invalidate_season_cache
+from lib.progress_store import ProgressStore, READY_PROPERTY, RECONCILE_INTERVAL
+from lib.facet_index import FacetStore, FACET_READY_PROPERTY, FACET_RECONCILE_INTERVAL
+from lib.result_cache import bump_revision
+from lib import keymap_cache
+from lib import media_info
+from lib import subtitle_index
+from lib.skip_store import get_store as get_skip_store
 
 if not os.path.exists(ADDON_DATA_PATH):
     os.makedirs(ADDON_DATA_PATH)
 
-SKIP_DATA_FILE = os.path.join(ADDON_DATA_PATH, 'skip_intro_data.json')
+# 主循环等到下一项定期检查到期才醒来（播放和片头片尾数据的变化由 Monitor/Player 回调处理），单次等待不少于此秒数
+MIN_IDLE_WAIT = 1
+# 片尾跳过前的倒计时（秒），倒计时从片尾时间点前这么多秒开始
+OUTRO_COUNTDOWN = 6
+# 检测皮肤切换的间隔（秒），Kodi 没有皮肤切换的通知
+SKIN_CHECK_INTERVAL = 10
+# 播放开始后等待播放器信息就绪：首次间隔、最大间隔和总等待时间（秒）
+PLAYBACK_READY_INITIAL_DELAY = 0.05
+PLAYBACK_READY_MAX_DELAY = 0.4
+PLAYBACK_READY_TIMEOUT = 3.0
+PLAYBACK_WORKERS = 2
+PLAYER_ITEM_PROPERTIES = ["tvshowid", "showtitle", "season", "episode", "file"]
 
 def warmup_xml_cache():
     try:
@@ -32,15 +50,102 @@ def warmup_xml_cache():
     except Exception as e:
         log(f"-----Error warming up XML cache: {e}")
 
-def load_skip_data():
-    if not os.path.exists(SKIP_DATA_FILE):
-        return {}
+def normalize_player_item(item):
+    if isinstance(item, dict):
+        # 统一补齐 episode（第几集），供播放列表补全逻辑直接使用。
+        episode_no = item.get('episode')
+        try:
+            item['episode'] = int(episode_no) if episode_no is not None else None
+        except (TypeError, ValueError):
+            item['episode'] = None
+    return item
+
+def tvshow_info_for(item):
+    """返回 (跳过点存储用的剧集 ID, 剧名, 季号)，无法识别时返回 (None, None, None)。"""
     try:
-        with open(SKIP_DATA_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        tvshow_id = item.get('tvshowid')
+        show_title = item.get('showtitle')
+        season = item.get('season', -1)
+        # 1. 优先使用已刮削的剧集信息
+        if tvshow_id and tvshow_id != -1:
+            return str(tvshow_id), show_title, str(season)
+        # 2. 兼容未刮削的文件/文件夹模式
+        file_path = item.get('file')
+        if file_path:
+            # 忽略插件流或 PVR
+            if file_path.startswith("plugin://") or file_path.startswith("pvr://"):
+                return None, None, None
+            # 使用 os.path 处理路径 (自动适配系统分隔符)
+            parent_dir = os.path.dirname(file_path)
+            dir_name = os.path.basename(parent_dir)
+            if not dir_name:
+                dir_name = "Unknown Folder"
+            # 使用 "directory:路径" 作为 ID，如果是不同路径则视为不同剧集
+            # 默认季数为 1
+            return f"directory:{parent_dir}", dir_name, "1"
     except Exception as e:
-        log(f"Error loading skip data: {e}")
-        return {}
+        log(f"Error getting TV show info: {e}")
+    return None, None, None
+
+def get_next_playlist_item():
+    """返回视频播放列表中当前项的下一项，没有时返回 None。"""
+    props = jsonrpc_request({
+        "jsonrpc": "2.0",
+        "method": "Player.GetProperties",
+        "params": {"playerid": 1, "properties": ["position", "playlistid"]},
+        "id": "Player.GetProperties",
+    }) or {}
+    position = props.get("position", -1) if isinstance(props, dict) else -1
+    playlist_id = props.get("playlistid", -1) if isinstance(props, dict) else -1
+    if position is None or position < 0 or playlist_id is None or playlist_id < 0:
+        return None
+    result = jsonrpc_request({
+        "jsonrpc": "2.0",
+        "method": "Playlist.GetItems",
+        "params": {
+            "playlistid": playlist_id,
+            "properties": PLAYER_ITEM_PROPERTIES,
+            "limits": {"start": position + 1, "end": position + 2},
+        },
+        "id": "Playlist.GetItems",
+    }) or {}
+    items = result.get("items") if isinstance(result, dict) else None
+    if not items:
+        return None
+    return normalize_player_item(items[0])
+
+def iso_playing_file(playing_file):
+    """ISO 文件返回去掉查询参数后的路径，其他文件（包括 HTTP 流）返回 None。"""
+    # Skip HTTP/HTTPS streams
+    if playing_file.lower().startswith(('http://', 'https://')):
+        log("HTTP stream detected, skipping ISO subtitle check.")
+        return None
+
+    # Strip query parameters if any
+    if '?' in playing_file:
+        playing_file = playing_file.split('?')[0]
+    
+    # Check if it's an ISO file
+    if not playing_file.lower().endswith('.iso'):
+        return None
+    return playing_file
+
+def find_iso_subtitles(playing_file):
+    """列出 ISO 同目录下与其同名的外挂字幕。"""
+    # Get directory and base name
+    # Normalize path separators
+    playing_file = playing_file.replace('\\', '/')
+    last_sep_idx = playing_file.rfind('/')
+    
+    if last_sep_idx == -1:
+        return []
+        
+    dir_path = playing_file[:last_sep_idx + 1]
+    file_name = playing_file[last_sep_idx + 1:]
+    base_name = file_name[:-4] # remove .iso
+    
+    # 目录列表和按文件名建立的字幕索引有缓存，同一目录的其他剧集不再重复列出
+    return subtitle_index.find_subtitles(dir_path, base_name)
 
 class PlayerMonitor(xbmc.Player):
     def __init__(self):
@@ -51,28 +156,40 @@ class PlayerMonitor(xbmc.Player):
         self.cancel_skip = False
         self.current_player_item = None
         self.current_season_info = None
+        self.outro_scheduler = OutroScheduler(self)
+        # 播放开始后的并行任务（字幕、播放列表补全、下一集预热），首次使用时创建
+        self._executor = None
+        self.prewarm_scheduler = PrewarmScheduler(self)
+        # 预热的下一项：{"file", "item", "subtitles"}
+        self.prewarmed = None
 
     def refresh_current_player_item(self):
         result = jsonrpc_request({
             "jsonrpc": "2.0",
             "method": "Player.GetItem",
             "params": {
-                "properties": ["tvshowid", "showtitle", "season", "episode", "file"],
+                "properties": PLAYER_ITEM_PROPERTIES,
                 "playerid": 1,
             },
             "id": "Player.GetItem",
         }) or {}
 
         item = result.get('item') if isinstance(result, dict) else None
-        if isinstance(item, dict):
-            # 统一补齐 episode（第几集），供播放列表补全逻辑直接使用。
-            episode_no = item.get('episode')
-            try:
-                item['episode'] = int(episode_no) if episode_no is not None else None
-            except (TypeError, ValueError):
-                item['episode'] = None
+        self.current_player_item = normalize_player_item(item)
+        return self.current_player_item
 
-        self.current_player_item = item
+    def prewarmed_player_item(self):
+        """正在播放的文件与预热的下一项相同时返回预热的条目，无需再查询 Player.GetItem。"""
+        prewarmed = self.prewarmed
+        if not prewarmed:
+            return None
+        try:
+            playing_file = self.getPlayingFile()
+        except RuntimeError:
+            return None
+        if playing_file != prewarmed.get("file"):
+            return None
+        self.current_player_item = dict(prewarmed["item"])
         return self.current_player_item
 
     def refresh_current_season_info(self):
@@ -89,10 +206,7 @@ class PlayerMonitor(xbmc.Player):
             self.current_season_info = None
             return None
 
-        cached = self.current_season_info if isinstance(self.current_season_info, dict) else None
-        if cached and cached.get('tvshowid') == int(tvshow_id) and cached.get('season') == int(season):
-            return cached
-
+        # 季剧集列表由 get_season_episode 统一缓存，切换剧集或季时之前看过的季也能直接命中
         self.current_season_info = get_season_episode(tvshow_id, season)
         return self.current_season_info
 
@@ -102,50 +216,125 @@ class PlayerMonitor(xbmc.Player):
             item = self.refresh_current_player_item()
         if not isinstance(item, dict):
             return None, None, None
+        return tvshow_info_for(item)
 
-        try:
-            tvshow_id = item.get('tvshowid')
-            show_title = item.get('showtitle')
-            season = item.get('season', -1)
-            # 1. 优先使用已刮削的剧集信息
-            if tvshow_id and tvshow_id != -1:
-                return str(tvshow_id), show_title, str(season)
-            # 2. 兼容未刮削的文件/文件夹模式
-            file_path = item.get('file')
-            if file_path:
-                # 忽略插件流或 PVR
-                if file_path.startswith("plugin://") or file_path.startswith("pvr://"):
-                    return None, None, None
-                # 使用 os.path 处理路径 (自动适配系统分隔符)
-                parent_dir = os.path.dirname(file_path)
-                dir_name = os.path.basename(parent_dir)
-                if not dir_name:
-                    dir_name = "Unknown Folder"
-                # 使用 "directory:路径" 作为 ID，如果是不同路径则视为不同剧集
-                # 默认季数为 1
-                return f"directory:{parent_dir}", dir_name, "1"
-        except Exception as e:
-            log(f"Error getting TV show info: {e}")
-        return None, None, None
+    def onPlayBackStopped(self):
+        self.current_outro_time = None
+        self.outro_scheduler.disarm()
+        self.prewarm_scheduler.disarm()
+        self.prewarmed = None
+
+    def onPlayBackEnded(self):
+        self.current_outro_time = None
+        self.outro_scheduler.disarm()
+        self.prewarm_scheduler.disarm()
+
+    def onPlayBackSeek(self, time, seekOffset):
+        self.outro_scheduler.arm()
+        self.prewarm_scheduler.arm()
+
+    def onPlayBackPaused(self):
+        self.outro_scheduler.pause()
+        self.prewarm_scheduler.disarm()
+
+    def onPlayBackResumed(self):
+        self.outro_scheduler.resume()
+        self.prewarm_scheduler.arm()
+
+    def onPlayBackSpeedChanged(self, speed):
+        self.outro_scheduler.arm()
+        self.prewarm_scheduler.arm()
 
     def onAVStarted(self):
         # 视频开始播放（包括切集）时触发
-        # 稍微延迟一下，确保元数据已加载
-        xbmc.sleep(1000)
-        self.refresh_current_player_item()
+        # 等到播放器信息就绪后先跳过片头，越早跳过越好；字幕和播放列表补全互不依赖，交给线程池并行处理
+        if not self.wait_until_ready():
+            return
         self.check_intro()
         self.update_outro_info()
-        self.load_iso_subtitles()
+        self.outro_scheduler.arm()
+        self.prewarm_scheduler.arm()
+
+        item = self.current_player_item if isinstance(self.current_player_item, dict) else {}
+        self._submit(self.prepare_streams)
         if get_setting('autofill_playlist_on_play') != 'false':
-            item = self.current_player_item if isinstance(self.current_player_item, dict) else {}
             if item.get('episode') and item['episode'] != -1:
-                log("Auto-fix playlist check...")
-                self.refresh_current_season_info()
-                EpisodePlayList(
-                    current_episode=item['episode'],
-                    current_season=self.current_season_info,
-                ).fix_playlist()
-                log("Auto-fix playlist check completed.")
+                self._submit(self.fix_playlist, item)
+
+    def wait_until_ready(self):
+        """
+        等待 Player.GetItem 返回播放文件且 getTotalTime 有效，间隔按指数退避，最多等待 PLAYBACK_READY_TIMEOUT 秒。
+        超时后仍按当前信息继续；播放已停止时返回 False。
+        """
+        started = time.time()
+        delay = PLAYBACK_READY_INITIAL_DELAY
+        while True:
+            item = self.prewarmed_player_item() or self.refresh_current_player_item()
+            try:
+                total_time = self.getTotalTime()
+            except RuntimeError:
+                # 播放已停止
+                return False
+            if isinstance(item, dict) and item.get('file') and total_time > 0:
+                log(f"Playback ready after {time.time() - started:.2f}s")
+                return True
+            if time.time() - started + delay > PLAYBACK_READY_TIMEOUT:
+                log(f"Playback info not ready after {PLAYBACK_READY_TIMEOUT}s, continuing with what is available")
+                return self.isPlayingVideo()
+            xbmc.sleep(int(delay * 1000))
+            delay = min(delay * 2, PLAYBACK_READY_MAX_DELAY)
+
+    def _submit(self, func, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=PLAYBACK_WORKERS)
+
+        def run():
+            try:
+                func(*args)
+            except Exception as e:
+                log(f"Error in playback start task {func.__name__}: {e}")
+                log(traceback.format_exc())
+
+        self._executor.submit(run)
+
+    def shutdown(self):
+        self.outro_scheduler.disarm()
+        self.prewarm_scheduler.disarm()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def fix_playlist(self, item):
+        log("Auto-fix playlist check...")
+        self.refresh_current_season_info()
+        EpisodePlayList(
+            current_episode=item['episode'],
+            current_season=self.current_season_info,
+        ).fix_playlist()
+        log("Auto-fix playlist check completed.")
+
+    def prewarm_next(self):
+        """预先取得播放列表下一项的信息、季集列表、跳过点和外挂字幕，切集时直接使用。"""
+        started = time.time()
+        item = get_next_playlist_item()
+        if not isinstance(item, dict) or not item.get('file'):
+            return
+        prewarmed = {"file": item['file'], "item": item}
+
+        # 预先载入季剧集列表缓存
+        get_season_episode(item.get('tvshowid'), item.get('season'))
+
+        show_key, _, show_season = tvshow_info_for(item)
+        if show_key:
+            # 读取一次使跳过点存储加载最新数据
+            get_skip_store().get(show_key, show_season)
+
+        iso_file = iso_playing_file(item['file'])
+        if iso_file:
+            prewarmed["subtitles"] = find_iso_subtitles(iso_file)
+
+        self.prewarmed = prewarmed
+        log(f"Prewarmed next item {item['file']} in {time.time() - started:.2f}s")
 
     def update_outro_info(self):
         self.current_outro_time = None
@@ -159,24 +348,20 @@ class PlayerMonitor(xbmc.Player):
         tvshow_id, show_title, season = self.get_current_tvshow_info()
         if not tvshow_id: return
 
-        data = load_skip_data()
-        if tvshow_id not in data: return
-        
-        record = data[tvshow_id]
-        if "seasons" in record and season in record["seasons"]:
-            s_data = record["seasons"][season]
-            if isinstance(s_data, dict):
-                # 获取片尾时长
-                outro_duration = s_data.get("outro")
-                if outro_duration:
-                    try:
-                        total_time = self.getTotalTime()
-                        if total_time > 0:
-                            # 计算触发时间点 = 总时长 - 片尾时长
-                            self.current_outro_time = total_time - outro_duration
-                            log(f"Outro skip set for {show_title} S{season}. Duration: {outro_duration}, Trigger at: {self.current_outro_time}")
-                    except Exception as e:
-                        log(f"Error calculating outro trigger: {e}")
+        points = get_skip_store().get(tvshow_id, season)
+        if not points: return
+
+        # 获取片尾时长
+        outro_duration = points.get("outro")
+        if outro_duration:
+            try:
+                total_time = self.getTotalTime()
+                if total_time > 0:
+                    # 计算触发时间点 = 总时长 - 片尾时长
+                    self.current_outro_time = total_time - outro_duration
+                    log(f"Outro skip set for {show_title} S{season}. Duration: {outro_duration}, Trigger at: {self.current_outro_time}")
+            except Exception as e:
+                log(f"Error calculating outro trigger: {e}")
 
     def check_intro(self):
         if not self.isPlayingVideo():
@@ -186,22 +371,11 @@ class PlayerMonitor(xbmc.Player):
         if not tvshow_id:
             return
 
-        data = load_skip_data()
-        if tvshow_id not in data:
+        points = get_skip_store().get(tvshow_id, season)
+        if not points:
             return
 
-        record = data[tvshow_id]
-        skip_time = 0
-        
-        if "seasons" in record and season in record["seasons"]:
-            val = record["seasons"][season]
-            if isinstance(val, dict):
-                skip_time = val.get("intro", 0)
-            else:
-                skip_time = val
-        elif "time" in record:
-            skip_time = record["time"]
-            
+        skip_time = points.get("intro", 0)
         if skip_time > 0:
             try:
                 current_time = self.getTime()
@@ -213,6 +387,11 @@ class PlayerMonitor(xbmc.Player):
             except Exception as e:
                 log(f"Error during skip: {e}")
 
+    def prepare_streams(self):
+        """加载外挂字幕后预先计算字幕和音轨选择器的显示条目，打开选择器时直接使用。"""
+        self.load_iso_subtitles()
+        media_info.precompute_stream_labels()
+
     def load_iso_subtitles(self):
         log("Checking for ISO subtitles...")
         try:
@@ -235,56 +414,17 @@ class PlayerMonitor(xbmc.Player):
                  log("No playing file found via JSONRPC, skipping ISO subtitle check.")
                  return
 
-            # Skip HTTP/HTTPS streams
-            if playing_file.lower().startswith(('http://', 'https://')):
-                log("HTTP stream detected, skipping ISO subtitle check.")
+            iso_file = iso_playing_file(playing_file)
+            if not iso_file:
                 return
 
-            # Strip query parameters if any
-            if '?' in playing_file:
-                playing_file = playing_file.split('?')[0]
-            
-            # Check if it's an ISO file
-            if not playing_file.lower().endswith('.iso'):
-                # log(f"Not an ISO file {playing_file}, skipping ISO subtitle check.")
-                return
-                
-            log(f"ISO file detected: {playing_file}, checking for external subtitles...")
-            
-            # Get directory and base name
-            # Normalize path separators
-            playing_file = playing_file.replace('\\', '/')
-            last_sep_idx = playing_file.rfind('/')
-            
-            if last_sep_idx == -1:
-                return
-                
-            dir_path = playing_file[:last_sep_idx + 1]
-            file_name = playing_file[last_sep_idx + 1:]
-            base_name = file_name[:-4] # remove .iso
-            
-            # Common subtitle extensions
-            sub_exts = ['.srt', '.ass', '.ssa', '.sub', '.smi', '.vtt']
-            
-            # List directory contents
-            dirs, files = xbmcvfs.listdir(dir_path)
-            
-            # Find matching subtitles
-            subtitles_to_load = []
-            for f in files:
-                f_lower = f.lower()
-                base_lower = base_name.lower()
-                if any(f_lower.endswith(ext) for ext in sub_exts):
-                    if f_lower.startswith(base_lower):
-                        remainder = f_lower[len(base_lower):]
-                        # Check strict matching (either exact match + ext, or followed by separator)
-                        # e.g. movie.srt, movie.en.srt, movie_en.srt
-                        if remainder in sub_exts or remainder.startswith('.') or remainder.startswith('-') or remainder.startswith('_'):
-                            sub_path = dir_path + f
-                            subtitles_to_load.append(sub_path)
-            
-            # Sort subtitles to have deterministic loading order
-            subtitles_to_load.sort()
+            prewarmed = self.prewarmed or {}
+            if prewarmed.get("file") == playing_file and "subtitles" in prewarmed:
+                subtitles_to_load = prewarmed["subtitles"]
+                log(f"Using prewarmed subtitle list for {iso_file}")
+            else:
+                log(f"ISO file detected: {iso_file}, checking for external subtitles...")
+                subtitles_to_load = find_iso_subtitles(iso_file)
             
             if subtitles_to_load:
                 log(f"Found {len(subtitles_to_load)} external subtitles for ISO: {subtitles_to_load}")
@@ -294,14 +434,279 @@ class PlayerMonitor(xbmc.Player):
         except Exception as e:
             log(f"Error loading ISO subtitles: {e}")
 
+class OutroScheduler:
+    """
+    片尾跳过的定时调度。
+    按当前播放位置和播放速度算出到达倒计时起点（片尾时间点前 OUTRO_COUNTDOWN 秒）的时刻，用 Timer 等到那一刻；
+    跳转、暂停、恢复、变速时由 PlayerMonitor 的回调重新计算。倒计时期间每秒更新一次提示。
+    """
+    def __init__(self, player):
+        self.player = player
+        self._lock = threading.RLock()
+        self._timer = None
+        self._countdown = None
+        self._paused = False
+
+    def arm(self):
+        """重新计算下一次触发时刻，已在片尾范围内时直接开始倒计时。"""
+        with self._lock:
+            self._cancel_timer()
+            player = self.player
+            if not player.current_outro_time:
+                self._stop_countdown()
+                return
+            try:
+                current_time = player.getTime()
+            except RuntimeError:
+                return
+            self._paused = xbmc.getCondVisibility("Player.Paused")
+            start_threshold = player.current_outro_time - OUTRO_COUNTDOWN
+
+            if current_time < start_threshold:
+                # 在片尾范围之前：重置所有状态，允许再次触发
+                player.cancel_skip = False
+                if self._countdown:
+                    log("Playback time before outro range. Resetting countdown.")
+                    self._stop_countdown()
+                rate = _playback_rate()
+                if self._paused or rate <= 0:
+                    # 暂停或快退时不计时，恢复/变速回调会重新计算
+                    return
+                delay = (start_threshold - current_time) / rate
+                self._timer = threading.Timer(delay, self._on_timer)
+                self._timer.daemon = True
+                self._timer.start()
+                log(f"Outro countdown scheduled in {delay:.1f}s (position {current_time:.1f}, rate {rate})")
+            elif not player.outro_triggered and not player.cancel_skip and not self._countdown:
+                self._start_countdown()
+
+    def disarm(self):
+        with self._lock:
+            self._cancel_timer()
+            self._stop_countdown()
+
+    def pause(self):
+        with self._lock:
+            self._paused = True
+            self._cancel_timer()
+
+    def resume(self):
+        with self._lock:
+            self._paused = False
+            if self._countdown:
+                self._countdown["wake"].set()
+        self.arm()
+
+    def _cancel_timer(self):
+        if self._timer:
+            self._timer.cancel()
+            self._timer = None
+
+    def _on_timer(self):
+        # 实际速度可能与计算时不同（例如调整了播放速度），由 arm 按当前位置校验，未到则重新定时
+        with self._lock:
+            self._timer = None
+        self.arm()
+
+    def _start_countdown(self):
+        countdown = {"stop": threading.Event(), "wake": threading.Event()}
+        countdown["thread"] = threading.Thread(target=self._run_countdown, args=(countdown,), daemon=True)
+        self._countdown = countdown
+        log(f"Entered outro range. Starting countdown: {OUTRO_COUNTDOWN}s")
+        countdown["thread"].start()
+        # 即将切到下一集，还未预热时立即预热
+        self.player.prewarm_scheduler.trigger()
+
+    def _stop_countdown(self):
+        countdown = self._countdown
+        self._countdown = None
+        if countdown:
+            countdown["stop"].set()
+            countdown["wake"].set()
+
+    def _run_countdown(self, countdown):
+        window = SkipCountdownWindow("notification_overlay.xml", ADDON_PATH)
+        window.wake = countdown["wake"]
+        # 在新线程中显示窗口，倒计时线程只负责计时和更新文字
+        window_thread = threading.Thread(target=window.doModal)
+        window_thread.start()
+
+        remaining = float(OUTRO_COUNTDOWN)
+        finished = False
+        try:
+            while not countdown["stop"].is_set() and not window.cancelled:
+                if self._paused:
+                    # 暂停期间倒计时不减少，等待恢复
+                    countdown["wake"].wait()
+                    countdown["wake"].clear()
+                    continue
+                if remaining <= 0:
+                    finished = True
+                    break
+                display_seconds = int(math.ceil(remaining))
+                window.update_text(f"即将跳过片尾... {display_seconds}秒 (按返回取消)")
+                # 等到显示的秒数变化，期间取消/暂停/停止会提前唤醒
+                step = remaining - (display_seconds - 1)
+                started = time.time()
+                countdown["wake"].wait(step)
+                countdown["wake"].clear()
+                if not self._paused:
+                    remaining -= time.time() - started
+        except Exception as e:
+            log(f"Error during outro countdown: {e}")
+            log(traceback.format_exc())
+
+        if not window.cancelled:
+            window.close()
+        window_thread.join()
+
+        with self._lock:
+            if self._countdown is countdown:
+                self._countdown = None
+            if countdown["stop"].is_set():
+                return
+            if window.cancelled:
+                self.player.cancel_skip = True
+                notification("自动跳过片尾 已取消")
+            elif finished:
+                self.player.outro_triggered = True
+                log("Countdown finished. Auto skipping outro -> Next episode")
+                xbmc.executebuiltin("PlayerControl(Next)")
+
+
+class PrewarmScheduler:
+    """
+    播放进度超过设置的比例（prewarm_next_percent）或片尾倒计时开始时，预热播放列表的下一项。
+    与 OutroScheduler 一样按播放速度计算到达时刻并用 Timer 等待，每个播放文件只预热一次。
+    """
+    def __init__(self, player):
+        self.player = player
+        self._lock = threading.RLock()
+        self._timer = None
+        self._done_for = None
+
+    def _current_file(self):
+        item = self.player.current_player_item
+        return item.get('file') if isinstance(item, dict) else None
+
+    def arm(self):
+        with self._lock:
+            self.disarm()
+            if not self._current_file() or self._current_file() == self._done_for:
+                return
+            try:
+                percent = int(get_setting('prewarm_next_percent') or 80)
+            except ValueError:
+                percent = 80
+            if percent <= 0:
+                # 只在片尾倒计时开始时预热
+                return
+            try:
+                current_time = self.player.getTime()
+                total_time = self.player.getTotalTime()
+            except RuntimeError:
+                return
+            if total_time <= 0:
+                return
+            target_time = total_time * min(percent, 100) / 100.0
+            if current_time >= target_time:
+                self._fire()
+                return
+            rate = _playback_rate()
+            if xbmc.getCondVisibility("Player.Paused") or rate <= 0:
+                return
+            self._timer = threading.Timer((target_time - current_time) / rate, self._on_timer)
+            self._timer.daemon = True
+            self._timer.start()
+
+    def disarm(self):
+        with self._lock:
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def trigger(self):
+        with self._lock:
+            self.disarm()
+            if self._current_file() and self._current_file() != self._done_for:
+                self._fire()
+
+    def _on_timer(self):
+        with self._lock:
+            self._timer = None
+        # 按实际位置再确认一次，未到则重新定时
+        self.arm()
+
+    def _fire(self):
+        self._done_for = self._current_file()
+        self.player._submit(self.player.prewarm_next)
+
+
+def _playback_rate():
+    """当前播放速度（含同步回放的速度微调），暂停为 0，快退为负数。"""
+    try:
+        return float(xbmc.getInfoLabel('Player.PlaySpeed'))
+    except ValueError:
+        return 1.0
+
+
+class ServiceMonitor(xbmc.Monitor):
+    def __init__(self, progress_store, facet_store):
+        xbmc.Monitor.__init__(self)
+        self.progress_store = progress_store
+        self.facet_store = facet_store
+        self.last_style = get_setting('style') or 'auto'
+        # 收到 default.py 的通知后重新加载片头片尾数据，由主程序设置
+        self.on_skip_data_changed = None
+
+    def onSettingsChanged(self):
+        current_style = get_setting('style') or 'auto'
+        if current_style != self.last_style:
+            log(f"Style setting changed from {self.last_style} to {current_style}. Re-evaluating rounded settings.")
+            self.last_style = current_style
+            set_rounded()
+
+    def onNotification(self, sender, method, data):
+        if sender == ADDON_ID and method == f"Other.{SKIP_DATA_CHANGED}":
+            if self.on_skip_data_changed is not None:
+                try:
+                    self.on_skip_data_changed()
+                except Exception as e:
+                    log(f"Error reloading skip data: {e}")
+            return
+        if method in ("VideoLibrary.OnUpdate", "VideoLibrary.OnRemove", "Player.OnStop",
+                      "VideoLibrary.OnScanFinished", "VideoLibrary.OnCleanFinished"):
+            try:
+                self.progress_store.handle_notification(method, data)
+            except Exception as e:
+                log(f"Error updating progress store for {method}: {e}")
+            try:
+                self.facet_store.handle_notification(method, data)
+            except Exception as e:
+                log(f"Error updating facet index for {method}: {e}")
+            try:
+                invalidate_season_cache(method, data)
+            except Exception as e:
+                log(f"Error invalidating season cache for {method}: {e}")
+            # 使筛选结果缓存失效
+            bump_revision()
+            if method == "VideoLibrary.OnScanFinished":
+                # 扫描可能发现了新的字幕文件
+                subtitle_index.invalidate()
+
 class SkipCountdownWindow(xbmcgui.WindowXMLDialog):
     def __init__(self, *args, **kwargs):
         xbmcgui.WindowXMLDialog.__init__(self, *args, **kwargs)
         self.cancelled = False
         self.is_ready = False
+        self.text = ""
+        # 取消时唤醒等待中的倒计时线程
+        self.wake = None
         
     def onInit(self):
         self.is_ready = True
+        if self.text:
+            self.update_text(self.text)
         
     def onAction(self, action):
         action_id = action.getId()
@@ -309,6 +714,8 @@ class SkipCountdownWindow(xbmcgui.WindowXMLDialog):
         if action_id in [10, 92]:
             self.cancelled = True
             self.close()
+            if self.wake:
+                self.wake.set()
         # 转发常用播放控制按键 (避免被模态窗口拦截)
         elif action_id in [1, 15]: # Left, StepBack
             xbmc.executebuiltin("PlayerControl(SmallSkipBackward)")
@@ -328,6 +735,7 @@ class SkipCountdownWindow(xbmcgui.WindowXMLDialog):
              xbmc.executebuiltin("PlayerControl(Play)")
             
     def update_text(self, text):
+        self.text = text
         if not self.is_ready: return
         try:
             # 确保控件存在
@@ -390,143 +798,52 @@ if __name__ == '__main__':
     threading.Thread(target=warmup_xml_cache).start()
 
     init_skin_properties()
-    monitor = xbmc.Monitor()
+    progress_store = ProgressStore()
+    facet_store = FacetStore()
+    monitor = ServiceMonitor(progress_store, facet_store)
     player = PlayerMonitor()
-    
-    countdown_window = None
-    countdown_thread = None
-    
-    # 倒计时状态
-    countdown_active = False
-    countdown_remaining = 0.0
-    last_tick_time = time.time()
+
+    def reload_skip_data():
+        # 片头片尾数据变化后重新计算片尾跳过点，倒计时由 OutroScheduler 定时触发
+        log("Reload signal received, updating info...")
+        player.update_outro_info()
+        player.outro_scheduler.arm()
+    monitor.on_skip_data_changed = reload_skip_data
     
     # 记录上一次的皮肤 ID，用于检测皮肤切换
     last_skin = xbmc.getSkinDir()
-    last_style = get_setting('style') or 'auto'
+    last_skin_check = time.time()
+    last_keymap_check = 0
     while not monitor.abortRequested():
-        # 1. 检测皮肤切换
-        current_skin = xbmc.getSkinDir()
-        if current_skin != last_skin:
-            log(f"Skin changed from {last_skin} to {current_skin}. Re-initializing properties.")
-            last_skin = current_skin
-            init_skin_properties()
-        
-        # 检查风格变更
-        current_style = get_setting('style') or 'auto'
-        if current_style != last_style:
-            log(f"Style setting changed from {last_style} to {current_style}. Re-evaluating rounded settings.")
-            last_style = current_style
-            set_rounded()
-
-        current_tick_time = time.time()
-        dt = current_tick_time - last_tick_time
-        last_tick_time = current_tick_time
-        
-        # 检查是否需要重新加载数据
-        if xbmcgui.Window(10000).getProperty("MFG.Reload") == "true":
-            xbmcgui.Window(10000).clearProperty("MFG.Reload")
-            log("Reload signal received, updating info...")
-            player.update_outro_info()
-            # 重置倒计时状态
-            countdown_active = False
-
-        # 检查片尾跳过
-        if player.isPlayingVideo() and player.current_outro_time:
-            try:
-                current_time = player.getTime()
-                trigger_time = player.current_outro_time
-                # 设定触发范围起点 (提前6秒)
-                start_threshold = trigger_time - 6
-                
-                if current_time < start_threshold:
-                    # 在片尾范围之前：重置所有状态，允许再次触发
-                    if player.cancel_skip: 
-                        player.cancel_skip = False
-                    # if player.outro_triggered: 
-                    #     player.outro_triggered = False
-                    
-                    if countdown_active:
-                        countdown_active = False
-                        log("Playback time before outro range. Resetting countdown.")
-                    
-                    if countdown_window:
-                        countdown_window.close()
-                        if countdown_thread: countdown_thread.join()
-                        countdown_window = None
-                        countdown_thread = None
-
-                elif not player.outro_triggered and not player.cancel_skip:
-                    # 检查冷却时间 (防止重复触发)
-
-
-                    # 在片尾范围内，且未触发/未取消：执行倒计时
-                    
-                    # 如果倒计时未激活，则初始化
-                    if not countdown_active:
-                        countdown_active = True
-                        countdown_remaining = 6.0
-                        log(f"Entered outro range. Starting countdown: {countdown_remaining}s")
-                    
-                    # 如果未暂停，则递减倒计时
-                    if not xbmc.getCondVisibility("Player.Paused"):
-                        countdown_remaining -= dt
-                    
-                    # 初始化倒计时窗口
-                    if not countdown_window:
-                        countdown_window = SkipCountdownWindow("notification_overlay.xml", ADDON_PATH)
-                        # 在新线程中显示窗口，以免阻塞主循环
-                        countdown_thread = threading.Thread(target=countdown_window.doModal)
-                        countdown_thread.start()
-                    
-                    # 更新提示文字
-                    display_seconds = int(countdown_remaining) + 1 # 向上取整显示
-                    countdown_window.update_text(f"即将跳过片尾... {display_seconds}秒 (按返回取消)")
-                    
-                    # 检查是否被用户取消
-                    if countdown_window.cancelled:
-                        player.cancel_skip = True
-                        notification("自动跳过片尾 已取消")
-                        # 清理窗口
-                        if countdown_thread and countdown_thread.is_alive():
-                            countdown_thread.join()
-                        countdown_window = None
-                        countdown_thread = None
-                        countdown_active = False
-                        continue
-
-                    # 倒计时结束，触发跳过
-                    if countdown_remaining <= 0:
-                        player.outro_triggered = True
-                        log("Countdown finished. Auto skipping outro -> Next episode")
-                        # notification("自动跳过片尾")
-                        # 关闭窗口
-                        if countdown_window:
-                            countdown_window.close()
-                            if countdown_thread and countdown_thread.is_alive():
-                                countdown_thread.join()
-                            countdown_window = None
-                            countdown_thread = None
-                            
-                        xbmc.executebuiltin("PlayerControl(Next)")
-                        countdown_active = False
-
-            except Exception as e:
-                log(f"Error checking outro: {e}")
-                log(traceback.format_exc())
-                # 出错时清理窗口
-                if countdown_window:
-                    countdown_window.close()
-                    countdown_window = None
-                countdown_active = False
-        else:
-            # 不满足跳过条件（如暂停、停止、已跳过、已取消），清理窗口
-            if countdown_window:
-                countdown_window.close()
-                if countdown_thread: countdown_thread.join()
-                countdown_window = None
-                countdown_thread = None
-            countdown_active = False
-        
-        if monitor.waitForAbort(0.3):
+        # 0. 定期全量校正进度聚合和筛选索引（首次启动时立即执行）
+        if progress_store.needs_reconcile():
+            progress_store.start_reconcile()
+        if facet_store.needs_reconcile():
+            facet_store.start_reconcile()
+        # 后台预先解析变化后的 keymap，筛选窗口打开时直接使用缓存
+        if time.time() - last_keymap_check >= keymap_cache.KEYMAP_REFRESH_INTERVAL:
+            last_keymap_check = time.time()
+            threading.Thread(target=keymap_cache.refresh, daemon=True).start()
+
+        # 1. 检测皮肤切换（风格设置的变更由 ServiceMonitor.onSettingsChanged 处理）
+        if time.time() - last_skin_check >= SKIN_CHECK_INTERVAL:
+            last_skin_check = time.time()
+            current_skin = xbmc.getSkinDir()
+            if current_skin != last_skin:
+                log(f"Skin changed from {last_skin} to {current_skin}. Re-initializing properties.")
+                last_skin = current_skin
+                init_skin_properties()
+
+        # 2. 等到下一项检查到期（Kodi 没有皮肤切换和 keymap 文件变化的通知，只能定期检查）
+        next_check = min(
+            last_skin_check + SKIN_CHECK_INTERVAL,
+            last_keymap_check + keymap_cache.KEYMAP_REFRESH_INTERVAL,
+            progress_store.last_reconcile + RECONCILE_INTERVAL,
+            facet_store.last_reconcile + FACET_RECONCILE_INTERVAL,
+        )
+        if monitor.waitForAbort(max(MIN_IDLE_WAIT, next_check - time.time())):
             break
+
+    player.shutdown()
+    xbmcgui.Window(10000).clearProperty(READY_PROPERTY)
+    xbmcgui.Window(10000).clearProperty(FACET_READY_PROPERTY)